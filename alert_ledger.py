@@ -0,0 +1,99 @@
+import time
+from datetime import date, timedelta
+from database import get_db_connection
+from logger import logger
+
+# Ids per IN (...) lookup, well below SQLite's bound-parameter limit
+LOOKUP_CHUNK = 500
+
+
+def current_tier(expiry, tiers, today):
+    # The tightest tier the item has reached, or None if it is outside all of them
+    days_left = (date.fromisoformat(expiry) - today).days
+    reached = [tier for tier in tiers if days_left <= tier]
+    return min(reached) if reached else None
+
+
+def tiered(kind, rows, tiers, today):
+    # (row, current tier) for rows (id, name, expiry, alert_email). A row whose
+    # expiry isn't a date is logged and left out instead of failing the run
+    # for everyone else.
+    items, invalid = [], []
+    for row in rows:
+        try:
+            items.append((row, current_tier(row[2], tiers, today)))
+        except (TypeError, ValueError):
+            invalid.append(row[0])
+    if invalid:
+        logger.error("%s %s with an invalid expiry date were not alerted (ids %s)", len(invalid), kind,
+                     ", ".join(map(str, invalid[:20])) + (" ..." if len(invalid) > 20 else ""))
+    return items
+
+
+def pending_condition(kind, expiry_column, tiers, today):
+    """SQL condition (table alias `t`) and params matching items inside the
+    outermost tier that have not yet been alerted for their current tier and
+    expiry date. Items already alerted for that state are skipped entirely."""
+    tiers = sorted(set(tiers))
+    column = f"t.{expiry_column}"
+    cases = " ".join(f"WHEN {column} <= ? THEN {int(tier)}" for tier in tiers[:-1])
+    tier_sql = f"CASE {cases} ELSE {int(tiers[-1])} END" if cases else str(int(tiers[-1]))
+    sql = (
+        f"{column} BETWEEN ? AND ? AND NOT EXISTS ("
+        "SELECT 1 FROM alert_state s "
+        f"WHERE s.kind = ? AND s.item_id = t.id AND s.expiry = {column} AND s.tier <= {tier_sql})"
+    )
+    params = (
+        today.isoformat(), (today + timedelta(days=tiers[-1])).isoformat(), kind,
+        *[(today + timedelta(days=tier)).isoformat() for tier in tiers[:-1]],
+    )
+    return sql, params
+
+
+def filter_pending(kind, rows, tiers, today):
+    # rows: (id, name, expiry, alert_email) already inside the outermost tier.
+    # Same test as pending_condition, for rows that come from the expiry index.
+    # Only these rows' ledger entries are read, not the whole ledger.
+    items = [(row, tier) for row, tier in tiered(kind, rows, tiers, today) if tier is not None]
+    if not items:
+        return []
+    ids = [row[0] for row, _ in items]
+    sent = {}
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        for start in range(0, len(ids), LOOKUP_CHUNK):
+            chunk = ids[start:start + LOOKUP_CHUNK]
+            cursor.execute(
+                f"SELECT item_id, expiry, tier FROM alert_state WHERE kind = ? "
+                f"AND item_id IN ({', '.join('?' * len(chunk))})",
+                (kind, *chunk)
+            )
+            sent.update((item_id, (expiry, tier)) for item_id, expiry, tier in cursor.fetchall())
+    finally:
+        conn.close()
+    pending = []
+    for row, tier in items:
+        state = sent.get(row[0])
+        if state is None or state[0] != row[2] or state[1] > tier:
+            pending.append(row)
+    return pending
+
+
+def record(conn, kind, items):
+    # items: (item_id, expiry, tier); runs in the caller's transaction
+    now = time.time()
+    conn.executemany(
+        "INSERT INTO alert_state (kind, item_id, expiry, tier, sent_at) VALUES (?, ?, ?, ?, ?) "
+        "ON CONFLICT (kind, item_id) DO UPDATE SET expiry = excluded.expiry, tier = excluded.tier, "
+        "sent_at = excluded.sent_at",
+        [(kind, item_id, expiry, tier, now) for item_id, expiry, tier in items]
+    )
+
+
+def purge(conn, kind, table):
+    # Forget items that were deleted since they were alerted
+    conn.execute(
+        f"DELETE FROM alert_state WHERE kind = ? AND NOT EXISTS (SELECT 1 FROM {table} t WHERE t.id = item_id)",
+        (kind,)
+    )
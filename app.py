@@ -1,21 +1,46 @@
 from flask import Flask
-from database import init_db
-from scheduler import start_scheduler
-from routes.services import service_bp
-from routes.licenses import license_bp
-from routes.auth_routes import auth_bp
 from config import (
-    SERVER_PORT
+    SERVER_PORT,
+    METRICS_ENABLED
 )
-app = Flask(__name__)
-init_db()
 
 
-app.register_blueprint(service_bp, url_prefix='/services')
-app.register_blueprint(license_bp, url_prefix='/licenses')
-app.register_blueprint(auth_bp, url_prefix='/auth')
+def create_app():
+    # Blueprints are imported here so importing this module stays cheap
+    from database import init_db
+    from routes.services import service_bp
+    from routes.licenses import license_bp
+    from routes.auth_routes import auth_bp
+    from routes.expiring import expiring_bp
+    from routes.profiling import profiling_bp
+    from expiry_index import expiry_index
+    import metrics
+    import profiling
+
+    app = Flask(__name__)
+    # Only reads PRAGMA user_version unless a migration is actually pending
+    init_db()
+    expiry_index.refresh()
+
+    app.register_blueprint(service_bp, url_prefix='/services')
+    app.register_blueprint(license_bp, url_prefix='/licenses')
+    app.register_blueprint(auth_bp, url_prefix='/auth')
+    app.register_blueprint(expiring_bp)
+    app.register_blueprint(profiling_bp, url_prefix='/admin/profiles')
+    profiling.init_app(app)
+    if METRICS_ENABLED:
+        import mail_queue  # noqa: F401 - registers the outbox depth gauge
+        metrics.init_app(app)
+    return app
+
 
 if __name__ == "__main__":
-    start_scheduler()
+    from leader import run_scheduler_when_leader
+    from config import METRICS_DIR
+    from metrics import MetricsStore
+    if METRICS_DIR:
+        MetricsStore.clear(METRICS_DIR)
+    app = create_app()
+    run_scheduler_when_leader()
     port=SERVER_PORT
     app.run(debug=True, port=port)
@@ -1,9 +1,97 @@
 import jwt
 import bcrypt
+import hashlib
+import threading
+import time
+from collections import OrderedDict
 from flask import request, jsonify
 from functools import wraps
-from config import JWT_SECRET
+from config import JWT_SECRET, AUTH_TOKEN_CACHE_SIZE, AUTH_DENYLIST_REFRESH_SECONDS
+from database import get_db_connection
 from datetime import datetime, timedelta
+from logger import logger
+
+
+class TokenCache:
+    # Verified tokens keyed by their SHA-256 digest, so repeat requests skip the
+    # HMAC check and claim parsing. Entries are dropped at the token's exp.
+
+    def __init__(self, max_entries=AUTH_TOKEN_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, digest):
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is None:
+                return None
+            if entry["exp"] <= time.time():
+                del self._entries[digest]
+                return None
+            self._entries.move_to_end(digest)
+            return entry
+
+    def put(self, digest, claims):
+        with self._lock:
+            self._entries[digest] = claims
+            self._entries.move_to_end(digest)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class Denylist:
+    # In-memory copy of disabled users and per-user token cut-offs from the
+    # users table, re-read at most every `refresh_seconds`.
+
+    def __init__(self, refresh_seconds=AUTH_DENYLIST_REFRESH_SECONDS):
+        self.refresh_seconds = refresh_seconds
+        self._disabled = set()
+        self._not_before = {}
+        self._loaded_at = 0
+        self._lock = threading.Lock()
+
+    def _refresh(self):
+        if time.monotonic() - self._loaded_at < self.refresh_seconds:
+            return
+        # Only one request pays for the refresh; others keep using the current copy
+        if not self._lock.acquire(blocking=False):
+            return
+        try:
+            conn = get_db_connection()
+            try:
+                cursor = conn.cursor()
+                cursor.execute(
+                    "SELECT username, disabled, tokens_not_before FROM users "
+                    "WHERE disabled = 1 OR tokens_not_before IS NOT NULL"
+                )
+                rows = cursor.fetchall()
+            finally:
+                conn.close()
+            self._disabled = {username for username, disabled, _ in rows if disabled}
+            self._not_before = {username: cutoff for username, _, cutoff in rows if cutoff is not None}
+            self._loaded_at = time.monotonic()
+        except Exception as e:
+            logger.error("Token denylist refresh failed: %s", e)
+        finally:
+            self._lock.release()
+
+    def is_revoked(self, claims):
+        self._refresh()
+        user = claims["user"]
+        if user in self._disabled:
+            return True
+        cutoff = self._not_before.get(user)
+        return cutoff is not None and claims.get("iat", 0) < cutoff
+
+
+token_cache = TokenCache()
+denylist = Denylist()
+
 
 def token_required(f):
     @wraps(f)
@@ -11,19 +99,31 @@ def token_required(f):
         token = request.headers.get('Authorization', '').replace('Bearer ', '')
         if not token:
             return jsonify({"error": "Missing token"}), 401
-        try:
-            decoded = jwt.decode(token, JWT_SECRET, algorithms=["HS256"])
-            request.user = decoded['user']
-        except jwt.ExpiredSignatureError:
-            return jsonify({"error": "Token expired"}), 401
-        except jwt.InvalidTokenError:
-            return jsonify({"error": "Invalid token"}), 401
+
+        digest = hashlib.sha256(token.encode('utf-8')).digest()
+        claims = token_cache.get(digest)
+        if claims is None:
+            try:
+                claims = jwt.decode(token, JWT_SECRET, algorithms=["HS256"], options={"require": ["exp"]})
+            except jwt.ExpiredSignatureError:
+                return jsonify({"error": "Token expired"}), 401
+            except jwt.InvalidTokenError:
+                return jsonify({"error": "Invalid token"}), 401
+            if 'user' not in claims:
+                return jsonify({"error": "Invalid token"}), 401
+            token_cache.put(digest, claims)
+
+        if denylist.is_revoked(claims):
+            return jsonify({"error": "Token revoked"}), 401
+        request.user = claims['user']
         return f(*args, **kwargs)
     return decorated
 
 def generate_token(username):
+    now = datetime.utcnow()
     payload = {
         "user": username,
-        "exp": datetime.utcnow() + timedelta(hours=24)
+        "iat": now,
+        "exp": now + timedelta(hours=24)
     }
     return jwt.encode(payload, JWT_SECRET, algorithm="HS256")
@@ -0,0 +1,213 @@
+"""Local stand-ins for the outside world: TLS endpoints and an SMTP relay.
+
+Both run in child processes so their work does not compete with the code
+under measurement for the GIL.
+"""
+import asyncio
+import multiprocessing
+import os
+import socket
+import ssl
+import subprocess
+
+# Listener behaviours. "slow" completes the handshake after a delay, "hang"
+# accepts the TCP connection and never answers, "fail" answers with garbage.
+LISTENER_KINDS = ("ok", "slow", "hang", "fail")
+
+_context = multiprocessing.get_context("spawn")
+
+
+def make_certificates(directory, days=30):
+    # A throwaway CA plus a localhost leaf signed by it, via the openssl CLI
+    ca_key = os.path.join(directory, "ca.key")
+    ca_cert = os.path.join(directory, "ca.pem")
+    key = os.path.join(directory, "server.key")
+    csr = os.path.join(directory, "server.csr")
+    cert = os.path.join(directory, "server.pem")
+    ext = os.path.join(directory, "server.ext")
+    with open(ext, "w") as f:
+        f.write("subjectAltName=DNS:localhost,IP:127.0.0.1\n")
+
+    def openssl(*args):
+        subprocess.run(["openssl", *args], check=True, capture_output=True)
+
+    openssl("req", "-x509", "-newkey", "rsa:2048", "-nodes", "-keyout", ca_key, "-out", ca_cert,
+            "-days", "3650", "-subj", "/CN=ExpiryWatch Benchmark CA")
+    openssl("req", "-newkey", "rsa:2048", "-nodes", "-keyout", key, "-out", csr, "-subj", "/CN=localhost")
+    openssl("x509", "-req", "-in", csr, "-CA", ca_cert, "-CAkey", ca_key, "-CAcreateserial",
+            "-out", cert, "-days", str(days), "-extfile", ext)
+    return ca_cert, cert, key
+
+
+async def _serve_plain(kind, reader, writer):
+    # "hang" and "fail" never speak TLS
+    try:
+        if kind == "fail":
+            writer.write(b"HTTP/1.0 400 Not TLS\r\n\r\n")
+            await writer.drain()
+            return
+        await reader.read()
+    except (ConnectionError, OSError):
+        pass
+    finally:
+        writer.close()
+
+
+async def _serve_tls(reader, writer):
+    try:
+        await reader.read()
+    except (ConnectionError, ssl.SSLError, OSError):
+        pass
+    finally:
+        writer.close()
+
+
+async def _serve_slow(listen_sock, context, delay):
+    # Sleeps between accept() and the server side of the handshake. The
+    # client's ClientHello waits in the kernel's socket buffer meanwhile, so
+    # the handshake completes once the delay is over.
+    loop = asyncio.get_running_loop()
+
+    async def handshake(sock):
+        await asyncio.sleep(delay)
+        try:
+            await loop.connect_accepted_socket(asyncio.Protocol, sock, ssl=context)
+        except (ConnectionError, ssl.SSLError, OSError):
+            sock.close()
+
+    while True:
+        sock, _ = await loop.sock_accept(listen_sock)
+        loop.create_task(handshake(sock))
+
+
+async def _run_listeners(specs, cert, key, delay, ready):
+    context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    context.load_cert_chain(cert, key)
+    ports = []
+    tasks = []
+    for kind in specs:
+        if kind == "slow":
+            listen_sock = socket.create_server(("127.0.0.1", 0), backlog=1024)
+            listen_sock.setblocking(False)
+            tasks.append(asyncio.create_task(_serve_slow(listen_sock, context, delay)))
+            ports.append(listen_sock.getsockname()[1])
+            continue
+        if kind == "ok":
+            server = await asyncio.start_server(_serve_tls, "127.0.0.1", 0, ssl=context, backlog=1024)
+        else:
+            server = await asyncio.start_server(
+                lambda r, w, kind=kind: _serve_plain(kind, r, w), "127.0.0.1", 0, backlog=1024
+            )
+        ports.append(server.sockets[0].getsockname()[1])
+    ready.send(ports)
+    await asyncio.Event().wait()
+
+
+def _listeners_main(specs, cert, key, delay, ready):
+    asyncio.run(_run_listeners(specs, cert, key, delay, ready))
+
+
+class _SmtpSink:
+    # Just enough of RFC 5321 for smtplib: every message is accepted and counted
+
+    def __init__(self, delay, counter):
+        self.delay = delay
+        self.counter = counter
+
+    async def handle(self, reader, writer):
+        writer.write(b"220 benchmark sink\r\n")
+        in_data = False
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    return
+                if in_data:
+                    if line == b".\r\n":
+                        in_data = False
+                        if self.delay:
+                            await asyncio.sleep(self.delay)
+                        with self.counter.get_lock():
+                            self.counter.value += 1
+                        writer.write(b"250 queued\r\n")
+                    continue
+                command = line[:4].upper()
+                if command == b"EHLO":
+                    writer.write(b"250-benchmark sink\r\n250 8BITMIME\r\n")
+                elif command == b"DATA":
+                    in_data = True
+                    writer.write(b"354 end with .\r\n")
+                elif command == b"QUIT":
+                    writer.write(b"221 bye\r\n")
+                    return
+                else:
+                    writer.write(b"250 ok\r\n")
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+
+async def _run_smtp(delay, counter, ready):
+    server = await asyncio.start_server(_SmtpSink(delay, counter).handle, "127.0.0.1", 0, backlog=1024)
+    ready.send(server.sockets[0].getsockname()[1])
+    await asyncio.Event().wait()
+
+
+def _smtp_main(delay, counter, ready):
+    asyncio.run(_run_smtp(delay, counter, ready))
+
+
+def _start(target, *args):
+    receiver, sender = _context.Pipe(duplex=False)
+    process = _context.Process(target=target, args=(*args, sender), daemon=True)
+    process.start()
+    if not receiver.poll(30):
+        process.terminate()
+        raise RuntimeError(f"{target.__name__} did not start")
+    return process, receiver.recv()
+
+
+class TlsListeners:
+    """`counts` maps a LISTENER_KINDS entry to how many ports of that kind to open."""
+
+    def __init__(self, counts, cert, key, slow_delay=1.0):
+        self.specs = [kind for kind in LISTENER_KINDS for _ in range(counts.get(kind, 0))]
+        self.cert = cert
+        self.key = key
+        self.slow_delay = slow_delay
+        self.process = None
+        self.ports = []
+
+    def __enter__(self):
+        self.process, self.ports = _start(_listeners_main, self.specs, self.cert, self.key, self.slow_delay)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.process.terminate()
+        self.process.join()
+
+    def urls(self):
+        # (kind, base url) per listener
+        return [(kind, f"https://localhost:{port}") for kind, port in zip(self.specs, self.ports)]
+
+
+class SmtpSink:
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.process = None
+        self.port = None
+        self._received = _context.Value("i", 0)
+
+    def __enter__(self):
+        self.process, self.port = _start(_smtp_main, self.delay, self._received)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.process.terminate()
+        self.process.join()
+
+    @property
+    def received(self):
+        return self._received.value
@@ -0,0 +1,341 @@
+"""Reproducible performance benchmarks against local stand-ins.
+
+    python -m benchmarks.run --services 2000 --licenses 2000 --output results.json
+
+Everything runs in a scratch directory (its own monitor.db and logs/), TLS
+endpoints and the SMTP relay are local child processes, and the results are a
+single JSON document so two runs can be diffed or compared by a script.
+"""
+import argparse
+import http.client
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+
+from benchmarks.fixtures import LISTENER_KINDS, SmtpSink, TlsListeners, make_certificates
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCENARIOS = ("scan", "alerts", "api")
+
+
+def _percentiles(samples):
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+
+    def rank(p):
+        return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))]
+
+    return {
+        "min": ordered[0],
+        "p50": rank(50),
+        "p90": rank(90),
+        "p99": rank(99),
+        "max": ordered[-1],
+        "mean": sum(ordered) / len(ordered),
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPO_ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _parse_listeners(spec):
+    counts = {}
+    for part in spec.split(","):
+        kind, _, count = part.partition("=")
+        if kind not in LISTENER_KINDS:
+            raise argparse.ArgumentTypeError(f"unknown listener kind: {kind}")
+        counts[kind] = int(count)
+    return counts
+
+
+def _prepare_workdir(workdir, log_level):
+    # The app resolves monitor.db and logs/ against the working directory
+    os.chdir(workdir)
+    if REPO_ROOT not in sys.path:
+        sys.path.insert(0, REPO_ROOT)
+    from logger import logger
+    logger.setLevel(log_level)
+    logging.getLogger("werkzeug").setLevel(log_level)
+
+
+def seed(services, licenses, urls, expiring_fraction, rng):
+    from database import init_db, BatchWriter
+    from config import CERT_ALERT_DAYS_BEFORE, LICENSE_ALERT_DAYS_BEFORE
+
+    init_db()
+    today = date.today()
+
+    def expiry(window):
+        if rng.random() < expiring_fraction:
+            return (today + timedelta(days=rng.randint(0, window))).isoformat()
+        return (today + timedelta(days=rng.randint(window + 1, 400))).isoformat()
+
+    with BatchWriter("INSERT INTO services (name, url, alert_email, certificate_expiry) VALUES (?, ?, ?, ?)") as writer:
+        for i in range(services):
+            _, base = urls[i % len(urls)]
+            writer.add((f"bench-service-{i}", f"{base}/svc/{i}", f"ops{i % 50}@bench.test",
+                        expiry(CERT_ALERT_DAYS_BEFORE)))
+    with BatchWriter("INSERT INTO licenses (name, expiry_date, alert_email) VALUES (?, ?, ?)") as writer:
+        for i in range(licenses):
+            writer.add((f"bench-license-{i}", expiry(LICENSE_ALERT_DAYS_BEFORE), f"legal{i % 50}@bench.test"))
+
+
+def bench_scan(use_cache):
+    import certificate_utils
+    from database import get_db_connection
+    from scheduler import check_cert_expiry
+
+    certificate_utils.probe_cache.clear()
+    if not use_cache:
+        certificate_utils.probe_cache.ttl = 0
+
+    started = time.perf_counter()
+    check_cert_expiry()
+    elapsed = time.perf_counter() - started
+
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT COUNT(*), SUM(last_error IS NULL) FROM services")
+    total, ok = cursor.fetchone()
+    cursor.execute("SELECT handshake_ms FROM services WHERE last_error IS NULL AND handshake_ms IS NOT NULL")
+    handshakes = [row[0] for row in cursor.fetchall()]
+    conn.close()
+    return {
+        "seconds": elapsed,
+        "services": total,
+        "services_per_second": total / elapsed if elapsed else None,
+        "ok": ok or 0,
+        "failed": total - (ok or 0),
+        "handshake_ms": _percentiles(handshakes),
+    }
+
+
+def bench_alerts(smtp_delay, workers, timeout):
+    from database import get_db_connection
+    from email_utils import Mailer
+    from mail_queue import DeliveryWorkers, queue_stats
+    from scheduler import send_alerts
+
+    conn = get_db_connection()
+    with conn:
+        conn.execute("DELETE FROM outbox")
+
+    with SmtpSink(delay=smtp_delay) as sink:
+        started = time.perf_counter()
+        send_alerts()
+        enqueued = time.perf_counter()
+        queued = queue_stats()["pending"]
+
+        delivery = DeliveryWorkers(
+            workers=workers,
+            mailer_factory=lambda: Mailer(host="127.0.0.1", port=sink.port, use_ssl=False,
+                                          starttls=False, password=None)
+        )
+        delivery.start()
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            stats = queue_stats()
+            if stats["pending"] + stats["sending"] == 0:
+                break
+            time.sleep(0.05)
+        finished = time.perf_counter()
+        delivery.stop(timeout=5)
+        stats = queue_stats()
+        received = sink.received
+
+    return {
+        "queued": queued,
+        "enqueue_seconds": enqueued - started,
+        "delivery_seconds": finished - enqueued,
+        "end_to_end_seconds": finished - started,
+        "messages_per_second": stats["sent"] / (finished - enqueued) if finished > enqueued else None,
+        "sent": stats["sent"],
+        "dead": stats["dead"],
+        "undelivered": stats["pending"] + stats["sending"],
+        "sink_received": received,
+    }
+
+
+def _serve_api(workdir, ca_file, log_level, ready):
+    _prepare_workdir(workdir, log_level)
+    from werkzeug.serving import make_server
+    import certificate_utils
+    import app
+
+    certificate_utils.PROBE_CA_FILE = ca_file
+    server = make_server("127.0.0.1", 0, app.create_app(), threaded=True)
+    ready.send(server.server_port)
+    server.serve_forever()
+
+
+def _request(port, method, path, body=None, token=None):
+    headers = {"Content-Type": "application/json"}
+    if token:
+        headers["Authorization"] = f"Bearer {token}"
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+    try:
+        started = time.perf_counter()
+        conn.request(method, path, body=json.dumps(body) if body is not None else None, headers=headers)
+        response = conn.getresponse()
+        payload = response.read()
+        return response.status, time.perf_counter() - started, payload
+    finally:
+        conn.close()
+
+
+def _load(port, requests, concurrency, make_request):
+    def one(i):
+        method, path, body, token = make_request(i)
+        status, elapsed, _ = _request(port, method, path, body, token)
+        return status, elapsed
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(one, range(requests)))
+    elapsed = time.perf_counter() - started
+
+    statuses = {}
+    for status, _ in results:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "seconds": elapsed,
+        "requests_per_second": requests / elapsed if elapsed else None,
+        "statuses": statuses,
+        "latency_seconds": _percentiles([latency for _, latency in results]),
+    }
+
+
+def bench_api(workdir, ca_file, log_level, requests, concurrency, ok_url):
+    # A separate process, so client threads and server threads don't share a GIL
+    context = multiprocessing.get_context("spawn")
+    receiver, sender = context.Pipe(duplex=False)
+    server = context.Process(target=_serve_api, args=(workdir, ca_file, log_level, sender), daemon=True)
+    server.start()
+    try:
+        if not receiver.poll(60):
+            raise RuntimeError("API server did not start")
+        port = receiver.recv()
+
+        credentials = {"username": "bench", "password": "bench-password"}
+        _request(port, "POST", "/auth/register", credentials)
+        status, _, payload = _request(port, "POST", "/auth/login", credentials)
+        if status != 200:
+            raise RuntimeError(f"Login failed with HTTP {status}: {payload!r}")
+        token = json.loads(payload)["token"]
+
+        run_id = int(time.time())
+        return {
+            "server": "werkzeug threaded",
+            "list": _load(port, requests, concurrency,
+                          lambda i: ("GET", "/services/list?limit=100", None, token)),
+            "add": _load(port, requests, concurrency,
+                         lambda i: ("POST", "/services/add", {
+                             "name": f"bench-added-{run_id}-{i}",
+                             "url": f"{ok_url}/added/{run_id}/{i}",
+                             "alert_email": "ops@bench.test",
+                         }, token)),
+        }
+    finally:
+        server.terminate()
+        server.join()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="ExpiryWatch benchmarks against local TLS and SMTP stand-ins")
+    parser.add_argument("--services", type=int, default=1000)
+    parser.add_argument("--licenses", type=int, default=1000)
+    parser.add_argument("--expiring-fraction", type=float, default=0.2,
+                        help="share of rows that fall inside the alert window")
+    parser.add_argument("--listeners", type=_parse_listeners, default="ok=20,slow=2,hang=1,fail=1",
+                        help="listener counts per kind, e.g. ok=20,slow=2,hang=1,fail=1")
+    parser.add_argument("--slow-delay", type=float, default=1.0, help="seconds before a slow listener handshakes")
+    parser.add_argument("--smtp-delay", type=float, default=0.0, help="seconds the SMTP sink takes per message")
+    parser.add_argument("--delivery-workers", type=int, default=4)
+    parser.add_argument("--delivery-timeout", type=float, default=600)
+    parser.add_argument("--api-requests", type=int, default=500)
+    parser.add_argument("--api-concurrency", type=int, default=16)
+    parser.add_argument("--no-probe-cache", action="store_true",
+                        help="probe every service instead of once per listener")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--workdir", help="scratch directory (default: a new temporary directory)")
+    parser.add_argument("--log-level", default="WARNING")
+    parser.add_argument("--output", help="write JSON here instead of stdout")
+    args = parser.parse_args(argv)
+
+    scenarios = [s for s in args.scenarios.split(",") if s]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    output = os.path.abspath(args.output) if args.output else None
+    workdir = os.path.abspath(args.workdir or tempfile.mkdtemp(prefix="expirywatch-bench-"))
+    os.makedirs(workdir, exist_ok=True)
+    ca_file, cert, key = make_certificates(workdir)
+
+    _prepare_workdir(workdir, args.log_level)
+    import certificate_utils
+    import config
+    certificate_utils.PROBE_CA_FILE = ca_file
+
+    report = {
+        "benchmark": "expirywatch",
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "git_commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "workdir": workdir,
+        "parameters": {key: value for key, value in vars(args).items() if key not in ("output", "workdir")},
+        "config": {name: getattr(config, name) for name in (
+            "SCAN_MAX_IN_FLIGHT", "SCAN_PROBE_TIMEOUT", "PROBE_CACHE_TTL", "ALERT_DIGEST_MODE",
+            "CERT_ALERT_DAYS_BEFORE", "LICENSE_ALERT_DAYS_BEFORE", "DB_WRITE_BATCH_SIZE", "BCRYPT_ROUNDS",
+        )},
+        "results": {},
+    }
+
+    with TlsListeners(args.listeners, cert, key, slow_delay=args.slow_delay) as listeners:
+        urls = listeners.urls()
+        if not urls:
+            parser.error("at least one listener is required")
+        started = time.perf_counter()
+        seed(args.services, args.licenses, urls, args.expiring_fraction, random.Random(args.seed))
+        report["results"]["seed_seconds"] = time.perf_counter() - started
+
+        if "scan" in scenarios:
+            report["results"]["scan"] = bench_scan(use_cache=not args.no_probe_cache)
+        if "alerts" in scenarios:
+            report["results"]["alerts"] = bench_alerts(args.smtp_delay, args.delivery_workers,
+                                                       args.delivery_timeout)
+        if "api" in scenarios:
+            ok_url = next((url for kind, url in urls if kind == "ok"), urls[0][1])
+            report["results"]["api"] = bench_api(workdir, ca_file, args.log_level, args.api_requests,
+                                                 args.api_concurrency, ok_url)
+
+    text = json.dumps(report, indent=2, default=str)
+    if output:
+        with open(output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
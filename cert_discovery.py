@@ -0,0 +1,176 @@
+"""Incremental discovery of certificates stored as files.
+
+    python -m cert_discovery /etc/ssl/internal /srv/staged-certs --alert-email ops@example.com
+
+Every certificate found becomes a service whose URL is
+`file://<quoted path>#<index in file>`, so scans, alerts, /expiring and the
+list API treat it like a probed host. cert_files remembers each file's
+mtime, size and hash: unchanged files are skipped on the stat alone, and a
+touched file whose content hash is unchanged is not re-parsed.
+"""
+import argparse
+import multiprocessing
+import os
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from urllib.parse import quote
+from database import get_db_connection, init_db
+from expiry_index import expiry_index
+from local_certs import parse_file
+from config import (
+    CERT_DISCOVERY_DIRS,
+    CERT_DISCOVERY_SUFFIXES,
+    CERT_DISCOVERY_ALERT_EMAIL,
+    CERT_DISCOVERY_WORKERS,
+    CERT_DISCOVERY_POOL_MIN,
+    DB_WRITE_BATCH_SIZE
+)
+from logger import logger
+
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def file_url(path, index):
+    return f"file://{quote(path)}#{index}"
+
+
+def _walk(directory, suffixes):
+    # (path, stat) for matching files under `directory`; symlinked dirs are not followed
+    try:
+        entries = list(os.scandir(directory))
+    except OSError as e:
+        logger.warning("Certificate discovery cannot read %s: %s", directory, e)
+        return
+    for entry in entries:
+        try:
+            if entry.is_dir(follow_symlinks=False):
+                yield from _walk(entry.path, suffixes)
+            elif entry.name.lower().endswith(suffixes) and entry.is_file():
+                yield entry.path, entry.stat()
+        except OSError:
+            continue
+
+
+def _parse_all(paths, digests, workers):
+    if len(paths) < CERT_DISCOVERY_POOL_MIN or workers == 1:
+        return map(parse_file, paths, digests)
+    # spawn: the parent has scheduler and database threads that must not be forked
+    executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+    chunksize = max(1, min(256, len(paths) // ((workers or os.cpu_count() or 1) * 4)))
+
+    def results():
+        with executor:
+            yield from executor.map(parse_file, paths, digests, chunksize=chunksize)
+
+    return results()
+
+
+def _replace_services(cursor, path, certs, alert_email, checked_at):
+    prefix = file_url(path, "")
+    for index, (common_name, not_after) in enumerate(certs):
+        cursor.execute(
+            "INSERT INTO services (name, url, alert_email, certificate_expiry, last_checked) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT (url) DO UPDATE SET name = excluded.name, certificate_expiry = excluded.certificate_expiry, "
+            "last_checked = excluded.last_checked, last_error = NULL, error_class = NULL, next_retry_at = NULL, "
+            "consecutive_failures = 0",
+            (f"{common_name or 'certificate'} [{path}#{index}]", file_url(path, index), alert_email,
+             not_after.strftime("%Y-%m-%d"), checked_at)
+        )
+    # Certificates that disappeared from the bundle; '~' sorts after every digit
+    cursor.execute(
+        "DELETE FROM services WHERE url BETWEEN ? AND ? AND CAST(substr(url, ?) AS INTEGER) >= ?",
+        (prefix, prefix + "~", len(prefix) + 1, len(certs))
+    )
+
+
+def discover(directories=None, alert_email=CERT_DISCOVERY_ALERT_EMAIL, workers=CERT_DISCOVERY_WORKERS):
+    directories = CERT_DISCOVERY_DIRS if directories is None else directories
+    if not alert_email:
+        # Discovered certificates would expire without anyone being told
+        raise ValueError("Certificate discovery needs an alert address (CERT_DISCOVERY_ALERT_EMAIL)")
+    started = time.monotonic()
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT path, mtime_ns, size, sha256 FROM cert_files")
+    known = {path: (mtime_ns, size, sha256) for path, mtime_ns, size, sha256 in cursor.fetchall()}
+
+    seen = set()
+    changed = {}
+    suffixes = tuple(suffix.lower() for suffix in CERT_DISCOVERY_SUFFIXES)
+    for directory in directories:
+        for path, stat in _walk(os.path.abspath(directory), suffixes):
+            seen.add(path)
+            previous = known.get(path)
+            if previous is None or previous[:2] != (stat.st_mtime_ns, stat.st_size):
+                changed[path] = stat
+
+    stats = {"files": len(seen), "changed": 0, "touched": 0, "removed": 0, "certificates": 0, "errors": 0}
+    now = time.time()
+    checked_at = datetime.utcnow().strftime(TIMESTAMP_FORMAT)
+    try:
+        paths = list(changed)
+        # A file whose hash is unchanged is only hashed, not parsed
+        digests = [known[path][2] if path in known else None for path in paths]
+        for path, digest, certs, error in _parse_all(paths, digests, workers):
+            stat = changed[path]
+            if certs is None:
+                # Touched but identical: remember the new mtime, keep the services as they are
+                stats["touched"] += 1
+                cursor.execute("UPDATE cert_files SET mtime_ns = ?, size = ? WHERE path = ?",
+                               (stat.st_mtime_ns, stat.st_size, path))
+                continue
+            stats["changed"] += 1
+            if error:
+                # Keep the last known certificates of a file we can't read right now
+                stats["errors"] += 1
+                logger.warning("Cannot parse certificate file %s: %s", path, error)
+            else:
+                stats["certificates"] += len(certs)
+                try:
+                    _replace_services(cursor, path, certs, alert_email, checked_at)
+                except sqlite3.IntegrityError as e:
+                    # A hand-made service already uses one of the generated names
+                    stats["errors"] += 1
+                    error = f"Cannot record certificates: {e}"
+                    logger.warning("Certificate file %s: %s", path, error)
+            cursor.execute(
+                "INSERT OR REPLACE INTO cert_files (path, mtime_ns, size, sha256, cert_count, error, parsed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (path, stat.st_mtime_ns, stat.st_size, None if error else digest, len(certs), error, now)
+            )
+            if stats["changed"] % DB_WRITE_BATCH_SIZE == 0:
+                # Don't hold the write lock for a whole first scan of a large tree
+                conn.commit()
+
+        scanned = [os.path.abspath(directory) + os.sep for directory in directories]
+        for path in known:
+            if path not in seen and any(path.startswith(root) for root in scanned):
+                stats["removed"] += 1
+                _replace_services(cursor, path, [], alert_email, checked_at)
+                cursor.execute("DELETE FROM cert_files WHERE path = ?", (path,))
+        conn.commit()
+    finally:
+        conn.close()
+
+    if stats["changed"] or stats["removed"]:
+        expiry_index.invalidate()
+    logger.info(
+        "Certificate discovery: %s files, %s parsed (%s certificates, %s errors), %s touched, %s removed in %.1fs",
+        stats["files"], stats["changed"], stats["certificates"], stats["errors"], stats["touched"],
+        stats["removed"], time.monotonic() - started
+    )
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="python -m cert_discovery", description="Record certificates found in files")
+    parser.add_argument("directories", nargs="*", help="directories to scan (default: CERT_DISCOVERY_DIRS)")
+    parser.add_argument("--alert-email", default=CERT_DISCOVERY_ALERT_EMAIL,
+                        help="alert address for discovered certificates (default: CERT_DISCOVERY_ALERT_EMAIL)")
+    args = parser.parse_args()
+    if not args.alert_email:
+        parser.error("an alert address is required: pass --alert-email or set CERT_DISCOVERY_ALERT_EMAIL")
+    init_db()
+    print(discover(args.directories or None, alert_email=args.alert_email))
@@ -1,18 +1,311 @@
+import random
 import ssl
 import socket
-from urllib.parse import urlparse
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout
+from urllib.parse import urlparse, unquote
 from datetime import datetime
+from database import get_db_connection
+from local_certs import file_expiry
+from metrics import PROBE_PHASE_SECONDS, PROBE_TOTAL
+from config import (
+    PROBE_CACHE_TTL,
+    PROBE_CACHE_MAX_ENTRIES,
+    PROBE_CACHE_PERSIST,
+    PROBE_CA_FILE,
+    PROBE_DNS_WORKERS,
+    PROBE_BREAKER_THRESHOLD,
+    PROBE_BACKOFF_BASE,
+    PROBE_BACKOFF_MAX,
+    PROBE_BREAKER_MAX_HOSTS
+)
 
-def get_cert_expiry(url):
+EXPIRY_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+class ProbeCache:
+    # Results are keyed by (hostname, port, sni): every URL on one host shares
+    # a single entry, and concurrent misses for that key share one handshake.
+
+    def __init__(self, ttl, max_entries, persist=False):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.persist = persist
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._loaded = not persist
+
+    def get(self, key, probe):
+        return self.lookup(key, probe)[0]
+
+    def lookup(self, key, probe):
+        # Returns (expiry, probed); probed is False when the result came from
+        # the cache or from another caller's in-flight handshake
+        self._load()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and time.time() - entry[1] < self.ttl:
+                self._entries.move_to_end(key)
+                return entry[0], False
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = self._inflight[key] = Future()
+
+        if not owner:
+            return future.result(), False
+
+        try:
+            expiry = probe()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            checked_at = time.time()
+            self._store(key, expiry, checked_at)
+            future.set_result(expiry)
+            if self.persist:
+                self._save(key, expiry, checked_at)
+            return expiry, True
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _store(self, key, expiry, checked_at):
+        with self._lock:
+            self._entries[key] = (expiry, checked_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _load(self):
+        if self._loaded:
+            return
+        with self._lock:
+            if self._loaded:
+                return
+            self._loaded = True
+        conn = get_db_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT hostname, port, sni, expiry, checked_at FROM probe_cache "
+                "WHERE checked_at > ? ORDER BY checked_at DESC LIMIT ?",
+                (time.time() - self.ttl, self.max_entries)
+            )
+            # Oldest first, so the newest entries end up most recently used
+            for hostname, port, sni, expiry, checked_at in reversed(cursor.fetchall()):
+                self._store((hostname, port, sni), datetime.strptime(expiry, EXPIRY_FORMAT), checked_at)
+        finally:
+            conn.close()
+
+    def _save(self, key, expiry, checked_at):
+        conn = get_db_connection()
+        try:
+            conn.execute(
+                "INSERT OR REPLACE INTO probe_cache (hostname, port, sni, expiry, checked_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (*key, expiry.strftime(EXPIRY_FORMAT), checked_at)
+            )
+            conn.commit()
+        finally:
+            conn.close()
+
+
+probe_cache = ProbeCache(PROBE_CACHE_TTL, PROBE_CACHE_MAX_ENTRIES, persist=PROBE_CACHE_PERSIST)
+
+
+def classify_error(error):
+    if isinstance(error, socket.gaierror):
+        return "dns"
+    if isinstance(error, (ssl.SSLError, ssl.CertificateError)):
+        return "tls"
+    if isinstance(error, TimeoutError):
+        return "timeout"
+    if isinstance(error, ConnectionRefusedError):
+        return "refused"
+    if isinstance(error, OSError):
+        return "network"
+    return "other"
+
+
+class ProbeFailure(Exception):
+    # A failed probe, with its error class and when the host may be probed
+    # again (epoch seconds, None while the breaker is still closed)
+
+    def __init__(self, message, error_class, retry_at=None):
+        super().__init__(message)
+        self.error_class = error_class
+        self.retry_at = retry_at
+
+
+class CircuitOpen(ProbeFailure):
+    pass
+
+
+class HostBreakers:
+    """Per (hostname, port) circuit breakers.
+
+    Consecutive failures are counted per host. Once `threshold` is reached
+    the breaker opens: probes fail immediately with CircuitOpen until the
+    retry time, which backs off exponentially from the error class's base.
+    After that a single trial probe is let through (the others keep failing
+    fast); success closes the breaker, failure reopens it for longer.
+    """
+
+    def __init__(self, threshold=PROBE_BREAKER_THRESHOLD, backoff_base=PROBE_BACKOFF_BASE,
+                 backoff_max=PROBE_BACKOFF_MAX, max_hosts=PROBE_BREAKER_MAX_HOSTS):
+        self.threshold = threshold
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_hosts = max_hosts
+        self._hosts = OrderedDict()
+        self._lock = threading.Lock()
+
+    def before(self, key):
+        with self._lock:
+            state = self._hosts.get(key)
+            if state is None or state["retry_at"] is None:
+                return
+            if time.time() >= state["retry_at"] and not state["trial"]:
+                state["trial"] = True
+                return
+            error_class, retry_at, last_error = state["error_class"], state["retry_at"], state["last_error"]
+        PROBE_TOTAL.inc("circuit_open")
+        raise CircuitOpen(
+            f"{key[0]}:{key[1]} is failing ({error_class}), not retrying before "
+            f"{time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(retry_at))} UTC: {last_error}",
+            error_class, retry_at
+        )
+
+    def succeeded(self, key):
+        with self._lock:
+            self._hosts.pop(key, None)
+
+    def failed(self, key, error):
+        error_class = classify_error(error)
+        message = str(error) or error.__class__.__name__
+        with self._lock:
+            state = self._hosts.pop(key, None) or {"failures": 0}
+            state["failures"] += 1
+            state.update(error_class=error_class, last_error=message, trial=False, retry_at=None)
+            if state["failures"] >= self.threshold:
+                base = self.backoff_base.get(error_class, self.backoff_base["other"])
+                delay = min(base * 2 ** (state["failures"] - self.threshold), self.backoff_max)
+                state["retry_at"] = time.time() + delay * random.uniform(0.9, 1.1)
+            self._hosts[key] = state
+            while len(self._hosts) > self.max_hosts:
+                self._hosts.popitem(last=False)
+        return ProbeFailure(message, error_class, state["retry_at"])
+
+    def clear(self):
+        with self._lock:
+            self._hosts.clear()
+
+
+probe_breakers = HostBreakers()
+
+
+# getaddrinfo has no timeout of its own, so lookups run here and the probe
+# stops waiting at its deadline
+_resolver = ThreadPoolExecutor(max_workers=PROBE_DNS_WORKERS, thread_name_prefix="probe-dns")
+
+
+def _remaining(deadline, phase):
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise socket.timeout(f"{phase} timed out")
+    return remaining
+
+
+def _resolve(hostname, port, deadline):
+    future = _resolver.submit(socket.getaddrinfo, hostname, port, type=socket.SOCK_STREAM)
+    try:
+        return future.result(timeout=_remaining(deadline, "DNS lookup"))
+    except FutureTimeout:
+        future.cancel()
+        raise socket.timeout("DNS lookup timed out") from None
+
+
+def _connect(addresses, deadline):
+    # Same fallback over resolved addresses as socket.create_connection, minus
+    # the lookup; all attempts together share what is left until `deadline`
+    error = None
+    for family, socktype, proto, _, address in addresses:
+        remaining = _remaining(deadline, "connect")
+        sock = socket.socket(family, socktype, proto)
+        sock.settimeout(remaining)
+        try:
+            sock.connect(address)
+            return sock
+        except OSError as e:
+            sock.close()
+            error = e
+    raise error or OSError("No addresses to connect to")
+
+
+def _probe_expiry(hostname, port, sni, timeout):
+    # `timeout` bounds DNS + connect + handshake together, not each socket call;
+    # each phase is timed separately so slow DNS, TCP and TLS can be told apart
+    deadline = time.monotonic() + timeout
+    try:
+        with PROBE_PHASE_SECONDS.time("dns"):
+            addresses = _resolve(hostname, port, deadline)
+        with PROBE_PHASE_SECONDS.time("connect"):
+            sock = _connect(addresses, deadline)
+        with sock:
+            sock.settimeout(_remaining(deadline, "TLS handshake"))
+            context = ssl.create_default_context()
+            if PROBE_CA_FILE:
+                context.load_verify_locations(PROBE_CA_FILE)
+            with PROBE_PHASE_SECONDS.time("tls"):
+                ssock = context.wrap_socket(sock, server_hostname=sni)
+            with ssock:
+                cert = ssock.getpeercert()
+                expiry_str = cert['notAfter']
+                expiry_date = datetime.strptime(expiry_str, '%b %d %H:%M:%S %Y %Z')
+    except Exception as e:
+        PROBE_TOTAL.inc(classify_error(e))
+        raise
+    PROBE_TOTAL.inc("ok")
+    return expiry_date
+
+
+def get_cert_expiry(url, timeout=10, sni=None, use_cache=True):
+    return probe_cert_expiry(url, timeout, sni, use_cache)[0]
+
+
+def probe_cert_expiry(url, timeout=10, sni=None, use_cache=True):
+    # Returns (expiry, probed); probed is False when no handshake was made
+    # for this call, so its timing says nothing about the host
     parsed_url = urlparse(url)
+    if parsed_url.scheme == "file":
+        # Discovered certificate files: file://<path>#<index in the bundle>
+        return file_expiry(unquote(parsed_url.path), int(parsed_url.fragment or 0)), True
+
     hostname = parsed_url.hostname
     if not hostname:
         raise ValueError("Invalid URL: Could not extract hostname.")
 
-    context = ssl.create_default_context()
-    with socket.create_connection((hostname, 443), timeout=10) as sock:
-        with context.wrap_socket(sock, server_hostname=hostname) as ssock:
-            cert = ssock.getpeercert()
-            expiry_str = cert['notAfter']
-            expiry_date = datetime.strptime(expiry_str, '%b %d %H:%M:%S %Y %Z')
-            return expiry_date
+    port = parsed_url.port or 443
+    sni = (sni or hostname).lower()
+
+    def probe():
+        probe_breakers.before((hostname, port))
+        try:
+            expiry = _probe_expiry(hostname, port, sni, timeout)
+        except Exception as e:
+            raise probe_breakers.failed((hostname, port), e) from e
+        probe_breakers.succeeded((hostname, port))
+        return expiry
+
+    if not use_cache:
+        return probe(), True
+    return probe_cache.lookup((hostname, port, sni), probe)
@@ -14,4 +14,154 @@ ALERT_SEND_TIME = "14:00"
 CERT_ALERT_DAYS_BEFORE = 10
 LICENSE_ALERT_DAYS_BEFORE = 10
 
+# Escalation tiers (days before expiry). An item is alerted once when it enters
+# each tier, and again from the top if its expiry date changes.
+CERT_ALERT_TIERS = [CERT_ALERT_DAYS_BEFORE, 3, 1]
+LICENSE_ALERT_TIERS = [LICENSE_ALERT_DAYS_BEFORE, 3, 1]
+
 JWT_SECRET = 'your-jwt-secret-key'
+
+# Certificate scan engine
+SCAN_MAX_IN_FLIGHT = 50  # concurrent TLS probes
+SCAN_PROBE_TIMEOUT = 10  # seconds per probe (DNS + connect + handshake)
+SCAN_RUN_DEADLINE = 3600  # seconds for a whole scan run
+
+# Certificate probe cache, shared by every URL on the same host/port/SNI
+PROBE_CACHE_TTL = 3600  # seconds a successful probe result is reused
+PROBE_CACHE_MAX_ENTRIES = 10000
+PROBE_CACHE_PERSIST = True  # keep results in monitor.db across restarts
+PROBE_DNS_WORKERS = 32  # threads for DNS lookups, which have no timeout of their own
+
+# Per-host circuit breaker: after PROBE_BREAKER_THRESHOLD consecutive failures a
+# host:port is not probed again until its retry time; probes fail fast meanwhile
+PROBE_BREAKER_THRESHOLD = 1
+PROBE_BACKOFF_BASE = {  # seconds before the first retry, by error class; doubled per failure
+    "dns": 300,
+    "refused": 60,
+    "timeout": 120,
+    "tls": 900,  # certificate/handshake errors rarely fix themselves quickly
+    "network": 60,
+    "other": 60,
+}
+PROBE_BACKOFF_MAX = 6 * 3600  # seconds
+PROBE_BREAKER_MAX_HOSTS = 10000  # failing hosts tracked at once
+
+# SQLite
+DATABASE_PATH = "monitor.db"
+DB_BUSY_TIMEOUT_MS = 5000  # wait this long for a competing writer before "database is locked"
+DB_SYNCHRONOUS = "NORMAL"  # safe with WAL, far fewer fsyncs than FULL
+DB_WRITE_BATCH_SIZE = 500  # rows per executemany/commit in BatchWriter
+
+# Alert mail delivery
+SMTP_TIMEOUT = 30  # seconds per SMTP operation
+ALERT_DIGEST_MODE = False  # True = one digest email per recipient per alert run
+
+# Outbound mail queue (outbox table drained by delivery workers)
+OUTBOX_WORKERS = 4  # parallel SMTP sessions
+OUTBOX_MAX_ATTEMPTS = 6  # then the message is dead-lettered
+OUTBOX_BACKOFF_BASE = 30  # seconds before the first retry, doubled per attempt
+OUTBOX_BACKOFF_MAX = 3600
+OUTBOX_POLL_INTERVAL = 5  # seconds an idle worker waits before polling again
+OUTBOX_CLAIM_TIMEOUT = 600  # seconds before a message stuck in 'sending' is retried
+OUTBOX_SENT_RETENTION = 7 * 86400  # seconds delivered messages are kept; dead ones stay until removed
+
+# Background certificate probes for service add/update/fetch-expiry
+PROBE_JOB_WORKERS = 8
+PROBE_JOB_MAX_WAIT = 30  # longest long-poll a client may request, in seconds
+PROBE_JOB_RETENTION = 86400  # seconds finished jobs stay queryable
+
+# List endpoints
+LIST_MAX_LIMIT = 1000  # largest page a client may request with ?limit=
+LIST_STREAM_FETCH_SIZE = 500  # rows fetched per step when streaming NDJSON
+# JSON list responses are kept serialized until the next write to their table (0 = off)
+RESPONSE_CACHE_MAX_ENTRIES = 256
+RESPONSE_CACHE_MAX_BYTES = 64 * 1024 * 1024  # total; a single body over a quarter of this isn't cached
+
+# Bulk import
+IMPORT_BATCH_SIZE = 1000  # rows per transaction
+IMPORT_REPORT_SPOOL_BYTES = 1024 * 1024  # per-row report moves to a temp file beyond this size
+
+# Scheduling of certificate checks: "cron" re-checks everything daily at
+# CERT_CHECK_TIME, "adaptive" re-checks each service when it is due
+SCHEDULER_MODE = "cron"
+RECHECK_FRACTION = 0.1  # re-check after this fraction of the remaining validity
+RECHECK_MIN_INTERVAL = 3600  # seconds
+RECHECK_MAX_INTERVAL = 7 * 86400  # seconds
+RECHECK_FAILURE_BASE = 900  # seconds after a first failure, doubled per consecutive failure
+RECHECK_JITTER = 0.1  # +/- fraction, spreads checks that would otherwise bunch up
+RECHECK_MAX_PROBES_PER_MINUTE = 60  # global rate limit in adaptive mode
+RECHECK_POLL_INTERVAL = 30  # seconds between looks for due services when idle
+RECHECK_BATCH_SIZE = 500  # due services loaded per pass
+
+# Multi-instance work sharding: replicas claim batches of rows through leases
+# in the database instead of every replica processing every row
+WORK_SHARDING = False
+LEASE_TTL = 120  # seconds a claim survives without a heartbeat
+LEASE_BATCH_SIZE = 100  # rows claimed at a time
+LEASE_POLL_INTERVAL = 5  # seconds between checks while waiting for other replicas to finish a run
+
+# Background jobs run in one elected process per host
+SCHEDULER_LOCK_FILE = "scheduler.lock"
+LEADER_RETRY_INTERVAL = 15  # seconds between attempts to take over leadership
+
+# Auth
+AUTH_TOKEN_CACHE_SIZE = 10000  # verified tokens remembered until their exp
+AUTH_DENYLIST_REFRESH_SECONDS = 30  # how often disabled users / revocations are re-read
+
+# Password hashing runs on its own small pool so login storms can't starve the API
+BCRYPT_ROUNDS = 12  # changing this rehashes each password at its next login
+PASSWORD_HASH_WORKERS = 2
+PASSWORD_HASH_MAX_PENDING = 8  # queued hash jobs beyond this get 429
+PASSWORD_HASH_TIMEOUT = 10  # seconds a request waits for its hash job
+
+# Prometheus-text /metrics endpoint and request timing hooks
+METRICS_ENABLED = True
+# Each server process writes its counters here and /metrics sums them, so any
+# gunicorn worker can answer a scrape (None = this process's values only)
+METRICS_DIR = "metrics_data"
+METRICS_FLUSH_INTERVAL = 5  # seconds; other processes' values in a scrape are at most this old
+
+# Profiling of requests and scheduled jobs (see profiling.py); also switchable
+# at runtime with POST /admin/profiles/config, which overrides these until the
+# settings file in PROFILE_DIR is removed
+PROFILING_ENABLED = False
+PROFILE_REQUEST_SAMPLE_RATE = 0.0  # share of requests profiled while enabled
+PROFILE_REQUEST_HEADER = "X-Profile"  # requests sending this header are profiled while enabled
+PROFILE_JOBS = ["check_cert_expiry", "send_alerts", "discover"]  # also "adaptive_recheck" (one profile per pass)
+PROFILE_RING_SIZE = 20  # newest profiles kept
+PROFILE_DIR = "profiles"  # captures and runtime settings, shared by all server processes
+PROFILE_SETTINGS_REFRESH = 5  # seconds before a runtime toggle reaches the other processes
+PROFILING_ADMINS = []  # usernames allowed to use /admin/profiles
+
+# Extra CA bundle trusted by certificate probes, e.g. an internal CA (None = system store only)
+PROBE_CA_FILE = None
+
+# Logging (written by a background thread; see logger.py)
+LOG_DIR = "logs"
+LOG_FILE = "expiry_watch.log"
+LOG_LEVEL = "INFO"
+LOG_LEVELS = {  # per-module overrides, e.g. {"expiry_watch.scan": "DEBUG", "werkzeug": "WARNING"}
+    "expiry_watch.scan": "INFO",
+}
+LOG_FORMAT = "text"  # "text" or "json" (one object per line, with service_id/host/duration_ms fields)
+LOG_MAX_BYTES = 10 * 1024 * 1024  # rotate at this size...
+LOG_ROTATE_WHEN = None  # ...or by time instead, e.g. "midnight"
+LOG_BACKUP_COUNT = 5
+# Reopen the file once logrotate (or similar) has moved it, instead of rotating in-process.
+# Needed whenever several processes write the file; gunicorn.conf.py turns it on.
+LOG_ROTATE_EXTERNALLY = False
+LOG_QUEUE_SIZE = 10000  # records buffered for the writer; overflow is dropped and counted
+SCAN_LOG_SAMPLE = 20  # per-service scan failures logged individually per run; the rest are summarised
+
+# In-memory expiry index (see expiry_index.py)
+EXPIRY_INDEX_REFRESH = 60  # seconds before a full reload picks up other processes' writes
+EXPIRING_MAX_DAYS = 3650  # largest ?days= accepted by /expiring
+
+# Local certificate discovery (see cert_discovery.py); each certificate found
+# becomes a service with a file:// URL and is alerted on like any other
+CERT_DISCOVERY_DIRS = []  # e.g. ["/etc/ssl/internal", "/srv/staged-certs"]
+CERT_DISCOVERY_SUFFIXES = (".pem", ".crt", ".cer", ".der", ".ca-bundle")
+CERT_DISCOVERY_ALERT_EMAIL = ""  # alert address for discovered certificates; required when DIRS is set
+CERT_DISCOVERY_INTERVAL = 3600  # seconds between re-scans
+CERT_DISCOVERY_WORKERS = None  # parser processes (None = one per CPU)
+CERT_DISCOVERY_POOL_MIN = 200  # changed files below this are parsed in-process
@@ -1,20 +1,91 @@
 import sqlite3
+import threading
+import time
+from datetime import datetime
+from config import (
+    DATABASE_PATH,
+    DB_BUSY_TIMEOUT_MS,
+    DB_SYNCHRONOUS,
+    DB_WRITE_BATCH_SIZE
+)
+from logger import logger
+from metrics import DB_QUERY_SECONDS
 
-def init_db():
-    conn = sqlite3.connect("monitor.db")
-    cursor = conn.cursor()
+_local = threading.local()
+
+
+def _statement_type(sql):
+    return sql.lstrip().split(None, 1)[0].upper() if sql.strip() else "EMPTY"
+
+
+class TimedCursor(sqlite3.Cursor):
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            DB_QUERY_SECONDS.observe(time.perf_counter() - started, _statement_type(sql))
+
+    def executemany(self, sql, seq_of_parameters):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            DB_QUERY_SECONDS.observe(time.perf_counter() - started, _statement_type(sql))
+
+
+class PooledConnection(sqlite3.Connection):
+    # Connections are reused by their thread, so close() only ends the
+    # current transaction; discard() really closes the handle. All cursors
+    # are TimedCursors so every statement lands in DB_QUERY_SECONDS.
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
 
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def close(self):
+        if self.in_transaction:
+            self.rollback()
+
+    def discard(self):
+        super().close()
+
+
+class MigrationError(RuntimeError):
+    pass
+
+
+def _ensure_columns(cursor, table, columns):
+    cursor.execute(f"PRAGMA table_info({table})")
+    existing = {row[1] for row in cursor.fetchall()}
+    for column, column_type in columns.items():
+        if column not in existing:
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}")
+
+def _migrate_base_schema(cursor):
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS services (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             name TEXT,
             url TEXT,
             alert_email TEXT,
-            certificate_expiry TEXT
+            certificate_expiry TEXT,
+            last_checked TEXT,
+            last_error TEXT,
+            handshake_ms REAL
         )
     """)
+    _ensure_columns(cursor, "services", {
+        "last_checked": "TEXT",
+        "last_error": "TEXT",
+        "handshake_ms": "REAL"
+    })
 
-    
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS users (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -22,7 +93,7 @@ def init_db():
             password_hash TEXT NOT NULL
         )
     """)
-    
+
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS licenses (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -32,8 +103,322 @@ def init_db():
         )
     """)
 
-    conn.commit()
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS probe_cache (
+            hostname TEXT NOT NULL,
+            port INTEGER NOT NULL,
+            sni TEXT NOT NULL,
+            expiry TEXT NOT NULL,
+            checked_at REAL NOT NULL,
+            PRIMARY KEY (hostname, port, sni)
+        )
+    """)
+
+def _normalize_dates(cursor, table, column):
+    # Zero-pads every date the app has always accepted ("2026-10-2"), so the
+    # text sorts like the date; returns the ids of values that aren't dates
+    cursor.execute(f"SELECT id, {column} FROM {table} WHERE {column} IS NOT NULL")
+    updates, invalid = [], []
+    for row_id, value in cursor.fetchall():
+        try:
+            normalized = datetime.strptime(value, "%Y-%m-%d").strftime("%Y-%m-%d")
+        except (TypeError, ValueError):
+            invalid.append(row_id)
+            continue
+        if normalized != value:
+            updates.append((normalized, row_id))
+    cursor.executemany(f"UPDATE {table} SET {column} = ? WHERE id = ?", updates)
+    if updates:
+        logger.info("Normalized %s %s.%s value(s) to YYYY-MM-DD.", len(updates), table, column)
+    return invalid
+
+def _migrate_expiry_indexes(cursor):
+    # Expiry dates are stored as ISO "YYYY-MM-DD" text, which sorts like the
+    # date itself, so alert windows become index range scans.
+    invalid = []
+    for table, column in (("licenses", "expiry_date"), ("services", "certificate_expiry")):
+        ids = _normalize_dates(cursor, table, column)
+        if ids:
+            more = " ..." if len(ids) > 50 else ""
+            invalid.append(f"{table}.{column} (ids {', '.join(map(str, ids[:50]))}{more})")
+    if invalid:
+        raise MigrationError(
+            f"Expiry dates that are not YYYY-MM-DD: {'; '.join(invalid)}. "
+            "Correct or delete those rows, then restart to apply the migration."
+        )
+
+    # Duplicates can only come from racing inserts. Which of two rows for the
+    # same URL to keep is the operator's call, so stop and name them; reused
+    # names are made unique without losing anything.
+    cursor.execute("""
+        SELECT url, GROUP_CONCAT(id) FROM services GROUP BY url HAVING COUNT(*) > 1 ORDER BY url
+    """)
+    duplicates = cursor.fetchall()
+    if duplicates:
+        listing = "; ".join(f"{url} (ids {ids})" for url, ids in duplicates[:50])
+        more = f"; and {len(duplicates) - 50} more" if len(duplicates) > 50 else ""
+        raise MigrationError(
+            f"{len(duplicates)} URL(s) are used by more than one service: {listing}{more}. "
+            "Delete or change the extra rows, then restart to apply the migration."
+        )
+    cursor.execute("""
+        UPDATE services SET name = name || ' #' || id
+        WHERE id NOT IN (SELECT MIN(id) FROM services GROUP BY name)
+    """)
+    if cursor.rowcount > 0:
+        logger.warning("Renamed %s services with duplicate names to '<name> #<id>'.", cursor.rowcount)
+
+    cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_services_name ON services (name)")
+    cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_services_url ON services (url)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_services_certificate_expiry ON services (certificate_expiry)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_licenses_expiry_date ON licenses (expiry_date)")
+
+
+def _migrate_outbox(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            recipients TEXT NOT NULL,
+            subject TEXT NOT NULL,
+            body TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            created_at REAL NOT NULL,
+            next_attempt_at REAL NOT NULL,
+            claimed_at REAL,
+            sent_at REAL,
+            last_error TEXT
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_outbox_status_due ON outbox (status, next_attempt_at)")
+
+
+def _migrate_probe_jobs(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS probe_jobs (
+            id TEXT PRIMARY KEY,
+            service_id INTEGER NOT NULL,
+            url TEXT NOT NULL,
+            status TEXT NOT NULL,
+            certificate_expiry TEXT,
+            error TEXT,
+            created_at REAL NOT NULL,
+            finished_at REAL
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_probe_jobs_created_at ON probe_jobs (created_at)")
+
+
+def _migrate_recheck_schedule(cursor):
+    _ensure_columns(cursor, "services", {
+        "next_check_at": "TEXT",
+        "consecutive_failures": "INTEGER NOT NULL DEFAULT 0"
+    })
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_services_next_check_at ON services (next_check_at)")
+
+
+def _migrate_work_leases(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS work_leases (
+            job TEXT NOT NULL,
+            run_key TEXT NOT NULL,
+            item_id INTEGER NOT NULL,
+            owner TEXT NOT NULL,
+            lease_until REAL NOT NULL,
+            done INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (job, run_key, item_id)
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_work_leases_owner ON work_leases (owner, done)")
+
+
+def _migrate_user_revocation(cursor):
+    _ensure_columns(cursor, "users", {
+        "disabled": "INTEGER NOT NULL DEFAULT 0",
+        "tokens_not_before": "REAL"
+    })
+
+
+def _migrate_alert_state(cursor):
+    # One row per alerted item: the expiry it was alerted for and the tightest
+    # tier already sent, so later runs only pick up items whose state changed
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS alert_state (
+            kind TEXT NOT NULL,
+            item_id INTEGER NOT NULL,
+            expiry TEXT NOT NULL,
+            tier INTEGER NOT NULL,
+            sent_at REAL NOT NULL,
+            PRIMARY KEY (kind, item_id)
+        )
+    """)
+
+
+def _migrate_probe_failures(cursor):
+    _ensure_columns(cursor, "services", {
+        "error_class": "TEXT",
+        "next_retry_at": "TEXT"
+    })
+
+
+def _migrate_cert_files(cursor):
+    # What each discovered certificate file looked like when it was last parsed
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS cert_files (
+            path TEXT PRIMARY KEY,
+            mtime_ns INTEGER NOT NULL,
+            size INTEGER NOT NULL,
+            sha256 TEXT,
+            cert_count INTEGER NOT NULL DEFAULT 0,
+            error TEXT,
+            parsed_at REAL NOT NULL
+        )
+    """)
+
+
+def _migrate_table_versions(cursor):
+    # A counter per table, bumped by triggers on every write from any process,
+    # so cached list responses (response_cache.py) know when they are stale.
+    # Counters start from the clock so a recreated database never reuses an ETag.
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS table_versions (
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL
+        )
+    """)
+    for table in ("services", "licenses"):
+        cursor.execute(
+            "INSERT OR IGNORE INTO table_versions (name, version) VALUES (?, CAST(strftime('%s', 'now') AS INTEGER) * 1000)",
+            (table,)
+        )
+        for event in ("INSERT", "UPDATE", "DELETE"):
+            cursor.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS {table}_version_{event.lower()} AFTER {event} ON {table}
+                BEGIN
+                    UPDATE table_versions SET version = version + 1 WHERE name = '{table}';
+                END
+            """)
+
+
+# Applied in order; PRAGMA user_version records the last one applied.
+# Append new migrations here, never edit or reorder shipped ones.
+MIGRATIONS = [
+    (1, _migrate_base_schema),
+    (2, _migrate_expiry_indexes),
+    (3, _migrate_outbox),
+    (4, _migrate_probe_jobs),
+    (5, _migrate_recheck_schedule),
+    (6, _migrate_work_leases),
+    (7, _migrate_user_revocation),
+    (8, _migrate_alert_state),
+    (9, _migrate_probe_failures),
+    (10, _migrate_cert_files),
+    (11, _migrate_table_versions),
+]
+
+def get_schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+def init_db():
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    current = get_schema_version(conn)
+    if current >= MIGRATIONS[-1][0]:
+        conn.close()
+        return
+
+    for version, migrate in MIGRATIONS:
+        if version <= current:
+            continue
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            # Another process may have migrated while we waited for the lock
+            if get_schema_version(conn) >= version:
+                conn.rollback()
+                continue
+            migrate(cursor)
+            cursor.execute(f"PRAGMA user_version = {version}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        logger.info("Applied database migration %s: %s", version, migrate.__name__)
+
     conn.close()
 
-def get_db_connection():
-    return sqlite3.connect("monitor.db")
+def _connect(path):
+    conn = sqlite3.connect(path, timeout=DB_BUSY_TIMEOUT_MS / 1000, factory=PooledConnection)
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute(f"PRAGMA synchronous = {DB_SYNCHRONOUS}")
+    conn.execute(f"PRAGMA busy_timeout = {int(DB_BUSY_TIMEOUT_MS)}")
+    return conn
+
+def get_db_connection(path=None):
+    path = path or DATABASE_PATH
+    connections = getattr(_local, "connections", None)
+    if connections is None:
+        connections = _local.connections = {}
+    conn = connections.get(path)
+    if conn is None:
+        conn = connections[path] = _connect(path)
+    return conn
+
+def close_thread_connections():
+    for conn in getattr(_local, "connections", {}).values():
+        conn.discard()
+    _local.connections = {}
+
+
+class BatchWriter:
+    # Collects parameter rows for one statement and writes each batch with a
+    # single executemany + commit, keeping write transactions short. With
+    # `on_conflict`, a batch that hits an IntegrityError is retried row by row
+    # and each rejected row is passed to on_conflict(params, error) instead
+    # of failing the batch.
+
+    def __init__(self, sql, batch_size=DB_WRITE_BATCH_SIZE, path=None, on_conflict=None):
+        self.sql = sql
+        self.batch_size = batch_size
+        self.path = path
+        self.on_conflict = on_conflict
+        self.rows = []
+        self.written = 0
+
+    def add(self, params):
+        self.rows.append(params)
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.rows:
+            return
+        rows, self.rows = self.rows, []
+        conn = get_db_connection(self.path)
+        try:
+            with conn:
+                conn.executemany(self.sql, rows)
+        except sqlite3.IntegrityError:
+            if not self.on_conflict:
+                raise
+            self._write_each(conn, rows)
+            return
+        self.written += len(rows)
+
+    def _write_each(self, conn, rows):
+        with conn:
+            for params in rows:
+                try:
+                    conn.execute(self.sql, params)
+                except sqlite3.IntegrityError as e:
+                    self.on_conflict(params, e)
+                else:
+                    self.written += 1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.flush()
+        else:
+            self.rows = []
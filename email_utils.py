@@ -1,29 +1,92 @@
 import smtplib
-import logging
+import time
 from email.mime.text import MIMEText
+from metrics import SMTP_SEND_SECONDS, SMTP_FAILURES
 from config import (
-    EMAIL_SENDER, EMAIL_PASSWORD, SMTP_SERVER, SMTP_PORT, USE_SSL
+    EMAIL_SENDER, EMAIL_PASSWORD, SMTP_SERVER, SMTP_PORT, USE_SSL, SMTP_TIMEOUT
 )
 
-def send_email(recipients, subject, body):
-    msg = MIMEText(body)
-    msg['Subject'] = subject
-    msg['From'] = EMAIL_SENDER
-    msg['To'] = ', '.join(recipients)
-
-    try:
-        if USE_SSL:
-            with smtplib.SMTP_SSL(SMTP_SERVER, SMTP_PORT) as server:
-                server.login(EMAIL_SENDER, EMAIL_PASSWORD)
-                server.sendmail(EMAIL_SENDER, recipients, msg.as_string())
+
+class Mailer:
+    # Keeps one authenticated SMTP session open across many sends and
+    # reconnects once if the server dropped it. Connects lazily on first send.
+
+    def __init__(self, host=SMTP_SERVER, port=SMTP_PORT, use_ssl=USE_SSL, starttls=None,
+                 username=EMAIL_SENDER, password=EMAIL_PASSWORD, sender=EMAIL_SENDER,
+                 timeout=SMTP_TIMEOUT):
+        self.host = host
+        self.port = port
+        self.use_ssl = use_ssl
+        self.starttls = (not use_ssl) if starttls is None else starttls
+        self.username = username
+        self.password = password
+        self.sender = sender
+        self.timeout = timeout
+        self.server = None
+
+    def connect(self):
+        if self.use_ssl:
+            server = smtplib.SMTP_SSL(self.host, self.port, timeout=self.timeout)
         else:
-            with smtplib.SMTP(SMTP_SERVER, SMTP_PORT) as server:
-                server.ehlo()
+            server = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+            server.ehlo()
+            if self.starttls:
                 server.starttls()
                 server.ehlo()
-                server.login(EMAIL_SENDER, EMAIL_PASSWORD)
-                server.sendmail(EMAIL_SENDER, recipients, msg.as_string())
+        if self.password:
+            server.login(self.username, self.password)
+        self.server = server
+
+    def close(self):
+        if self.server is None:
+            return
+        try:
+            self.server.quit()
+        except (smtplib.SMTPException, OSError):
+            self.server.close()
+        self.server = None
+
+    def send(self, recipients, subject, body):
+        msg = MIMEText(body)
+        msg['Subject'] = subject
+        msg['From'] = self.sender
+        msg['To'] = ', '.join(recipients)
+
+        started = time.perf_counter()
+        try:
+            self._send(recipients, msg)
+        except Exception as e:
+            SMTP_FAILURES.inc(e.__class__.__name__)
+            raise
+        SMTP_SEND_SECONDS.observe(time.perf_counter() - started)
+
+    def _send(self, recipients, msg):
+        for attempt in range(2):
+            if self.server is None:
+                self.connect()
+            try:
+                self.server.sendmail(self.sender, recipients, msg.as_string())
+                return
+            except smtplib.SMTPResponseException as e:
+                self.close()
+                # 421: the server is closing the session, worth one fresh connection
+                if attempt or e.smtp_code != 421:
+                    raise
+            except (smtplib.SMTPServerDisconnected, OSError):
+                self.close()
+                if attempt:
+                    raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
 
-        logging.info(f"Email sent to {recipients}")
-    except Exception as e:
-        logging.error(f"Email error: {e}")
+def build_digest(items):
+    # items: (kind, name, expiry_date) tuples for one recipient
+    lines = [f"- {kind} '{name}' expires on {expiry_date}" for kind, name, expiry_date in items]
+    subject = f"Expiry Digest: {len(items)} item(s) expiring soon"
+    body = "The following items are expiring soon:\n\n" + "\n".join(lines)
+    return subject, body
@@ -0,0 +1,115 @@
+import bisect
+import threading
+import time
+from datetime import datetime, timedelta
+from database import get_db_connection
+from config import EXPIRY_INDEX_REFRESH
+from logger import logger
+
+# kind -> (table, expiry column)
+KINDS = {
+    "services": ("services", "certificate_expiry"),
+    "licenses": ("licenses", "expiry_date"),
+}
+
+
+class ExpiryIndex:
+    """Every service and license expiry date, kept sorted in memory.
+
+    Range queries are a bisect plus a slice. Writers in this process update
+    the index as they commit; writes made by other processes are picked up
+    by a full reload at most `refresh_interval` seconds later, or right away
+    by calling refresh().
+    """
+
+    def __init__(self, refresh_interval=EXPIRY_INDEX_REFRESH):
+        self.refresh_interval = refresh_interval
+        self._lock = threading.Lock()
+        self._sorted = {kind: [] for kind in KINDS}  # (expiry, id), ascending
+        self._items = {kind: {} for kind in KINDS}  # id -> (name, expiry, alert_email)
+        self._loaded_at = None
+        self._mutations = 0
+
+    def refresh(self):
+        with self._lock:
+            mutations = self._mutations
+        started = time.monotonic()
+        items = {}
+        conn = get_db_connection()
+        try:
+            cursor = conn.cursor()
+            for kind, (table, column) in KINDS.items():
+                cursor.execute(f"SELECT id, name, {column}, alert_email FROM {table}")
+                items[kind] = {item_id: (name, expiry, email) for item_id, name, expiry, email in cursor.fetchall()}
+        finally:
+            conn.close()
+        ordered = {kind: sorted((entry[1], item_id) for item_id, entry in entries.items() if entry[1])
+                   for kind, entries in items.items()}
+
+        with self._lock:
+            self._items, self._sorted = items, ordered
+            # A write that landed while we were reading may be missing from the
+            # snapshot, so only count the reload as fresh if nothing changed
+            self._loaded_at = time.monotonic() if self._mutations == mutations else None
+        logger.debug("Expiry index loaded %s services and %s licenses in %.0fms",
+                     len(items["services"]), len(items["licenses"]), (time.monotonic() - started) * 1000)
+
+    def invalidate(self):
+        with self._lock:
+            self._loaded_at = None
+
+    def _fresh(self):
+        with self._lock:
+            loaded_at = self._loaded_at
+        if loaded_at is None or time.monotonic() - loaded_at > self.refresh_interval:
+            self.refresh()
+
+    def _unlink(self, kind, item_id):
+        entry = self._items[kind].pop(item_id, None)
+        if entry and entry[1]:
+            keys = self._sorted[kind]
+            position = bisect.bisect_left(keys, (entry[1], item_id))
+            if position < len(keys) and keys[position] == (entry[1], item_id):
+                del keys[position]
+        return entry
+
+    def put(self, kind, item_id, name, expiry, alert_email):
+        with self._lock:
+            self._mutations += 1
+            self._unlink(kind, item_id)
+            self._items[kind][item_id] = (name, expiry, alert_email)
+            if expiry:
+                bisect.insort(self._sorted[kind], (expiry, item_id))
+
+    def set_expiry(self, kind, item_id, expiry):
+        with self._lock:
+            entry = self._items[kind].get(item_id)
+            if entry is None or entry[1] == expiry:
+                return
+            self._mutations += 1
+            self._unlink(kind, item_id)
+            self._items[kind][item_id] = (entry[0], expiry, entry[2])
+            if expiry:
+                bisect.insort(self._sorted[kind], (expiry, item_id))
+
+    def remove(self, kind, item_id):
+        with self._lock:
+            self._mutations += 1
+            self._unlink(kind, item_id)
+
+    def range(self, kind, start, end):
+        # (id, name, expiry, alert_email) for start <= expiry <= end (ISO dates), soonest first
+        self._fresh()
+        with self._lock:
+            keys = self._sorted[kind]
+            low = bisect.bisect_left(keys, (start,))
+            high = bisect.bisect_right(keys, (end, float("inf")))
+            items = self._items[kind]
+            return [(item_id, items[item_id][0], expiry, items[item_id][2]) for expiry, item_id in keys[low:high]]
+
+    def expiring(self, kind, days, today=None):
+        today = today or datetime.utcnow().date()
+        return self.range(kind, today.isoformat(), (today + timedelta(days=days)).isoformat())
+
+
+expiry_index = ExpiryIndex()
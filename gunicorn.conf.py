@@ -0,0 +1,27 @@
+import multiprocessing
+import config
+from config import SERVER_PORT
+
+# Every worker appends to the same log file, so rotation is left to logrotate
+# (see README); this runs before anything imports logger
+config.LOG_ROTATE_EXTERNALLY = True
+
+bind = f"0.0.0.0:{SERVER_PORT}"
+workers = multiprocessing.cpu_count() * 2 + 1
+threads = 4
+# The app must not be preloaded: the scheduler threads can't survive a fork
+preload_app = False
+
+
+def on_starting(server):
+    from config import METRICS_DIR
+    from metrics import MetricsStore
+    # Counters restart with the server; workers sum each other's files from here on
+    if METRICS_DIR:
+        MetricsStore.clear(METRICS_DIR)
+
+    # Run pending migrations once in the master instead of racing in every worker
+    from database import init_db, close_thread_connections
+    init_db()
+    # Workers are forked from here; a SQLite connection must not cross a fork
+    close_thread_connections()
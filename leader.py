@@ -0,0 +1,71 @@
+import os
+import threading
+from config import SCHEDULER_LOCK_FILE, LEADER_RETRY_INTERVAL
+from logger import logger
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+class LeaderLock:
+    # An exclusive, non-blocking lock on a file. The OS drops it when the
+    # holding process exits, so a crashed leader is replaced automatically.
+
+    def __init__(self, path=SCHEDULER_LOCK_FILE):
+        self.path = path
+        self._fd = None
+
+    def acquire(self):
+        if self._fd is not None:
+            return True
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if fcntl:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+        except OSError:
+            os.close(fd)
+            return False
+        os.ftruncate(fd, 0)
+        os.write(fd, str(os.getpid()).encode())
+        self._fd = fd
+        return True
+
+    @property
+    def held(self):
+        return self._fd is not None
+
+
+_started = threading.Event()
+
+
+def run_scheduler_when_leader(lock=None, retry_interval=LEADER_RETRY_INTERVAL):
+    # Start the scheduler now if this process wins the lock, otherwise keep
+    # retrying in the background so a follower takes over when the leader dies.
+    lock = lock or LeaderLock()
+
+    def try_lead():
+        if _started.is_set() or not lock.acquire():
+            return False
+        from scheduler import start_scheduler
+        _started.set()
+        logger.info("Process %s elected scheduler leader.", os.getpid())
+        start_scheduler()
+        return True
+
+    if try_lead():
+        return True
+
+    def follow():
+        while not _started.wait(retry_interval):
+            try:
+                try_lead()
+            except Exception as e:
+                logger.error("Scheduler leader election failed: %s", e)
+
+    threading.Thread(target=follow, name="leader-election", daemon=True).start()
+    return False
@@ -0,0 +1,145 @@
+import os
+import socket
+import threading
+import time
+import uuid
+from database import get_db_connection
+from config import LEASE_TTL, LEASE_BATCH_SIZE, LEASE_POLL_INTERVAL
+from logger import logger
+
+INSTANCE_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+class Leases:
+    """Lets several processes share one job's rows through work_leases.
+
+    Rows are claimed in batches for a (job, run_key) pair. A claim stays
+    valid for `ttl` seconds and is extended by a heartbeat while this process
+    holds it. Finished rows are marked done so nobody takes them again in the
+    same run. Claims that stop being heartbeated (a crashed replica) expire
+    and are handed out again.
+    """
+
+    def __init__(self, job, ttl=LEASE_TTL, batch_size=LEASE_BATCH_SIZE, owner=INSTANCE_ID):
+        self.job = job
+        self.ttl = ttl
+        self.batch_size = batch_size
+        self.owner = owner
+        self._heartbeat = None
+        self._stop = threading.Event()
+
+    def claim(self, run_key, table, columns, where="1", params=(), order="t.id"):
+        # `columns`, `where` and `order` refer to the table as alias `t`;
+        # the first column must be its id.
+        now = time.time()
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        # IMMEDIATE takes the write lock before reading, so two replicas can't pick the same rows
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            cursor.execute(
+                f"SELECT {columns} FROM {table} t "
+                "LEFT JOIN work_leases l ON l.job = ? AND l.run_key = ? AND l.item_id = t.id "
+                f"WHERE ({where}) AND (l.item_id IS NULL OR (l.done = 0 AND l.lease_until < ?)) "
+                f"ORDER BY {order} LIMIT ?",
+                (self.job, run_key, *params, now, self.batch_size)
+            )
+            rows = cursor.fetchall()
+            cursor.executemany(
+                "INSERT OR REPLACE INTO work_leases (job, run_key, item_id, owner, lease_until, done) "
+                "VALUES (?, ?, ?, ?, ?, 0)",
+                [(self.job, run_key, row[0], self.owner, now + self.ttl) for row in rows]
+            )
+            conn.commit()
+        finally:
+            conn.close()
+        return rows
+
+    def iter_batches(self, run_key, table, columns, where="1", params=(), order="t.id", wait=False):
+        """Yields one claimed batch at a time; the next is claimed only when
+        the caller asks for it, so replicas running together split the rows.
+
+        With `wait`, running out of rows while other owners still hold live
+        claims waits for them (see wait_for_others). Only pass it if every
+        batch is completed before the next one is requested, or two replicas
+        can end up waiting on each other.
+        """
+        while True:
+            rows = self.claim(run_key, table, columns, where, params, order)
+            if rows:
+                yield rows
+            elif not (wait and self.wait_for_others(run_key)):
+                return
+
+    def iter_claimed(self, run_key, table, columns, where="1", params=(), order="t.id"):
+        for rows in self.iter_batches(run_key, table, columns, where, params, order):
+            yield from rows
+
+    def wait_for_others(self, run_key):
+        # True after a pause if other owners still hold unfinished rows of this
+        # run: the caller should claim again, which takes over the rows of a
+        # replica that died mid-run once its claims expire, rather than leaving
+        # them to the next run. False once everything is done.
+        if not self.outstanding(run_key):
+            return False
+        return not self._stop.wait(min(LEASE_POLL_INTERVAL, self.ttl / 3))
+
+    def outstanding(self, run_key):
+        # Live claims of other owners on this run. Expired ones don't count:
+        # claim() takes those over if they still match, else nobody needs them.
+        conn = get_db_connection()
+        try:
+            return conn.execute(
+                "SELECT COUNT(*) FROM work_leases "
+                "WHERE job = ? AND run_key = ? AND done = 0 AND owner != ? AND lease_until >= ?",
+                (self.job, run_key, self.owner, time.time())
+            ).fetchone()[0]
+        finally:
+            conn.close()
+
+    def complete(self, run_key, ids):
+        self._update("UPDATE work_leases SET done = 1 WHERE job = ? AND run_key = ? AND item_id = ? AND owner = ?",
+                     run_key, ids)
+
+    def release(self, run_key, ids):
+        self._update("DELETE FROM work_leases WHERE job = ? AND run_key = ? AND item_id = ? AND owner = ?",
+                     run_key, ids)
+
+    def _update(self, sql, run_key, ids):
+        if not ids:
+            return
+        conn = get_db_connection()
+        with conn:
+            conn.executemany(sql, [(self.job, run_key, item_id, self.owner) for item_id in ids])
+
+    def purge(self, run_key):
+        # Drop finished or abandoned claims left over from earlier runs
+        conn = get_db_connection()
+        with conn:
+            conn.execute(
+                "DELETE FROM work_leases WHERE job = ? AND run_key != ? AND (done = 1 OR lease_until < ?)",
+                (self.job, run_key, time.time())
+            )
+
+    def __enter__(self):
+        self._stop.clear()
+        self._heartbeat = threading.Thread(target=self._beat, name=f"lease-{self.job}", daemon=True)
+        self._heartbeat.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._stop.set()
+        self._heartbeat.join()
+        self._heartbeat = None
+
+    def _beat(self):
+        while not self._stop.wait(self.ttl / 3):
+            try:
+                conn = get_db_connection()
+                with conn:
+                    conn.execute(
+                        "UPDATE work_leases SET lease_until = ? WHERE job = ? AND owner = ? AND done = 0",
+                        (time.time() + self.ttl, self.job, self.owner)
+                    )
+            except Exception as e:
+                logger.error("Lease heartbeat for %s failed: %s", self.job, e)
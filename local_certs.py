@@ -0,0 +1,130 @@
+"""Read certificate expiry dates from PEM/DER files.
+
+Only the fields we need (subject CN and notAfter) are decoded, straight from
+the DER, so this has no dependencies beyond the standard library. The module
+imports nothing from the app: parse_file runs in worker processes.
+"""
+import base64
+import binascii
+import hashlib
+import re
+from datetime import datetime
+
+PEM_CERTIFICATE = re.compile(rb"-----BEGIN (?:TRUSTED |X509 )?CERTIFICATE-----(.+?)-----END", re.S)
+COMMON_NAME_OID = b"\x06\x03\x55\x04\x03"
+UTC_TIME, GENERALIZED_TIME = 0x17, 0x18
+
+
+class CertificateParseError(ValueError):
+    pass
+
+
+def _tlv(data, pos):
+    # (tag, value start, value end) of the DER element at `pos`
+    if pos + 2 > len(data):
+        raise CertificateParseError("Truncated DER")
+    tag, length = data[pos], data[pos + 1]
+    pos += 2
+    if length & 0x80:
+        count = length & 0x7F
+        if not 0 < count <= 4:
+            raise CertificateParseError("Unsupported DER length")
+        length = int.from_bytes(data[pos:pos + count], "big")
+        pos += count
+    if pos + length > len(data):
+        raise CertificateParseError("Truncated DER")
+    return tag, pos, pos + length
+
+
+def _children(data, start, end):
+    pos = start
+    while pos < end:
+        tag, value_start, value_end = _tlv(data, pos)
+        yield tag, value_start, value_end
+        pos = value_end
+
+
+def _time(tag, value):
+    text = value.decode("ascii").rstrip("Z").split(".")[0]
+    if tag == UTC_TIME:
+        # Two-digit years: 50-99 are 19xx, 00-49 are 20xx (RFC 5280)
+        year = int(text[:2])
+        text = f"{1900 + year if year >= 50 else 2000 + year}{text[2:]}"
+    elif tag != GENERALIZED_TIME:
+        raise CertificateParseError("Unexpected time type")
+    return datetime.strptime(text.ljust(14, "0")[:14], "%Y%m%d%H%M%S")
+
+
+def _common_name(data, start, end):
+    position = data.find(COMMON_NAME_OID, start, end)
+    if position < 0:
+        return None
+    _, value_start, value_end = _tlv(data, position + len(COMMON_NAME_OID))
+    return data[value_start:value_end].decode("utf-8", "replace")
+
+
+def parse_der(der):
+    """(subject CN or None, notAfter as naive UTC datetime) of one certificate."""
+    try:
+        tag, start, end = _tlv(der, 0)
+        if tag != 0x30:
+            raise CertificateParseError("Not a certificate")
+        tag, start, end = _tlv(der, start)  # tbsCertificate
+        fields = [(tag, value_start, value_end) for tag, value_start, value_end in _children(der, start, end)]
+        if fields and fields[0][0] == 0xA0:  # explicit version
+            fields = fields[1:]
+        # serialNumber, signature, issuer, validity, subject, ...
+        _, validity_start, validity_end = fields[3]
+        _, subject_start, subject_end = fields[4]
+        times = list(_children(der, validity_start, validity_end))
+        tag, value_start, value_end = times[1]
+        not_after = _time(tag, der[value_start:value_end])
+        return _common_name(der, subject_start, subject_end), not_after
+    except (IndexError, ValueError) as e:
+        if isinstance(e, CertificateParseError):
+            raise
+        raise CertificateParseError(f"Malformed certificate: {e}") from e
+
+
+def certificates(data):
+    # DER blobs in a PEM bundle, or the file itself if it is a single DER certificate
+    blocks = PEM_CERTIFICATE.findall(data)
+    if blocks:
+        try:
+            return [base64.b64decode(b"".join(block.split()), validate=True) for block in blocks]
+        except binascii.Error as e:
+            raise CertificateParseError(f"Bad PEM block: {e}") from e
+    if data[:1] == b"\x30":
+        return [data]
+    return []
+
+
+def parse_file(path, known_digest=None):
+    """Parse every certificate in a file.
+
+    Returns (path, sha256 hex, [(subject CN, notAfter), ...], error or None);
+    never raises, so it can be mapped over many files in a process pool. If
+    the content still hashes to `known_digest` it is not parsed and the
+    certificate list is None.
+    """
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except OSError as e:
+        return path, None, [], str(e)
+    digest = hashlib.sha256(data).hexdigest()
+    if digest == known_digest:
+        return path, digest, None, None
+    try:
+        return path, digest, [parse_der(der) for der in certificates(data)], None
+    except CertificateParseError as e:
+        return path, digest, [], str(e)
+
+
+def file_expiry(path, index=0):
+    _, _, certs, error = parse_file(path)
+    if error:
+        raise CertificateParseError(f"{path}: {error}")
+    if index >= len(certs):
+        raise CertificateParseError(f"{path}: no certificate #{index}")
+    return certs[index][1]
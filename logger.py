@@ -1,16 +1,133 @@
 # logger.py
+# Records are handed to a bounded queue and written by a background listener
+# thread, so a slow disk or terminal never blocks a request or a scan worker.
+import atexit
+import json
 import logging
+import logging.handlers
 import os
+import queue
+from datetime import datetime, timezone
+from config import (
+    LOG_DIR,
+    LOG_FILE,
+    LOG_LEVEL,
+    LOG_LEVELS,
+    LOG_FORMAT,
+    LOG_MAX_BYTES,
+    LOG_BACKUP_COUNT,
+    LOG_ROTATE_WHEN,
+    LOG_ROTATE_EXTERNALLY,
+    LOG_QUEUE_SIZE
+)
 
-os.makedirs("logs", exist_ok=True)
+TEXT_FORMAT = '[%(asctime)s] %(levelname)s - %(message)s'
 
-logging.basicConfig(
-    level=logging.INFO,
-    format='[%(asctime)s] %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler("logs/expiry_watch.log"),
-        logging.StreamHandler()
-    ]
-)
+# Attributes every LogRecord has; anything else was passed via `extra=`
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    # One JSON object per line; `extra={"service_id": 3, "host": ...}` fields become keys
+
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    # Never blocks the caller: when the writer falls behind, records are
+    # dropped and counted, and the count is reported once it catches up.
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            if self.dropped and self.queue.qsize() < self.queue.maxsize // 2:
+                dropped, self.dropped = self.dropped, 0
+                self.queue.put_nowait(logging.makeLogRecord({
+                    "name": "expiry_watch", "levelno": logging.WARNING, "levelname": "WARNING",
+                    "msg": f"Log queue overflowed, dropped {dropped} record(s)",
+                }))
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def _file_handler(path):
+    # The rotating handlers are single-process: two processes rotating one
+    # file rename it under each other and lose lines
+    if LOG_ROTATE_EXTERNALLY:
+        return logging.handlers.WatchedFileHandler(path)
+    if LOG_ROTATE_WHEN:
+        return logging.handlers.TimedRotatingFileHandler(path, when=LOG_ROTATE_WHEN, backupCount=LOG_BACKUP_COUNT)
+    return logging.handlers.RotatingFileHandler(path, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT)
+
+
+_queue_handler = None
+_handlers = []
+listener = None
+
+
+def _start_listener():
+    # One listener thread per process. A forked child inherits the queue
+    # handler but not the thread, so it gets a fresh queue and listener.
+    global listener
+    log_queue = queue.Queue(LOG_QUEUE_SIZE)
+    _queue_handler.queue = log_queue
+    _queue_handler.dropped = 0
+    listener = logging.handlers.QueueListener(log_queue, *_handlers, respect_handler_level=True)
+    listener.start()
+
+
+def _stop_listener():
+    # Flush whatever is still queued when the process exits
+    if listener is not None and listener._thread is not None:
+        listener.stop()
+
+
+def _setup():
+    global _queue_handler, _handlers
+    root = logging.getLogger()
+    if any(isinstance(handler, DroppingQueueHandler) for handler in root.handlers):
+        return
+
+    os.makedirs(LOG_DIR, exist_ok=True)
+    formatter = JsonFormatter() if LOG_FORMAT == "json" else logging.Formatter(TEXT_FORMAT)
+    _handlers = [_file_handler(os.path.join(LOG_DIR, LOG_FILE)), logging.StreamHandler()]
+    for handler in _handlers:
+        handler.setFormatter(formatter)
+
+    _queue_handler = DroppingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+    root.addHandler(_queue_handler)
+    root.setLevel(LOG_LEVEL)
+    for name, level in LOG_LEVELS.items():
+        logging.getLogger(name).setLevel(level)
+
+    _start_listener()
+    atexit.register(_stop_listener)
+    if hasattr(os, "register_at_fork"):
+        # e.g. gunicorn workers forked from a master that imported this module
+        os.register_at_fork(after_in_child=_start_listener)
+
+
+_setup()
 
 logger = logging.getLogger("expiry_watch")
+
+
+def get_logger(name):
+    # Per-module loggers ("expiry_watch.scan", ...) whose level LOG_LEVELS can set
+    return logger.getChild(name)
@@ -0,0 +1,210 @@
+import random
+import smtplib
+import threading
+import time
+from database import get_db_connection
+from email_utils import Mailer
+from metrics import registry
+from config import (
+    OUTBOX_WORKERS,
+    OUTBOX_MAX_ATTEMPTS,
+    OUTBOX_BACKOFF_BASE,
+    OUTBOX_BACKOFF_MAX,
+    OUTBOX_POLL_INTERVAL,
+    OUTBOX_CLAIM_TIMEOUT,
+    OUTBOX_SENT_RETENTION
+)
+from logger import logger
+
+
+OUTBOX_DELIVERY_SECONDS = registry.histogram(
+    "expirywatch_outbox_delivery_seconds", "Time from enqueue to successful SMTP delivery.",
+    buckets=(0.1, 0.5, 1, 5, 15, 60, 300, 900, 3600, 21600))
+
+
+def _outbox_depth():
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT status, COUNT(*) FROM outbox WHERE status IN ('pending', 'sending', 'dead') GROUP BY status"
+        )
+        counts = {("pending",): 0, ("sending",): 0, ("dead",): 0}
+        counts.update({(status,): count for status, count in cursor.fetchall()})
+        return counts
+    finally:
+        conn.close()
+
+
+registry.gauge("expirywatch_outbox_messages", "Outbox messages not yet delivered, by status.", ["status"], _outbox_depth)
+
+
+def enqueue_many(messages, conn):
+    # messages: (recipients list, subject, body). The rows join the caller's
+    # transaction; the caller commits and calls delivery_workers.notify().
+    now = time.time()
+    # Delivered mail is only kept for queue_stats and troubleshooting
+    conn.execute("DELETE FROM outbox WHERE status = 'sent' AND sent_at < ?", (now - OUTBOX_SENT_RETENTION,))
+    rows = []
+    for recipients, subject, body in messages:
+        if not recipients:
+            # Would only be dead-lettered by the workers
+            logger.warning("Not queueing %r: no recipients", subject)
+            continue
+        rows.append((",".join(recipients), subject, body, now, now))
+    if not rows:
+        return 0
+    conn.executemany(
+        "INSERT INTO outbox (recipients, subject, body, created_at, next_attempt_at) VALUES (?, ?, ?, ?, ?)", rows
+    )
+    return len(rows)
+
+
+def claim_next():
+    # A single UPDATE ... RETURNING, so concurrent workers (or processes)
+    # never claim the same message. Stale 'sending' rows belong to a crashed worker.
+    now = time.time()
+    conn = get_db_connection()
+    with conn:
+        row = conn.execute("""
+            UPDATE outbox SET status = 'sending', claimed_at = ?, attempts = attempts + 1
+            WHERE id = (
+                SELECT id FROM outbox
+                WHERE (status = 'pending' AND next_attempt_at <= ?)
+                   OR (status = 'sending' AND claimed_at < ?)
+                ORDER BY next_attempt_at
+                LIMIT 1
+            )
+            RETURNING id, recipients, subject, body, attempts, created_at
+        """, (now, now, now - OUTBOX_CLAIM_TIMEOUT)).fetchone()
+    return row
+
+
+def _is_permanent(error):
+    # Only the server rejecting this message (5xx to RCPT or DATA) is final.
+    # Connection and login failures, 535 included, say nothing about the
+    # message and are retried, so a bad password can't dead-letter the outbox.
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return True
+    return isinstance(error, smtplib.SMTPDataError) and 500 <= error.smtp_code < 600
+
+
+def _backoff(attempts):
+    delay = min(OUTBOX_BACKOFF_BASE * 2 ** (attempts - 1), OUTBOX_BACKOFF_MAX)
+    return delay * random.uniform(0.8, 1.2)
+
+
+def mark_sent(message_id):
+    conn = get_db_connection()
+    with conn:
+        conn.execute(
+            "UPDATE outbox SET status = 'sent', sent_at = ?, last_error = NULL WHERE id = ?",
+            (time.time(), message_id)
+        )
+
+
+def mark_failed(message_id, attempts, error):
+    dead = _is_permanent(error) or attempts >= OUTBOX_MAX_ATTEMPTS
+    conn = get_db_connection()
+    with conn:
+        conn.execute(
+            "UPDATE outbox SET status = ?, next_attempt_at = ?, last_error = ? WHERE id = ?",
+            ("dead" if dead else "pending", time.time() + _backoff(attempts), str(error), message_id)
+        )
+    return dead
+
+
+def queue_stats(window=3600):
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT status, COUNT(*) FROM outbox GROUP BY status")
+    stats = {status: 0 for status in ("pending", "sending", "sent", "dead")}
+    stats.update(dict(cursor.fetchall()))
+
+    now = time.time()
+    cursor.execute("SELECT MIN(created_at) FROM outbox WHERE status IN ('pending', 'sending')")
+    oldest = cursor.fetchone()[0]
+    cursor.execute(
+        "SELECT COUNT(*), AVG(sent_at - created_at), MAX(sent_at - created_at) FROM outbox "
+        "WHERE status = 'sent' AND sent_at >= ?",
+        (now - window,)
+    )
+    delivered, avg_latency, max_latency = cursor.fetchone()
+    conn.close()
+
+    stats["oldest_pending_age"] = now - oldest if oldest else 0
+    stats["delivered_recently"] = delivered
+    stats["avg_delivery_latency"] = avg_latency or 0
+    stats["max_delivery_latency"] = max_latency or 0
+    return stats
+
+
+class DeliveryWorkers:
+    # Each worker owns one Mailer, so its SMTP session is reused across messages.
+
+    def __init__(self, workers=OUTBOX_WORKERS, mailer_factory=Mailer):
+        self.workers = workers
+        self.mailer_factory = mailer_factory
+        self._wakeup = threading.Condition()
+        self._stopping = threading.Event()
+        self._threads = []
+
+    def start(self):
+        if self._threads:
+            return
+        self._stopping.clear()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"outbox-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info("Started %s outbox delivery workers.", self.workers)
+
+    def stop(self, timeout=None):
+        self._stopping.set()
+        self.notify()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def notify(self):
+        with self._wakeup:
+            self._wakeup.notify_all()
+
+    def _run(self):
+        with self.mailer_factory() as mailer:
+            while not self._stopping.is_set():
+                try:
+                    message = claim_next()
+                except Exception as e:
+                    logger.error("Outbox claim failed: %s", e)
+                    message = None
+                if message is None:
+                    # Idle workers drop their SMTP session instead of letting it time out
+                    mailer.close()
+                    with self._wakeup:
+                        self._wakeup.wait(OUTBOX_POLL_INTERVAL)
+                    continue
+                try:
+                    self._deliver(mailer, *message)
+                except Exception:
+                    # e.g. "database is locked" recording the outcome; the claim
+                    # times out and the message is retried, so keep the worker alive
+                    logger.exception("Outbox message %s: delivery bookkeeping failed", message[0])
+
+    def _deliver(self, mailer, message_id, recipients, subject, body, attempts, created_at):
+        try:
+            mailer.send(recipients.split(","), subject, body)
+        except Exception as e:
+            if mark_failed(message_id, attempts, e):
+                logger.error("Outbox message %s dead-lettered after %s attempt(s): %s", message_id, attempts, e)
+            else:
+                logger.warning("Outbox message %s attempt %s failed, will retry: %s", message_id, attempts, e)
+            return
+        mark_sent(message_id)
+        latency = time.time() - created_at
+        logger.info("Email sent to %s (%.1fs after enqueue)", recipients, latency,
+                    extra={"message_id": message_id, "duration_ms": round(latency * 1000)})
+        OUTBOX_DELIVERY_SECONDS.observe(latency)
+
+
+delivery_workers = DeliveryWorkers()
@@ -0,0 +1,296 @@
+import atexit
+import bisect
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from config import METRICS_DIR, METRICS_FLUSH_INTERVAL
+from logger import logger
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs += [f'{name}="{_escape(value)}"' for name, value in extra]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._values)
+
+    @staticmethod
+    def merge(into, values):
+        for labels, value in values.items():
+            into[labels] = into.get(labels, 0) + value
+
+    def reset(self):
+        with self._lock:
+            self._values = {}
+
+    def render(self, values=None):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        values = self.snapshot() if values is None else values
+        for labels, value in values.items():
+            lines.append(f"{self.name}{_labels(self.labelnames, labels)} {value}")
+        return lines
+
+
+class Histogram:
+    # Bucket counts are stored per bucket and made cumulative only when rendered,
+    # so observe() is a bisect plus three additions under a lock.
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, *labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labels)
+
+    def snapshot(self):
+        with self._lock:
+            return {labels: [list(counts), total, count] for labels, (counts, total, count) in self._series.items()}
+
+    @staticmethod
+    def merge(into, series):
+        for labels, (counts, total, count) in series.items():
+            mine = into.get(labels)
+            if mine is None:
+                into[labels] = [list(counts), total, count]
+                continue
+            mine[0] = [a + b for a, b in zip(mine[0], counts)]
+            mine[1] += total
+            mine[2] += count
+
+    def reset(self):
+        with self._lock:
+            self._series = {}
+
+    def render(self, series=None):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        series = self.snapshot() if series is None else series
+        for labels, (counts, total, count) in series.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, [('le', bound)])} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {total}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {count}")
+        return lines
+
+
+class Gauge:
+    # Value is read from `collect()` at scrape time: a dict of label tuple -> value
+
+    def __init__(self, name, help_text, labelnames, collect):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self.collect = collect
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} gauge"]
+        for labels, value in self.collect().items():
+            lines.append(f"{self.name}{_labels(self.labelnames, labels)} {value}")
+        return lines
+
+
+class MetricsStore:
+    """Counter and histogram state shared between the processes of one server.
+
+    Each process writes its own values to `<pid>-<start>.json` in `directory`
+    every METRICS_FLUSH_INTERVAL seconds and at exit; a scrape sums every
+    file, so whichever gunicorn worker answers reports the same, monotonic
+    totals, including the leader's scan, SMTP and outbox series. Files of
+    exited workers are kept so their counts don't vanish; the directory is
+    emptied when the server starts (clear()).
+    """
+
+    def __init__(self, directory, registry, interval):
+        self.directory = directory
+        self.registry = registry
+        self.interval = interval
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, f"{os.getpid()}-{time.time_ns()}.json")
+        self._stop = threading.Event()
+        threading.Thread(target=self._run, name="metrics-flush", daemon=True).start()
+        atexit.register(self.write)
+
+    @staticmethod
+    def clear(directory):
+        if os.path.isdir(directory):
+            for name in os.listdir(directory):
+                if name.endswith(".json"):
+                    os.remove(os.path.join(directory, name))
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.write()
+            except OSError as e:
+                logger.warning("Cannot write metrics snapshot %s: %s", self.path, e)
+
+    def stop(self):
+        self._stop.set()
+
+    def write(self, states=None):
+        states = self.registry.snapshot() if states is None else states
+        data = {name: [[list(labels), value] for labels, value in values.items()] for name, values in states.items()}
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp, self.path)
+
+    def others(self):
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if not name.endswith(".json") or path == self.path:
+                continue
+            try:
+                with open(path) as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                continue  # replaced or half-written while we listed
+            yield {metric: {tuple(labels): value for labels, value in values} for metric, values in data.items()}
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+        self.store = None
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text, labelnames=()):
+        return self.register(Counter(name, help_text, labelnames))
+
+    def histogram(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, help_text, labelnames, buckets))
+
+    def gauge(self, name, help_text, labelnames, collect):
+        return self.register(Gauge(name, help_text, labelnames, collect))
+
+    def _stateful(self):
+        with self._lock:
+            return [metric for metric in self._metrics if hasattr(metric, "snapshot")]
+
+    def snapshot(self):
+        return {metric.name: metric.snapshot() for metric in self._stateful()}
+
+    def share(self, directory, interval):
+        # Called by each serving process; see MetricsStore
+        if self.store is None:
+            self.store = MetricsStore(directory, self, interval)
+
+    def _after_fork(self):
+        # A forked child starts from zero: the parent's counts are its own to report
+        for metric in self._stateful():
+            metric.reset()
+        self.store = None
+
+    def render(self):
+        lines = []
+        with self._lock:
+            metrics = list(self._metrics)
+        states = self.snapshot()
+        if self.store is not None:
+            self.store.write(states)
+            by_name = {metric.name: metric for metric in metrics if metric.name in states}
+            for other in self.store.others():
+                for name, values in other.items():
+                    if name in by_name:
+                        by_name[name].merge(states[name], values)
+        for metric in metrics:
+            try:
+                lines.extend(metric.render(states[metric.name]) if metric.name in states else metric.render())
+            except Exception:
+                # A failing gauge callback must not break the whole scrape
+                continue
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=registry._after_fork)
+
+PROBE_PHASE_SECONDS = registry.histogram(
+    "expirywatch_probe_phase_seconds", "Certificate probe time per phase (dns, connect, tls).", ["phase"])
+PROBE_TOTAL = registry.counter(
+    "expirywatch_probe_total", "Certificate probes by outcome.", ["outcome"])
+SCAN_RUN_SECONDS = registry.histogram(
+    "expirywatch_scan_run_seconds", "Duration of certificate scan runs.", ["mode"],
+    buckets=(1, 5, 15, 30, 60, 300, 900, 1800, 3600, 7200))
+SMTP_SEND_SECONDS = registry.histogram(
+    "expirywatch_smtp_send_seconds", "Time to hand one message to the SMTP relay.")
+SMTP_FAILURES = registry.counter(
+    "expirywatch_smtp_send_failures_total", "SMTP sends that raised, by exception type.", ["error"])
+DB_QUERY_SECONDS = registry.histogram(
+    "expirywatch_db_query_seconds", "SQLite statement execution time by statement type.", ["statement"],
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5))
+HTTP_REQUEST_SECONDS = registry.histogram(
+    "expirywatch_http_request_seconds", "HTTP request latency by route.", ["method", "endpoint", "status"])
+
+
+def init_app(app):
+    from flask import Response, g, request
+
+    if METRICS_DIR:
+        registry.share(METRICS_DIR, METRICS_FLUSH_INTERVAL)
+
+    @app.before_request
+    def _start_timer():
+        g.metrics_started = time.perf_counter()
+
+    @app.after_request
+    def _observe(response):
+        started = g.pop("metrics_started", None)
+        if started is not None:
+            HTTP_REQUEST_SECONDS.observe(
+                time.perf_counter() - started, request.method, request.endpoint or "unmatched", response.status_code
+            )
+        return response
+
+    @app.route("/metrics")
+    def metrics():
+        return Response(registry.render(), mimetype="text/plain; version=0.0.4")
@@ -0,0 +1,114 @@
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from scan_engine import probe_service, store_results
+from database import get_db_connection
+from config import (
+    SCAN_PROBE_TIMEOUT,
+    PROBE_JOB_WORKERS,
+    PROBE_JOB_RETENTION
+)
+from logger import logger
+
+FINISHED = ("done", "failed")
+
+
+class ProbeJobs:
+    # Job state lives in the probe_jobs table so any web worker can report it;
+    # the in-process events only make long-polls on the submitting worker instant.
+
+    def __init__(self, workers=PROBE_JOB_WORKERS):
+        self.workers = workers
+        self._executor = None
+        self._events = {}
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="probe-job")
+            return self._executor
+
+    def submit(self, service_id, url):
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        conn = get_db_connection()
+        with conn:
+            conn.execute("DELETE FROM probe_jobs WHERE created_at < ?", (now - PROBE_JOB_RETENTION,))
+            conn.execute(
+                "INSERT INTO probe_jobs (id, service_id, url, status, created_at) VALUES (?, ?, ?, 'queued', ?)",
+                (job_id, service_id, url, now)
+            )
+        conn.close()
+
+        with self._lock:
+            self._events[job_id] = threading.Event()
+        self._get_executor().submit(self._run, job_id, service_id, url)
+        return job_id
+
+    def _run(self, job_id, service_id, url):
+        conn = get_db_connection()
+        try:
+            with conn:
+                conn.execute("UPDATE probe_jobs SET status = 'running' WHERE id = ?", (job_id,))
+
+            result = probe_service(service_id, url, SCAN_PROBE_TIMEOUT)
+            error = result["error"]
+            expiry_str = result["expiry"].strftime("%Y-%m-%d") if error is None else None
+            if error:
+                logger.error("Certificate check failed for %s: %s", url, error)
+
+            list(store_results([result]))
+            with conn:
+                conn.execute(
+                    "UPDATE probe_jobs SET status = ?, certificate_expiry = ?, error = ?, finished_at = ? WHERE id = ?",
+                    ("failed" if error else "done", expiry_str, error, time.time(), job_id)
+                )
+        except Exception as e:
+            logger.error("Probe job %s for service ID %s crashed: %s", job_id, service_id, e)
+        finally:
+            conn.close()
+            with self._lock:
+                event = self._events.pop(job_id, None)
+            if event:
+                event.set()
+
+    def get(self, job_id):
+        conn = get_db_connection()
+        try:
+            cursor = conn.cursor()
+            # The service's failure state says when a failing host will be tried again
+            cursor.execute(
+                "SELECT j.id, j.service_id, j.url, j.status, j.certificate_expiry, j.error, s.error_class, "
+                "s.next_retry_at, j.created_at, j.finished_at "
+                "FROM probe_jobs j LEFT JOIN services s ON s.id = j.service_id WHERE j.id = ?",
+                (job_id,)
+            )
+            row = cursor.fetchone()
+        finally:
+            conn.close()
+        if not row:
+            return None
+        keys = ("id", "service_id", "url", "status", "certificate_expiry", "error", "error_class", "next_retry_at",
+                "created_at", "finished_at")
+        return dict(zip(keys, row))
+
+    def wait(self, job_id, timeout):
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            event = self._events.get(job_id)
+        if event:
+            event.wait(timeout)
+            return self.get(job_id)
+
+        # Submitted by another process: fall back to polling the table
+        while True:
+            job = self.get(job_id)
+            remaining = deadline - time.monotonic()
+            if job is None or job["status"] in FINISHED or remaining <= 0:
+                return job
+            time.sleep(min(0.25, remaining))
+
+
+probe_jobs = ProbeJobs()
@@ -0,0 +1,316 @@
+"""On-demand cProfile captures of requests and scheduled jobs.
+
+Off by default (PROFILING_ENABLED) and switchable at runtime through
+/admin/profiles/config. While off, each request pays one attribute check
+and a clock read. While on, a request is profiled when it carries
+PROFILE_REQUEST_HEADER or wins the PROFILE_REQUEST_SAMPLE_RATE draw, and
+runs of the jobs named in PROFILE_JOBS are always profiled.
+
+Settings and captures live in PROFILE_DIR, shared by every process of the
+server: a toggle made through any worker reaches the others (and the
+scheduler leader) within PROFILE_SETTINGS_REFRESH seconds, and any worker
+can list and serve any capture. The newest PROFILE_RING_SIZE are kept.
+
+cProfile only sees the thread it was started on: work a job hands to the
+probe or delivery pools shows up as time spent waiting for it.
+"""
+import cProfile
+import functools
+import itertools
+import json
+import marshal
+import os
+import random
+import re
+import threading
+import time
+from config import (
+    PROFILING_ENABLED,
+    PROFILE_REQUEST_SAMPLE_RATE,
+    PROFILE_REQUEST_HEADER,
+    PROFILE_JOBS,
+    PROFILE_RING_SIZE,
+    PROFILE_DIR,
+    PROFILE_SETTINGS_REFRESH
+)
+from logger import logger
+
+# Collapsed stacks leave out paths worth less than this share of the total
+COLLAPSED_MIN_SHARE = 0.0001
+COLLAPSED_MAX_DEPTH = 100
+PROFILE_ID = re.compile(r"^[0-9]+-[0-9]+-[0-9]+$")
+
+
+class Profile:
+    def __init__(self, meta, stats):
+        self.meta = meta  # what summary() returns; see Profiler.finish
+        self.id = meta["id"]
+        self.stats = stats  # pstats' {func: (cc, nc, tt, ct, callers)}
+
+    def summary(self):
+        return dict(self.meta)
+
+    def pstats(self):
+        # The same marshalled dict Stats.dump_stats writes; load with pstats.Stats(path)
+        return marshal.dumps(self.stats)
+
+    def top(self, limit=20):
+        rows = sorted(self.stats.items(), key=lambda item: item[1][3], reverse=True)[:limit]
+        return [
+            {"function": _label(func), "calls": nc, "tottime_ms": round(tt * 1000, 3), "cumtime_ms": round(ct * 1000, 3)}
+            for func, (cc, nc, tt, ct, callers) in rows
+        ]
+
+    def collapsed(self):
+        """Brendan Gregg's folded format ("a;b;c <microseconds>" per line).
+
+        cProfile records caller -> callee edges, not whole stacks, so each
+        function's time is split across its callers in proportion to the time
+        it spent under each of them. Recursive calls are folded into the outer
+        frame.
+        """
+        callees = {}
+        for func, (cc, nc, tt, ct, callers) in self.stats.items():
+            for caller, edge in callers.items():
+                callees.setdefault(caller, []).append((func, edge[3]))
+        roots = [func for func, entry in self.stats.items() if not entry[4]]
+        total = sum(self.stats[func][3] for func in roots)
+        min_time = max(total * COLLAPSED_MIN_SHARE, 1e-6)
+        folded = {}
+
+        def walk(func, stack, share):
+            cc, nc, tt, ct, callers = self.stats[func]
+            if tt * share >= 1e-6:
+                key = ";".join(stack)
+                folded[key] = folded.get(key, 0) + tt * share
+            if len(stack) >= COLLAPSED_MAX_DEPTH:
+                return
+            for callee, edge_time in callees.get(func, ()):
+                callee_time = self.stats[callee][3]
+                label = _label(callee)
+                if edge_time * share < min_time or callee_time <= 0 or label in stack:
+                    continue
+                walk(callee, stack + [label], edge_time * share / callee_time)
+
+        for root in roots:
+            walk(root, [_label(root)], 1.0)
+        return "".join(f"{stack} {int(round(seconds * 1e6))}\n"
+                       for stack, seconds in sorted(folded.items()) if seconds >= 5e-7)
+
+
+def _label(func):
+    filename, line, name = func
+    if filename == "~":  # built-ins
+        label = name
+    else:
+        label = f"{name} ({os.path.basename(filename)}:{line})"
+    return label.replace(";", ",")
+
+
+class Profiler:
+    def __init__(self, directory=PROFILE_DIR, enabled=PROFILING_ENABLED, sample_rate=PROFILE_REQUEST_SAMPLE_RATE,
+                 jobs=PROFILE_JOBS, size=PROFILE_RING_SIZE, refresh=PROFILE_SETTINGS_REFRESH):
+        self.directory = directory
+        self.enabled = enabled
+        self.sample_rate = sample_rate
+        self.jobs = set(jobs)
+        self.size = size
+        self.refresh = refresh
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._settings_mtime = None
+        self._next_sync = 0.0
+
+    @property
+    def _settings_path(self):
+        return os.path.join(self.directory, "settings.json")
+
+    def _write(self, name, data, mode="w"):
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, name)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, mode) as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    def active(self):
+        # The per-request check: settings written by another process apply once
+        # this one's refresh interval has passed
+        if time.monotonic() >= self._next_sync:
+            self.sync()
+        return self.enabled
+
+    def sync(self):
+        self._next_sync = time.monotonic() + self.refresh
+        try:
+            mtime = os.stat(self._settings_path).st_mtime_ns
+        except OSError:
+            return  # never configured at runtime: config.py defaults apply
+        if mtime == self._settings_mtime:
+            return
+        try:
+            with open(self._settings_path) as f:
+                settings = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning("Cannot read profiling settings: %s", e)
+            return
+        with self._lock:
+            self._settings_mtime = mtime
+            self.enabled = settings["enabled"]
+            self.sample_rate = settings["sample_rate"]
+            self.jobs = set(settings["jobs"])
+            self.size = settings["size"]
+
+    def configure(self, enabled=None, sample_rate=None, jobs=None, size=None):
+        self.sync()
+        with self._lock:
+            if sample_rate is not None:
+                self.sample_rate = sample_rate
+            if jobs is not None:
+                self.jobs = set(jobs)
+            if size is not None:
+                self.size = size
+            if enabled is not None:
+                self.enabled = enabled
+            self._write("settings.json", json.dumps(self.settings()))
+            self._settings_mtime = os.stat(self._settings_path).st_mtime_ns
+        self._prune()
+        logger.info("Profiling %s (request sample rate %s, jobs %s)",
+                    "enabled" if self.enabled else "disabled", self.sample_rate, sorted(self.jobs) or "none")
+
+    def settings(self):
+        return {"enabled": self.enabled, "sample_rate": self.sample_rate, "jobs": sorted(self.jobs),
+                "size": self.size}
+
+    def start(self):
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Another profiler (or a debugger's tracer) already owns this thread
+            return None
+        return profile, time.time(), time.perf_counter()
+
+    def finish(self, capture, kind, name, status=None):
+        profile, started, started_counter = capture
+        profile.disable()
+        duration = time.perf_counter() - started_counter
+        profile.create_stats()
+        # Ids sort by capture time and are unique across processes
+        profile_id = f"{time.time_ns()}-{os.getpid()}-{next(self._ids)}"
+        meta = {
+            "id": profile_id,
+            "kind": kind,
+            "name": name,
+            "started": started,
+            "duration_ms": round(duration * 1000, 1),
+            "status": status,
+            "functions": len(profile.stats),
+            "pid": os.getpid(),
+        }
+        entry = Profile(meta, profile.stats)
+        try:
+            # Stats first: a listed capture can always be downloaded
+            self._write(f"{profile_id}.pstats", entry.pstats(), "wb")
+            self._write(f"{profile_id}.json", json.dumps(meta))
+            self._prune()
+        except OSError as e:
+            logger.warning("Cannot store profile %s: %s", profile_id, e)
+        return entry
+
+    def _ids_on_disk(self):
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return []
+        return sorted((name[:-5] for name in names if name.endswith(".json") and PROFILE_ID.match(name[:-5])),
+                      key=lambda profile_id: [int(part) for part in profile_id.split("-")])
+
+    def _remove(self, profile_id):
+        for suffix in (".json", ".pstats"):
+            try:
+                os.remove(os.path.join(self.directory, profile_id + suffix))
+            except OSError:
+                pass
+
+    def _prune(self):
+        ids = self._ids_on_disk()
+        for profile_id in ids[:max(len(ids) - self.size, 0)]:
+            self._remove(profile_id)
+
+    def get(self, profile_id):
+        if not PROFILE_ID.match(profile_id):
+            return None
+        try:
+            with open(os.path.join(self.directory, f"{profile_id}.json")) as f:
+                meta = json.load(f)
+            with open(os.path.join(self.directory, f"{profile_id}.pstats"), "rb") as f:
+                stats = marshal.load(f)
+        except (OSError, ValueError, EOFError):
+            return None
+        return Profile(meta, stats)
+
+    def list(self):
+        entries = []
+        for profile_id in reversed(self._ids_on_disk()):
+            try:
+                with open(os.path.join(self.directory, f"{profile_id}.json")) as f:
+                    entries.append(json.load(f))
+            except (OSError, ValueError):
+                continue  # pruned while we listed
+        return entries
+
+    def clear(self):
+        for profile_id in self._ids_on_disk():
+            self._remove(profile_id)
+
+    def wants_request(self, headers):
+        return bool(headers.get(PROFILE_REQUEST_HEADER)) or (
+            self.sample_rate > 0 and random.random() < self.sample_rate)
+
+    def job(self, name, func):
+        # Wraps a scheduled job; costs one check per run unless `name` is being profiled
+        @functools.wraps(func)
+        def run(*args, **kwargs):
+            if not (self.active() and name in self.jobs):
+                return func(*args, **kwargs)
+            capture = self.start()
+            if capture is None:
+                return func(*args, **kwargs)
+            status = "error"
+            try:
+                result = func(*args, **kwargs)
+                status = "ok"
+                return result
+            finally:
+                entry = self.finish(capture, "job", name, status)
+                logger.info("Profiled job %s in %.1fs (profile %s)", name, entry.meta["duration_ms"] / 1000, entry.id)
+        return run
+
+
+profiler = Profiler()
+
+
+def init_app(app):
+    from flask import g, request
+
+    @app.before_request
+    def _start_profile():
+        if profiler.active() and profiler.wants_request(request.headers):
+            g.profile_capture = profiler.start()
+
+    @app.after_request
+    def _finish_profile(response):
+        capture = g.pop("profile_capture", None)
+        if capture is not None:
+            entry = profiler.finish(capture, "request", f"{request.method} {request.path}", response.status_code)
+            response.headers["X-Profile-Id"] = str(entry.id)
+        return response
+
+    @app.teardown_request
+    def _abandon_profile(exc):
+        # after_request is skipped when a view raises
+        capture = g.pop("profile_capture", None)
+        if capture is not None:
+            profiler.finish(capture, "request", f"{request.method} {request.path}", 500)
+
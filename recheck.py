@@ -0,0 +1,127 @@
+import threading
+import time
+from datetime import datetime
+from contextlib import nullcontext
+from database import get_db_connection
+from leasing import Leases
+from metrics import SCAN_RUN_SECONDS
+from profiling import profiler
+from scan_engine import iter_scan, store_results, ScanSummary, TIMESTAMP_FORMAT
+from config import (
+    RECHECK_MAX_PROBES_PER_MINUTE,
+    RECHECK_POLL_INTERVAL,
+    RECHECK_BATCH_SIZE,
+    WORK_SHARDING
+)
+from logger import logger
+
+
+class RateLimiter:
+    # Token bucket that releases probes evenly instead of in bursts
+
+    def __init__(self, per_minute, burst=1):
+        self.interval = 60.0 / per_minute
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, stop_event=None):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) / self.interval)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return True
+                wait = (1 - self._tokens) * self.interval
+            if stop_event is None:
+                time.sleep(wait)
+            elif stop_event.wait(wait):
+                return False
+
+
+class AdaptiveScheduler:
+    # Re-checks each service when its own next_check_at comes due instead of
+    # re-probing everything at once. The next_check_at index is the priority
+    # queue: never-checked services (NULL) sort first, then the most overdue.
+
+    def __init__(self, per_minute=RECHECK_MAX_PROBES_PER_MINUTE,
+                 poll_interval=RECHECK_POLL_INTERVAL, batch_size=RECHECK_BATCH_SIZE):
+        self.limiter = RateLimiter(per_minute)
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        # Sharded replicas lease due rows so each is re-checked by one of them;
+        # leases are released once the new next_check_at is stored
+        self.leases = Leases("recheck", batch_size=batch_size) if WORK_SHARDING else None
+        self._stop = threading.Event()
+        self._thread = None
+        self._run_pass = profiler.job("adaptive_recheck", self.run_once)
+
+    def start(self):
+        if self._thread:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="adaptive-recheck", daemon=True)
+        self._thread.start()
+        logger.info("Adaptive certificate re-check scheduler started.")
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def due_services(self):
+        now = datetime.utcnow().strftime(TIMESTAMP_FORMAT)
+        if self.leases:
+            return self.leases.claim(
+                "adaptive", "services", "t.id, t.url",
+                "t.next_check_at IS NULL OR t.next_check_at <= ?", (now,), "t.next_check_at"
+            )
+        conn = get_db_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT id, url FROM services WHERE next_check_at IS NULL OR next_check_at <= ? "
+                "ORDER BY next_check_at LIMIT ?",
+                (now, self.batch_size)
+            )
+            return cursor.fetchall()
+        finally:
+            conn.close()
+
+    def run_once(self):
+        due = self.due_services()
+        if not due:
+            return 0
+
+        def paced():
+            for service in due:
+                if not self.limiter.acquire(self._stop):
+                    return
+                yield service
+
+        summary = ScanSummary(f"Adaptive re-check pass ({len(due)} due)")
+        with self.leases or nullcontext(), SCAN_RUN_SECONDS.time("adaptive"):
+            for result in store_results(iter_scan(paced())):
+                summary.add(result)
+        if self.leases:
+            self.leases.release("adaptive", [service_id for service_id, _ in due])
+        summary.log()
+        return len(due)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                due = self._run_pass()
+            except Exception as e:
+                logger.error("Adaptive re-check pass failed: %s", e)
+                due = 0
+            # A full batch means more work is already due; otherwise idle until the next poll
+            if due < self.batch_size:
+                self._stop.wait(self.poll_interval)
+
+
+adaptive_scheduler = AdaptiveScheduler()
@@ -0,0 +1,77 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from database import get_db_connection
+from config import RESPONSE_CACHE_MAX_ENTRIES, RESPONSE_CACHE_MAX_BYTES
+
+
+def table_version(table, conn=None):
+    # Bumped by triggers on every insert/update/delete (migration 11), whichever process wrote
+    own = conn is None
+    conn = conn or get_db_connection()
+    try:
+        row = conn.execute("SELECT version FROM table_versions WHERE name = ?", (table,)).fetchone()
+    finally:
+        if own:
+            conn.close()
+    return row[0] if row else 0
+
+
+def make_etag(table, version, key):
+    digest = hashlib.sha1(repr(key).encode("utf-8")).hexdigest()[:16]
+    return f"{table}-{version}-{digest}"
+
+
+class ResponseCache:
+    """Serialized response bodies, keyed by (table, version, request key).
+
+    An entry can only be hit while its table is at the version it was built
+    from, so a write anywhere makes it unreachable; entries of older versions
+    are dropped as soon as a newer version is seen, the rest age out LRU.
+    """
+
+    def __init__(self, max_entries=RESPONSE_CACHE_MAX_ENTRIES, max_bytes=RESPONSE_CACHE_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # (table, version, key) -> (body, headers)
+        self._versions = {}  # table -> newest version seen
+        self._bytes = 0
+
+    def get(self, table, version, key):
+        with self._lock:
+            if version > self._versions.get(table, version - 1):
+                self._versions[table] = version
+                for stale in [k for k in self._entries if k[0] == table and k[1] < version]:
+                    self._drop(stale)
+            entry = self._entries.get((table, version, key))
+            if entry is not None:
+                self._entries.move_to_end((table, version, key))
+            return entry
+
+    def put(self, table, version, key, body, headers):
+        size = len(body)
+        if not self.max_entries or size > self.max_bytes // 4:
+            return
+        with self._lock:
+            if version < self._versions.get(table, version):
+                return
+            if (table, version, key) in self._entries:
+                self._drop((table, version, key))
+            self._entries[(table, version, key)] = (body, headers)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._versions.clear()
+            self._bytes = 0
+
+    def _drop(self, cache_key):
+        body, _ = self._entries.pop(cache_key)
+        self._bytes -= len(body)
+
+
+response_cache = ResponseCache()
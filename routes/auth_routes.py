@@ -1,10 +1,18 @@
 from flask import Blueprint, request, jsonify
+from concurrent.futures import TimeoutError as HashTimeout
 from database import get_db_connection
 from auth import generate_token
-import bcrypt
+from password_hashing import password_hasher, HashingBusy
+from logger import logger
 
 auth_bp = Blueprint('auth_bp', __name__)
 
+
+def _too_busy():
+    response = jsonify({"error": "Authentication service busy, retry shortly"})
+    response.headers["Retry-After"] = "1"
+    return response, 429
+
 @auth_bp.route('/register', methods=['POST'])
 def register():
     data = request.json
@@ -13,7 +21,10 @@ def register():
     if not username or not password:
         return jsonify({"error": "Username and password required"}), 400
 
-    password_hash = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
+    try:
+        password_hash = password_hasher.hash(password)
+    except (HashingBusy, HashTimeout):
+        return _too_busy()
 
     conn = get_db_connection()
     cursor = conn.cursor()
@@ -31,13 +42,37 @@ def login():
     data = request.json
     username = data.get('username')
     password = data.get('password')
+    if not username or not password:
+        return jsonify({"error": "Invalid credentials"}), 401
 
     conn = get_db_connection()
     cursor = conn.cursor()
-    cursor.execute("SELECT password_hash FROM users WHERE username = ?", (username,))
+    cursor.execute("SELECT password_hash FROM users WHERE username = ? AND disabled = 0", (username,))
     row = cursor.fetchone()
     conn.close()
-    if row and bcrypt.checkpw(password.encode('utf-8'), row[0]):
-        token = generate_token(username)
-        return jsonify({"token": token})
-    return jsonify({"error": "Invalid credentials"}), 401
+    if not row:
+        return jsonify({"error": "Invalid credentials"}), 401
+
+    try:
+        if not password_hasher.verify(password, row[0]):
+            return jsonify({"error": "Invalid credentials"}), 401
+    except (HashingBusy, HashTimeout):
+        return _too_busy()
+
+    if password_hasher.needs_rehash(row[0]):
+        # BCRYPT_ROUNDS changed since this hash was made: upgrade it while we know
+        # the password. Best effort; under load it simply waits for a later login.
+        try:
+            new_hash = password_hasher.hash(password)
+            conn = get_db_connection()
+            with conn:
+                conn.execute(
+                    "UPDATE users SET password_hash = ? WHERE username = ? AND password_hash = ?",
+                    (new_hash, username, row[0])
+                )
+            logger.info("Rehashed password for %s with cost %s", username, password_hasher.rounds)
+        except (HashingBusy, HashTimeout):
+            pass
+
+    token = generate_token(username)
+    return jsonify({"token": token})
@@ -0,0 +1,38 @@
+from flask import Blueprint, request, jsonify
+from auth import token_required
+from expiry_index import expiry_index
+from config import EXPIRING_MAX_DAYS
+
+expiring_bp = Blueprint('expiring_bp', __name__)
+
+# ?kind= value -> (index kind, label in the response)
+KINDS = {
+    "cert": ("services", "certificate"),
+    "license": ("licenses", "license"),
+}
+
+
+@expiring_bp.route("/expiring", methods=["GET"])
+@token_required
+def expiring():
+    try:
+        days = int(request.args.get("days", 30))
+    except ValueError:
+        return jsonify({"error": "days must be an integer"}), 400
+    if not 0 <= days <= EXPIRING_MAX_DAYS:
+        return jsonify({"error": f"days must be between 0 and {EXPIRING_MAX_DAYS}"}), 400
+
+    kind = request.args.get("kind", "all")
+    if kind != "all" and kind not in KINDS:
+        return jsonify({"error": "kind must be cert, license or all"}), 400
+
+    items = []
+    for key in KINDS if kind == "all" else [kind]:
+        index_kind, label = KINDS[key]
+        items += [
+            {"kind": label, "id": item_id, "name": name, "expiry": expiry, "alert_email": email}
+            for item_id, name, expiry, email in expiry_index.expiring(index_kind, days)
+        ]
+    if kind == "all":
+        items.sort(key=lambda item: item["expiry"])
+    return jsonify(items)
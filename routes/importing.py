@@ -0,0 +1,117 @@
+import csv
+import io
+import itertools
+import json
+import sqlite3
+import tempfile
+from flask import Response
+from database import get_db_connection
+from config import IMPORT_BATCH_SIZE, IMPORT_REPORT_SPOOL_BYTES
+
+JSONL_MIMETYPES = ("application/x-ndjson", "application/jsonl", "application/x-jsonlines")
+
+
+class ImportFormatError(ValueError):
+    pass
+
+
+class ImportRowError(ValueError):
+    pass
+
+
+def open_records(req):
+    # Yields (line number, record dict or ImportRowError) straight off the
+    # request stream, so the upload is never held in memory as a whole.
+    fmt = req.args.get("format")
+    if not fmt:
+        if req.mimetype == "text/csv":
+            fmt = "csv"
+        elif req.mimetype in JSONL_MIMETYPES:
+            fmt = "jsonl"
+    if fmt not in ("csv", "jsonl"):
+        raise ImportFormatError("Send text/csv or application/x-ndjson, or pass ?format=csv|jsonl")
+
+    # utf-8-sig drops the byte order mark Excel puts in front of CSV exports
+    text = io.TextIOWrapper(io.BufferedReader(req.stream), encoding="utf-8-sig", newline="")
+    return _csv_records(text) if fmt == "csv" else _jsonl_records(text)
+
+
+def _csv_records(text):
+    reader = csv.DictReader(text)
+    for row in reader:
+        yield reader.line_num, row
+
+
+def _jsonl_records(text):
+    for line_no, line in enumerate(text, start=1):
+        if not line.strip():
+            continue
+        try:
+            yield line_no, json.loads(line)
+        except ValueError:
+            yield line_no, ImportRowError("Invalid JSON")
+
+
+def run_import(records, import_row, on_commit=None, batch_size=IMPORT_BATCH_SIZE):
+    """Apply `import_row(cursor, record)` to every record, one transaction per batch.
+
+    `import_row` returns a report entry dict with at least "status" and "id",
+    or raises ImportRowError to reject the row. `on_commit` is called with
+    the batch's successful entries once they are committed. The per-row report
+    is spooled to a temporary file and streamed back as NDJSON, ending with a
+    summary line.
+    """
+    report = tempfile.SpooledTemporaryFile(max_size=IMPORT_REPORT_SPOOL_BYTES, mode="w+", encoding="utf-8")
+    summary = {"created": 0, "updated": 0, "error": 0}
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    batch = []
+
+    def commit():
+        conn.commit()
+        if on_commit:
+            on_commit([entry for entry in batch if entry["status"] != "error"])
+        for entry in batch:
+            summary[entry["status"]] += 1
+            report.write(json.dumps(entry) + "\n")
+        batch.clear()
+
+    try:
+        records = iter(records)
+        while True:
+            # Read the whole batch off the upload before taking the write lock,
+            # so a slow client never holds it
+            pending = list(itertools.islice(records, batch_size))
+            if not pending:
+                break
+            # Take the write lock up front so reads and writes in the batch see one snapshot
+            cursor.execute("BEGIN IMMEDIATE")
+            for line_no, record in pending:
+                try:
+                    if isinstance(record, ImportRowError):
+                        raise record
+                    entry = import_row(cursor, record)
+                except ImportRowError as e:
+                    entry = {"status": "error", "error": str(e)}
+                except sqlite3.IntegrityError as e:
+                    entry = {"status": "error", "error": f"Conflicts with an existing row: {e}"}
+                batch.append({"line": line_no, **entry})
+            commit()
+    except BaseException:
+        report.close()
+        raise
+    finally:
+        conn.close()
+
+    report.write(json.dumps({"summary": summary}) + "\n")
+    report.seek(0)
+
+    def stream():
+        with report:
+            while True:
+                chunk = report.read(64 * 1024)
+                if not chunk:
+                    return
+                yield chunk
+
+    return Response(stream(), mimetype="application/x-ndjson")
@@ -1,58 +1,130 @@
 from flask import Blueprint, request, jsonify
 from database import get_db_connection
+from auth import token_required
+from datetime import datetime
+from routes.listing import ListQuery, ListQueryError
+from routes.importing import open_records, run_import, ImportFormatError, ImportRowError
+from routes.services import validate_emails, string_fields
+from expiry_index import expiry_index
 
 license_bp = Blueprint('license_bp', __name__)
 
+
+def is_valid_date(value):
+    # Expiry dates are stored as ISO text so SQL range queries sort correctly
+    try:
+        return datetime.strptime(value, "%Y-%m-%d").strftime("%Y-%m-%d") == value
+    except (TypeError, ValueError):
+        return False
+
+
 @license_bp.route("/add", methods=["POST"])
+@token_required
 def add_license():
     data = request.json
     name = data["name"]
     expiry_date = data["expiry_date"]
     email = data["alert_email"]
+    if not is_valid_date(expiry_date):
+        return jsonify({"error": "expiry_date must be in YYYY-MM-DD format"}), 400
 
     conn = get_db_connection()
     cursor = conn.cursor()
     cursor.execute("INSERT INTO licenses (name, expiry_date, alert_email) VALUES (?, ?, ?)", (name, expiry_date, email))
     conn.commit()
+    expiry_index.put("licenses", cursor.lastrowid, name, expiry_date, email)
     conn.close()
     return jsonify({"status": "License added"}), 201
 
+def _license_id(value):
+    # JSON integers or integer strings only: "1.0" or 1.5 would still match
+    # row 1 through SQLite's type affinity
+    if isinstance(value, int) and not isinstance(value, bool):
+        return value
+    if isinstance(value, str):
+        try:
+            return int(value)
+        except ValueError:
+            pass
+    raise ImportRowError(f"id must be an integer, got {value!r}")
+
+def _import_license(cursor, record):
+    if not isinstance(record, dict) or not all(key in record for key in ["name", "expiry_date", "alert_email"]):
+        raise ImportRowError("Missing required fields (name, expiry_date, alert_email)")
+    fields = string_fields(record, ["name", "expiry_date", "alert_email"])
+    if fields is None:
+        raise ImportRowError("name, expiry_date and alert_email must be non-empty strings")
+    name, expiry_date, email = fields
+    if not is_valid_date(expiry_date):
+        raise ImportRowError("expiry_date must be in YYYY-MM-DD format")
+    if not validate_emails(email):
+        raise ImportRowError("One or more email addresses are invalid")
+
+    # Licenses have no natural key, so only rows that carry an id are updated
+    license_id = record.get("id")
+    if license_id not in (None, ""):
+        license_id = _license_id(license_id)
+        cursor.execute(
+            "UPDATE licenses SET name = ?, expiry_date = ?, alert_email = ? WHERE id = ?",
+            (name, expiry_date, email, license_id)
+        )
+        if cursor.rowcount == 0:
+            raise ImportRowError(f"License {license_id} not found")
+        return {"status": "updated", "id": license_id}
+
+    cursor.execute("INSERT INTO licenses (name, expiry_date, alert_email) VALUES (?, ?, ?)", (name, expiry_date, email))
+    return {"status": "created", "id": cursor.lastrowid}
+
+@license_bp.route("/import", methods=["POST"])
+@token_required
+def import_licenses():
+    try:
+        records = open_records(request)
+    except ImportFormatError as e:
+        return jsonify({"error": str(e)}), 400
+    return run_import(records, _import_license, lambda entries: expiry_index.invalidate())
+
 @license_bp.route("/update/<int:id>", methods=["PUT"])
+@token_required
 def update_license(id):
     data = request.json
     name = data["name"]
     expiry_date = data["expiry_date"]
     email = data["alert_email"]
+    if not is_valid_date(expiry_date):
+        return jsonify({"error": "expiry_date must be in YYYY-MM-DD format"}), 400
 
     conn = get_db_connection()
     cursor = conn.cursor()
     cursor.execute("UPDATE licenses SET name = ?, expiry_date = ?, alert_email = ? WHERE id = ?", (name, expiry_date, email, id))
     conn.commit()
+    if cursor.rowcount:
+        expiry_index.put("licenses", id, name, expiry_date, email)
     conn.close()
     return jsonify({"status": "License updated"})
 
 @license_bp.route("/delete/<int:id>", methods=["DELETE"])
+@token_required
 def delete_license(id):
     conn = get_db_connection()
     cursor = conn.cursor()
     cursor.execute("DELETE FROM licenses WHERE id = ?", (id,))
     conn.commit()
+    expiry_index.remove("licenses", id)
     conn.close()
     return jsonify({"status": "License deleted"})
 
+license_list_query = ListQuery(
+    "licenses",
+    fields=["id", "name", "expiry_date", "alert_email"],
+    default_fields=["id", "name", "expiry_date", "alert_email"],
+    expiry_column="expiry_date"
+)
+
 @license_bp.route("/list", methods=["GET"])
+@token_required
 def list_licenses():
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, name, expiry_date, alert_email FROM licenses")
-    rows = cursor.fetchall()
-    conn.close()
-
-    license_list = [{
-        "id": lid,
-        "name": name,
-        "expiry_date": expiry,
-        "alert_email": email
-    } for lid, name, expiry, email in rows]
-
-    return jsonify(license_list)
+    try:
+        return license_list_query.respond(request.args)
+    except ListQueryError as e:
+        return jsonify({"error": str(e)}), 400
@@ -0,0 +1,169 @@
+import json
+from datetime import datetime, timedelta
+from flask import Response, current_app, jsonify, request, stream_with_context
+from database import get_db_connection
+from response_cache import response_cache, table_version, make_etag
+from config import LIST_MAX_LIMIT, LIST_STREAM_FETCH_SIZE, EXPIRING_MAX_DAYS
+
+# Largest value SQLite can bind as an INTEGER
+SQLITE_MAX_INT = 2 ** 63 - 1
+
+
+class ListQueryError(ValueError):
+    pass
+
+
+class ListQuery:
+    # Translates list endpoint query args into one keyset-paginated SELECT.
+    #   after=<id>                 rows with a larger id (value of X-Next-Cursor)
+    #   limit=<n>                  page size, capped at LIST_MAX_LIMIT
+    #   expiring_within_days=<n>   expiry between today and today + n (indexed)
+    #   name_prefix=<s>            name starts with s (index range on name)
+    #   has_error=true|false       last probe failed / succeeded (rejected for tables without an error column)
+    #   fields=a,b                 projection; id is always included
+    #   format=ndjson              stream one JSON object per line
+    # JSON pages carry a strong ETag derived from the table version and the
+    # query, and their bytes are cached until the next write to the table.
+
+    def __init__(self, table, fields, default_fields, expiry_column, error_column=None):
+        self.table = table
+        self.fields = fields
+        self.default_fields = default_fields
+        self.expiry_column = expiry_column
+        self.error_column = error_column
+
+    def parse(self, args):
+        where, params = [], []
+
+        after = self._int_arg(args, "after", SQLITE_MAX_INT)
+        if after is not None:
+            where.append("id > ?")
+            params.append(after)
+
+        days = self._int_arg(args, "expiring_within_days", EXPIRING_MAX_DAYS)
+        if days is not None:
+            today = datetime.utcnow().date()
+            where.append(f"{self.expiry_column} BETWEEN ? AND ?")
+            params += [today.isoformat(), (today + timedelta(days=days)).isoformat()]
+
+        prefix = args.get("name_prefix")
+        if prefix:
+            # A range instead of LIKE so the name index can be used
+            where.append("name >= ? AND name < ?")
+            params += [prefix, prefix + "\U0010ffff"]
+
+        has_error = args.get("has_error")
+        if has_error is not None:
+            if not self.error_column:
+                raise ListQueryError(f"has_error is not supported for {self.table}")
+            if has_error.lower() not in ("true", "false", "1", "0"):
+                raise ListQueryError("has_error must be true or false")
+            negate = "NOT " if has_error.lower() in ("true", "1") else ""
+            where.append(f"{self.error_column} IS {negate}NULL")
+
+        fields = self.default_fields
+        if args.get("fields"):
+            fields = [f.strip() for f in args["fields"].split(",") if f.strip()]
+            unknown = [f for f in fields if f not in self.fields]
+            if unknown:
+                raise ListQueryError(f"Unknown field(s): {', '.join(unknown)}")
+            if "id" not in fields:
+                fields = ["id"] + fields
+
+        limit = self._int_arg(args, "limit")
+        if limit is not None:
+            limit = min(max(limit, 1), LIST_MAX_LIMIT)
+
+        sql = f"SELECT {', '.join(fields)} FROM {self.table}"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY id"
+        if limit is not None:
+            # One extra row tells us whether there is a next page
+            sql += " LIMIT ?"
+            params.append(limit + 1)
+        return sql, params, fields, limit
+
+    def respond(self, args):
+        sql, params, fields, limit = self.parse(args)
+        if args.get("format") == "ndjson":
+            return self._stream(sql, params, fields, limit)
+
+        # params carry today's date for expiring_within_days, so the key rolls over at midnight
+        key = (sql, tuple(params))
+        conn = get_db_connection()
+        try:
+            # One read snapshot, so the rows are exactly those of the version they are cached under
+            conn.execute("BEGIN")
+            version = table_version(self.table, conn)
+            etag = make_etag(self.table, version, key)
+            if request.if_none_match.contains(etag):
+                return self._cached(b"", {}, etag, status=304)
+            cached = response_cache.get(self.table, version, key)
+            if cached is not None:
+                return self._cached(*cached, etag)
+            cursor = conn.cursor()
+            cursor.execute(sql, params)
+            rows = cursor.fetchall()
+        finally:
+            conn.close()
+
+        headers = {}
+        if limit is not None and len(rows) > limit:
+            rows = rows[:limit]
+            headers["X-Next-Cursor"] = str(rows[-1][0])
+
+        body = jsonify([dict(zip(fields, row)) for row in rows]).get_data()
+        response_cache.put(self.table, version, key, body, headers)
+        return self._cached(body, headers, etag)
+
+    @staticmethod
+    def _cached(body, headers, etag, status=200):
+        response = Response(body, status=status, headers=headers, mimetype=current_app.json.mimetype)
+        response.set_etag(etag)
+        # Clients may keep the page but must revalidate; a 304 costs one tiny query
+        response.headers["Cache-Control"] = "no-cache"
+        return response
+
+    def _stream(self, sql, params, fields, limit):
+        def generate():
+            conn = get_db_connection()
+            try:
+                cursor = conn.cursor()
+                cursor.execute(sql, params)
+                sent = 0
+                last_id = None
+                while True:
+                    rows = cursor.fetchmany(LIST_STREAM_FETCH_SIZE)
+                    if not rows:
+                        return
+                    chunk = []
+                    for row in rows:
+                        if limit is not None and sent >= limit:
+                            # The extra row: hand the client a cursor for the next page
+                            chunk.append(json.dumps({"next_cursor": last_id}) + "\n")
+                            yield "".join(chunk)
+                            return
+                        last_id = row[0]
+                        sent += 1
+                        chunk.append(json.dumps(dict(zip(fields, row))) + "\n")
+                    yield "".join(chunk)
+            finally:
+                conn.close()
+
+        return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+    @staticmethod
+    def _int_arg(args, name, maximum=None):
+        value = args.get(name)
+        if value is None or value == "":
+            return None
+        try:
+            value = int(value)
+        except ValueError:
+            raise ListQueryError(f"{name} must be an integer")
+        if value < 0:
+            raise ListQueryError(f"{name} must not be negative")
+        if maximum is not None and value > maximum:
+            raise ListQueryError(f"{name} must not be more than {maximum}")
+        return value
@@ -0,0 +1,84 @@
+from functools import wraps
+from flask import Blueprint, Response, request, jsonify
+from auth import token_required
+from profiling import profiler
+from config import PROFILING_ADMINS
+
+profiling_bp = Blueprint('profiling_bp', __name__)
+
+
+def admin_required(f):
+    @token_required
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        if request.user not in PROFILING_ADMINS:
+            return jsonify({"error": "Not allowed"}), 403
+        return f(*args, **kwargs)
+    return decorated
+
+
+@profiling_bp.route("", methods=["GET"])
+@admin_required
+def list_profiles():
+    return jsonify({"settings": profiler.settings(), "profiles": profiler.list()})
+
+
+@profiling_bp.route("", methods=["DELETE"])
+@admin_required
+def clear_profiles():
+    profiler.clear()
+    return jsonify({"status": "Profiles cleared"})
+
+
+@profiling_bp.route("/config", methods=["POST"])
+@admin_required
+def configure():
+    data = request.get_json(silent=True) or {}
+    enabled = data.get("enabled")
+    if enabled is not None and not isinstance(enabled, bool):
+        return jsonify({"error": "enabled must be true or false"}), 400
+    sample_rate = data.get("sample_rate")
+    if sample_rate is not None and (isinstance(sample_rate, bool) or not isinstance(sample_rate, (int, float))
+                                    or not 0 <= sample_rate <= 1):
+        return jsonify({"error": "sample_rate must be between 0 and 1"}), 400
+    jobs = data.get("jobs")
+    if jobs is not None and (not isinstance(jobs, list) or not all(isinstance(job, str) for job in jobs)):
+        return jsonify({"error": "jobs must be a list of job names"}), 400
+    size = data.get("size")
+    if size is not None and (isinstance(size, bool) or not isinstance(size, int) or size < 1):
+        return jsonify({"error": "size must be a positive integer"}), 400
+
+    profiler.configure(enabled=enabled, sample_rate=sample_rate, jobs=jobs, size=size)
+    return jsonify(profiler.settings())
+
+
+@profiling_bp.route("/<profile_id>", methods=["GET"])
+@admin_required
+def show_profile(profile_id):
+    profile = profiler.get(profile_id)
+    if profile is None:
+        return jsonify({"error": "Profile not found"}), 404
+    return jsonify({**profile.summary(), "top": profile.top(request.args.get("limit", 20, type=int))})
+
+
+@profiling_bp.route("/<profile_id>.pstats", methods=["GET"])
+@admin_required
+def download_pstats(profile_id):
+    profile = profiler.get(profile_id)
+    if profile is None:
+        return jsonify({"error": "Profile not found"}), 404
+    return Response(profile.pstats(), mimetype="application/octet-stream", headers={
+        "Content-Disposition": f"attachment; filename=profile-{profile_id}.pstats"
+    })
+
+
+@profiling_bp.route("/<profile_id>.collapsed", methods=["GET"])
+@admin_required
+def download_collapsed(profile_id):
+    # Feed to flamegraph.pl or speedscope
+    profile = profiler.get(profile_id)
+    if profile is None:
+        return jsonify({"error": "Profile not found"}), 404
+    return Response(profile.collapsed(), mimetype="text/plain", headers={
+        "Content-Disposition": f"attachment; filename=profile-{profile_id}.collapsed"
+    })
@@ -1,10 +1,17 @@
 from flask import Blueprint, request, jsonify
 from database import get_db_connection
-from certificate_utils import get_cert_expiry
+from auth import token_required
+from probe_jobs import probe_jobs
+from routes.listing import ListQuery, ListQueryError
+from routes.importing import open_records, run_import, ImportFormatError, ImportRowError
+from scan_engine import BackgroundScan
+from expiry_index import expiry_index
+from config import PROBE_JOB_MAX_WAIT
 from datetime import datetime
 from urllib.parse import urlparse
 from logger import logger  # ✅ Import the shared logger
 import re
+import sqlite3
 
 service_bp = Blueprint('service_bp', __name__)
 
@@ -32,144 +39,210 @@ def validate_emails(email_string):
     return True
 
 
-@service_bp.route("/add", methods=["POST"])
-def add_service():
-    data = request.json
-    logger.info("Add service request received.")
+def string_fields(data, keys):
+    # Stripped values of `keys`, or None unless every one is a non-empty string
+    # (JSON null, numbers and the None a short CSV row is padded with are not)
+    values = [data[key] for key in keys]
+    if not all(isinstance(value, str) and value.strip() for value in values):
+        return None
+    return [value.strip() for value in values]
+
 
-    if not all(key in data for key in ['name', 'url', 'alert_email']):
-        logger.warning("Missing required fields.")
-        return jsonify({"error": "Missing required fields (name, url, alert_email)"}), 400
+def validate_service(data):
+    if not isinstance(data, dict) or not all(key in data for key in ['name', 'url', 'alert_email']):
+        return None, "Missing required fields (name, url, alert_email)"
 
-    name = data["name"].strip()
-    url = data["url"].strip().lower()
-    email = data["alert_email"].strip()
+    fields = string_fields(data, ['name', 'url', 'alert_email'])
+    if fields is None:
+        return None, "name, url and alert_email must be non-empty strings"
+    name, url, email = fields
+    url = url.lower()
 
     if len(name) < 3 or len(name) > 50:
-        logger.warning(f"Invalid name length: {name}")
-        return jsonify({"error": "Name must be between 3 and 50 characters"}), 400
+        return None, "Name must be between 3 and 50 characters"
 
     if not is_valid_url(url):
-        logger.warning(f"Invalid URL format: {url}")
-        return jsonify({"error": "Invalid URL format. Must include http:// or https://"}), 400
+        return None, "Invalid URL format. Must include http:// or https://"
 
     if not validate_emails(email):
-        logger.warning(f"Invalid email(s): {email}")
-        return jsonify({"error": "One or more email addresses are invalid"}), 400
+        return None, "One or more email addresses are invalid"
+
+    return (name, url, email), None
+
+
+def find_conflict(cursor, name, url, exclude_id=None):
+    # One indexed lookup (name OR url) instead of two full-table scans
+    cursor.execute(
+        "SELECT name = ?, url = ? FROM services WHERE (name = ? OR url = ?) AND id IS NOT ?",
+        (name, url, name, url, exclude_id)
+    )
+    matches = cursor.fetchall()
+    if any(name_match for name_match, _ in matches):
+        return "Service name already exists"
+    if matches:
+        return "URL already exists"
+    return None
+
+
+@service_bp.route("/add", methods=["POST"])
+@token_required
+def add_service():
+    data = request.json
+    logger.debug("Add service request received.")
+
+    fields, error = validate_service(data)
+    if error:
+        logger.warning("Invalid service data: %s", error)
+        return jsonify({"error": error}), 400
+    name, url, email = fields
 
     conn = None
     try:
         conn = get_db_connection()
         cursor = conn.cursor()
 
-        cursor.execute("SELECT id FROM services WHERE name = ?", (name,))
-        if cursor.fetchone():
-            logger.warning(f"Service name already exists: {name}")
-            return jsonify({"error": "Service name already exists"}), 409
-
-        cursor.execute("SELECT id FROM services WHERE url = ?", (url,))
-        if cursor.fetchone():
-            logger.warning(f"URL already exists: {url}")
-            return jsonify({"error": "URL already exists"}), 409
-
-        expiry_str = None
-        try:
-            expiry = get_cert_expiry(url)
-            expiry_str = expiry.strftime("%Y-%m-%d")
-        except Exception as e:
-            logger.error(f"Certificate check failed for {url}: {e}")
+        conflict = find_conflict(cursor, name, url)
+        if conflict:
+            logger.warning("%s: %s (%s)", conflict, name, url)
+            return jsonify({"error": conflict}), 409
 
         cursor.execute(
-            "INSERT INTO services (name, url, alert_email, certificate_expiry) VALUES (?, ?, ?, ?)",
-            (name, url, email, expiry_str)
+            "INSERT INTO services (name, url, alert_email) VALUES (?, ?, ?)",
+            (name, url, email)
         )
+        service_id = cursor.lastrowid
         conn.commit()
+        expiry_index.put("services", service_id, name, None, email)
+
+        # The certificate is probed in the background; poll the job for the result
+        job_id = probe_jobs.submit(service_id, url)
 
-        logger.info(f"Service added: {name} ({url})")
+        logger.info("Service added: %s (%s), probe job %s", name, url, job_id)
         return jsonify({
             "status": "Service added",
-            "certificate_expiry": expiry_str,
+            "probe_job_id": job_id,
             "service": {
+                "id": service_id,
                 "name": name,
                 "url": url,
                 "alert_email": email
             }
-        }), 201
+        }), 202
 
+    except sqlite3.IntegrityError:
+        logger.warning("Concurrent duplicate service rejected: %s (%s)", name, url)
+        return jsonify({"error": "Service name or URL already exists"}), 409
     except Exception as e:
-        logger.error(f"Error adding service: {e}")
+        logger.error("Error adding service: %s", e)
         return jsonify({"error": f"Database error: {str(e)}"}), 500
     finally:
         if conn:
             conn.close()
 
 
-@service_bp.route("/update/<int:id>", methods=["PUT"])
-def update_service(id):
-    data = request.json
-    logger.info(f"Update request received for service ID {id}.")
+def _import_service(cursor, record):
+    fields, error = validate_service(record)
+    if error:
+        raise ImportRowError(error)
+    name, url, email = fields
 
-    if not all(key in data for key in ['name', 'url', 'alert_email']):
-        return jsonify({"error": "Missing required fields (name, url, alert_email)"}), 400
+    # URL is the natural key: re-importing an inventory updates rows in place
+    cursor.execute("SELECT id FROM services WHERE url = ?", (url,))
+    row = cursor.fetchone()
+    if row:
+        cursor.execute("UPDATE services SET name = ?, alert_email = ? WHERE id = ?", (name, email, row[0]))
+        return {"status": "updated", "id": row[0], "url": url}
 
-    name = data["name"].strip()
-    url = data["url"].strip().lower()
-    email = data["alert_email"].strip()
+    cursor.execute("INSERT INTO services (name, url, alert_email) VALUES (?, ?, ?)", (name, url, email))
+    return {"status": "created", "id": cursor.lastrowid, "url": url}
 
-    if len(name) < 3 or len(name) > 50:
-        return jsonify({"error": "Name must be between 3 and 50 characters"}), 400
 
-    if not is_valid_url(url):
-        return jsonify({"error": "Invalid URL format. Must include http:// or https://"}), 400
+@service_bp.route("/import", methods=["POST"])
+@token_required
+def import_services():
+    logger.info("Bulk service import requested.")
+    try:
+        records = open_records(request)
+    except ImportFormatError as e:
+        return jsonify({"error": str(e)}), 400
 
-    if not validate_emails(email):
-        return jsonify({"error": "One or more email addresses are invalid"}), 400
+    # New services are probed concurrently in the background as their batch commits
+    scan = BackgroundScan() if request.args.get("probe", "true").lower() != "false" else None
+
+    def on_commit(entries):
+        expiry_index.invalidate()
+        if scan:
+            for entry in entries:
+                if entry["status"] == "created":
+                    scan.add(entry["id"], entry["url"])
+
+    try:
+        return run_import(records, _import_service, on_commit)
+    except Exception as e:
+        logger.error("Error importing services: %s", e)
+        return jsonify({"error": f"Import failed: {str(e)}"}), 500
+    finally:
+        if scan:
+            scan.close()
+
+
+@service_bp.route("/update/<int:id>", methods=["PUT"])
+@token_required
+def update_service(id):
+    data = request.json
+    logger.debug("Update request received for service ID %s.", id)
+
+    fields, error = validate_service(data)
+    if error:
+        return jsonify({"error": error}), 400
+    name, url, email = fields
 
     conn = None
     try:
         conn = get_db_connection()
         cursor = conn.cursor()
 
-        cursor.execute("SELECT id FROM services WHERE id = ?", (id,))
-        if not cursor.fetchone():
-            logger.warning(f"Service ID not found: {id}")
+        cursor.execute("SELECT url, certificate_expiry FROM services WHERE id = ?", (id,))
+        row = cursor.fetchone()
+        if not row:
+            logger.warning("Service ID not found: %s", id)
             return jsonify({"error": "Service not found"}), 404
 
-        cursor.execute("SELECT id FROM services WHERE name = ? AND id != ?", (name, id))
-        if cursor.fetchone():
-            return jsonify({"error": "Service name already exists"}), 409
+        conflict = find_conflict(cursor, name, url, exclude_id=id)
+        if conflict:
+            return jsonify({"error": conflict}), 409
 
-        cursor.execute("SELECT id FROM services WHERE url = ? AND id != ?", (url, id))
-        if cursor.fetchone():
-            return jsonify({"error": "URL already exists"}), 409
-
-        expiry_str = None
-        try:
-            expiry = get_cert_expiry(url)
-            expiry_str = expiry.strftime("%Y-%m-%d")
-        except Exception as e:
-            logger.error(f"Certificate check failed during update: {e}")
+        # A new URL means the stored expiry belongs to someone else's certificate
+        old_url, expiry_str = row
+        if url != old_url:
+            expiry_str = None
 
         cursor.execute(
             "UPDATE services SET name = ?, url = ?, alert_email = ?, certificate_expiry = ? WHERE id = ?",
             (name, url, email, expiry_str, id)
         )
         conn.commit()
+        expiry_index.put("services", id, name, expiry_str, email)
+
+        job_id = probe_jobs.submit(id, url)
 
-        logger.info(f"Service updated: ID {id}, name {name}")
+        logger.info("Service updated: ID %s, name %s, probe job %s", id, name, job_id)
         return jsonify({
             "status": "Service updated",
             "certificate_expiry": expiry_str,
+            "probe_job_id": job_id,
             "service": {
                 "id": id,
                 "name": name,
                 "url": url,
                 "alert_email": email
             }
-        }), 200
+        }), 202
 
+    except sqlite3.IntegrityError:
+        return jsonify({"error": "Service name or URL already exists"}), 409
     except Exception as e:
-        logger.error(f"Error updating service ID {id}: {e}")
+        logger.error("Error updating service ID %s: %s", id, e)
         return jsonify({"error": f"Database error: {str(e)}"}), 500
     finally:
         if conn:
@@ -177,8 +250,9 @@ def update_service(id):
 
 
 @service_bp.route("/delete/<int:id>", methods=["DELETE"])
+@token_required
 def delete_service(id):
-    logger.info(f"Delete request for service ID {id}")
+    logger.debug("Delete request for service ID %s", id)
     conn = None
     try:
         conn = get_db_connection()
@@ -186,52 +260,49 @@ def delete_service(id):
 
         cursor.execute("SELECT id FROM services WHERE id = ?", (id,))
         if not cursor.fetchone():
-            logger.warning(f"Service not found for deletion: ID {id}")
+            logger.warning("Service not found for deletion: ID %s", id)
             return jsonify({"error": "Service not found"}), 404
 
         cursor.execute("DELETE FROM services WHERE id = ?", (id,))
         conn.commit()
-        logger.info(f"Service deleted: ID {id}")
+        expiry_index.remove("services", id)
+        logger.info("Service deleted: ID %s", id)
         return jsonify({"status": "Service deleted"}), 200
     except Exception as e:
-        logger.error(f"Error deleting service ID {id}: {e}")
+        logger.error("Error deleting service ID %s: %s", id, e)
         return jsonify({"error": f"Database error: {str(e)}"}), 500
     finally:
         if conn:
             conn.close()
 
 
+service_list_query = ListQuery(
+    "services",
+    fields=["id", "name", "url", "alert_email", "certificate_expiry", "last_checked", "last_error", "error_class",
+            "next_retry_at", "handshake_ms", "next_check_at", "consecutive_failures"],
+    default_fields=["id", "name", "url", "alert_email", "certificate_expiry"],
+    expiry_column="certificate_expiry",
+    error_column="last_error"
+)
+
+
 @service_bp.route("/list", methods=["GET"])
+@token_required
 def list_services():
-    logger.info("List services requested.")
-    conn = None
+    logger.debug("List services requested.")
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT id, name, url, alert_email, certificate_expiry FROM services")
-        rows = cursor.fetchall()
-
-        service_list = [{
-            "id": sid,
-            "name": name,
-            "url": url,
-            "alert_email": email,
-            "certificate_expiry": expiry
-        } for sid, name, url, email, expiry in rows]
-
-        logger.info(f"Returned {len(service_list)} services.")
-        return jsonify(service_list)
+        return service_list_query.respond(request.args)
+    except ListQueryError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
-        logger.error(f"Error listing services: {e}")
+        logger.error("Error listing services: %s", e)
         return jsonify({"error": f"Database error: {str(e)}"}), 500
-    finally:
-        if conn:
-            conn.close()
 
 
 @service_bp.route("/fetch-expiry/<int:id>", methods=["POST"])
+@token_required
 def fetch_expiry(id):
-    logger.info(f"Manual expiry fetch for service ID {id}")
+    logger.info("Manual expiry fetch for service ID %s", id)
     conn = None
     try:
         conn = get_db_connection()
@@ -239,26 +310,33 @@ def fetch_expiry(id):
         cursor.execute("SELECT url FROM services WHERE id = ?", (id,))
         row = cursor.fetchone()
         if not row:
-            logger.warning(f"Service not found for expiry fetch: ID {id}")
+            logger.warning("Service not found for expiry fetch: ID %s", id)
             return jsonify({"error": "Service not found"}), 404
+        conn.close()
 
-        url = row[0]
-        try:
-            expiry = get_cert_expiry(url)
-            expiry_str = expiry.strftime("%Y-%m-%d")
-            cursor.execute("UPDATE services SET certificate_expiry = ? WHERE id = ?", (expiry_str, id))
-            conn.commit()
-            logger.info(f"Updated expiry for service ID {id} → {expiry_str}")
-            return jsonify({
-                "status": "Expiry date updated",
-                "certificate_expiry": expiry_str
-            }), 200
-        except Exception as e:
-            logger.error(f"Error fetching expiry for service ID {id}: {e}")
-            return jsonify({"error": str(e)}), 500
+        job_id = probe_jobs.submit(id, row[0])
+        logger.info("Queued expiry fetch for service ID %s: probe job %s", id, job_id)
+        return jsonify({
+            "status": "Expiry fetch queued",
+            "probe_job_id": job_id
+        }), 202
     except Exception as e:
-        logger.error(f"Database error during expiry fetch: {e}")
+        logger.error("Database error during expiry fetch: %s", e)
         return jsonify({"error": f"Database error: {str(e)}"}), 500
     finally:
         if conn:
             conn.close()
+
+
+@service_bp.route("/probe-jobs/<job_id>", methods=["GET"])
+@token_required
+def probe_job_status(job_id):
+    try:
+        wait = min(max(float(request.args.get("wait", 0)), 0), PROBE_JOB_MAX_WAIT)
+    except ValueError:
+        return jsonify({"error": "wait must be a number of seconds"}), 400
+
+    job = probe_jobs.wait(job_id, wait) if wait else probe_jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Probe job not found"}), 404
+    return jsonify(job)
@@ -0,0 +1,185 @@
+"""Probe certificates for a list of hosts without the web app.
+
+    python -m scan_cli hosts.txt > results.ndjson
+    cut -d, -f1 lb-export.csv | python -m scan_cli - --format csv --parallel 200 --timeout 5
+    python -m scan_cli hosts.txt --upsert --alert-email ops@example.com
+
+Input is one host per line: `host`, `host:port` or a URL; blank lines and
+`#` comments are skipped. Hosts are read lazily and results are written as
+each probe finishes, so memory stays flat however long the list is. The exit
+status is 1 if any probe failed, any line was rejected or any result could
+not be upserted.
+"""
+import argparse
+import csv
+import json
+import logging
+import sys
+from datetime import datetime
+from urllib.parse import urlparse
+
+import certificate_utils
+from certificate_utils import ProbeCache, EXPIRY_FORMAT
+from scan_engine import iter_scan, TIMESTAMP_FORMAT
+from config import SCAN_MAX_IN_FLIGHT, SCAN_PROBE_TIMEOUT, PROBE_CACHE_TTL, PROBE_CACHE_MAX_ENTRIES, DB_WRITE_BATCH_SIZE
+from logger import logger
+
+FIELDS = ["input", "url", "host", "port", "expiry", "days_left", "error", "error_class", "latency_ms"]
+
+# Same columns store_results maintains; new URLs become services named after themselves
+UPSERT_SQL = (
+    "INSERT INTO services (name, url, alert_email, certificate_expiry, last_checked, last_error, error_class, "
+    "next_retry_at, handshake_ms) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) "
+    "ON CONFLICT (url) DO UPDATE SET "
+    "certificate_expiry = COALESCE(excluded.certificate_expiry, services.certificate_expiry), "
+    "last_checked = excluded.last_checked, last_error = excluded.last_error, "
+    "error_class = excluded.error_class, next_retry_at = excluded.next_retry_at, "
+    "handshake_ms = COALESCE(excluded.handshake_ms, services.handshake_ms), "
+    "consecutive_failures = CASE WHEN excluded.last_error IS NULL THEN 0 "
+    "ELSE services.consecutive_failures + 1 END"
+)
+
+
+def to_url(line):
+    # "example.com", "example.com:8443" or "https://example.com:8443/path"
+    target = line if "://" in line else f"https://{line}"
+    parsed = urlparse(target)
+    # .port raises ValueError for "host:abc" or "host:70000", rejecting the line
+    if not parsed.hostname or parsed.port == 0:
+        return None
+    # Lowercased like the API does, so both map a host to the same service row
+    return f"https://{parsed.netloc}".lower()
+
+
+def read_targets(stream, rejected):
+    # Yields (line number, input, url); unusable lines are reported straight away
+    for line_no, line in enumerate(stream, start=1):
+        line = line.split("#", 1)[0].strip()
+        if not line:
+            continue
+        try:
+            url = to_url(line)
+        except ValueError:
+            url = None
+        if url is None:
+            rejected(line_no, line)
+            continue
+        yield line_no, line, url
+
+
+class Output:
+    def __init__(self, stream, fmt):
+        self.stream = stream
+        self.fmt = fmt
+        self._csv = csv.DictWriter(stream, fieldnames=FIELDS) if fmt == "csv" else None
+        if self._csv:
+            self._csv.writeheader()
+
+    def write(self, row):
+        if self._csv:
+            self._csv.writerow(row)
+        else:
+            self.stream.write(json.dumps(row) + "\n")
+        self.stream.flush()
+
+
+def _row(inputs, result, now):
+    parsed = urlparse(result["url"])
+    expiry = result["expiry"]
+    return {
+        "input": inputs.pop(result["id"], None),
+        "url": result["url"],
+        "host": parsed.hostname,
+        "port": parsed.port or 443,
+        "expiry": expiry.strftime(EXPIRY_FORMAT) if expiry else None,
+        "days_left": (expiry - now).days if expiry else None,
+        "error": result["error"],
+        "error_class": result["error_class"],
+        "latency_ms": round(result["latency_ms"], 1) if result["latency_ms"] is not None else None,
+    }
+
+
+def _upsert_params(row, result, checked_at, alert_email):
+    retry_at = result["retry_at"].strftime(TIMESTAMP_FORMAT) if result["retry_at"] else None
+    expiry = result["expiry"].strftime("%Y-%m-%d") if result["expiry"] else None
+    return (row["url"], row["url"], alert_email, expiry, checked_at, row["error"], row["error_class"], retry_at,
+            row["latency_ms"])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m scan_cli", description="Probe TLS certificate expiry for a host list")
+    parser.add_argument("source", nargs="?", default="-", help="file with one host per line, or - for stdin")
+    parser.add_argument("--format", choices=["ndjson", "csv"], default="ndjson")
+    parser.add_argument("--parallel", type=int, default=SCAN_MAX_IN_FLIGHT, help="probes in flight at once")
+    parser.add_argument("--timeout", type=float, default=SCAN_PROBE_TIMEOUT, help="seconds per probe")
+    parser.add_argument("--deadline", type=float, default=None,
+                        help="seconds for the whole run; unfinished hosts are reported as failed")
+    parser.add_argument("--upsert", action="store_true", help="also write results to the services table")
+    parser.add_argument("--alert-email", default="", help="alert address for services created by --upsert (required with it)")
+    parser.add_argument("-v", "--verbose", action="store_true")
+    args = parser.parse_args(argv)
+    if args.parallel < 1 or args.timeout <= 0:
+        parser.error("--parallel and --timeout must be positive")
+    if args.upsert and not args.alert_email.strip():
+        # Services without an address could never be alerted
+        parser.error("--upsert needs --alert-email")
+
+    logger.setLevel(logging.INFO if args.verbose else logging.WARNING)
+    # Results are only shared between hosts of this run, never read from monitor.db
+    certificate_utils.probe_cache = ProbeCache(PROBE_CACHE_TTL, PROBE_CACHE_MAX_ENTRIES, persist=False)
+
+    source = sys.stdin if args.source == "-" else open(args.source, encoding="utf-8")
+    output = Output(sys.stdout, args.format)
+    inputs = {}
+    counts = {"ok": 0, "failed": 0, "rejected": 0, "not_upserted": 0}
+
+    def rejected(line_no, line):
+        counts["rejected"] += 1
+        print(f"line {line_no}: not a host or URL: {line!r}", file=sys.stderr)
+
+    def conflict(params, error):
+        # e.g. another service already uses this URL as its name
+        counts["not_upserted"] += 1
+        print(f"{params[1]}: not upserted, conflicts with an existing service: {error}", file=sys.stderr)
+
+    writer = None
+    if args.upsert:
+        from database import init_db, BatchWriter
+        init_db()
+        writer = BatchWriter(UPSERT_SQL, DB_WRITE_BATCH_SIZE, on_conflict=conflict)
+
+    def targets():
+        for line_no, line, url in read_targets(source, rejected):
+            inputs[line_no] = line
+            yield line_no, url
+
+    now = datetime.utcnow()
+    checked_at = now.strftime(TIMESTAMP_FORMAT)
+    # iter_scan wants a finite deadline; a year is "none" for a CLI run
+    deadline = args.deadline if args.deadline else 365 * 86400
+    try:
+        for result in iter_scan(targets(), max_in_flight=args.parallel, probe_timeout=args.timeout,
+                                run_deadline=deadline):
+            row = _row(inputs, result, now)
+            output.write(row)
+            counts["ok" if result["error"] is None else "failed"] += 1
+            if writer:
+                writer.add(_upsert_params(row, result, checked_at, args.alert_email))
+    except (BrokenPipeError, KeyboardInterrupt):
+        # e.g. piped into `head`; keep whatever was already upserted
+        pass
+    finally:
+        if writer:
+            writer.flush()
+        if source is not sys.stdin:
+            source.close()
+
+    summary = f"{counts['ok']} ok, {counts['failed']} failed, {counts['rejected']} rejected"
+    if writer:
+        summary += f", {counts['not_upserted']} not upserted"
+    print(summary, file=sys.stderr)
+    return 1 if counts["failed"] or counts["rejected"] or counts["not_upserted"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
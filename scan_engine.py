@@ -0,0 +1,240 @@
+import logging
+import queue
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from urllib.parse import urlparse
+from certificate_utils import probe_cert_expiry, classify_error, ProbeFailure, CircuitOpen
+from database import BatchWriter
+from expiry_index import expiry_index
+from config import (
+    SCAN_MAX_IN_FLIGHT,
+    SCAN_PROBE_TIMEOUT,
+    SCAN_RUN_DEADLINE,
+    RECHECK_MIN_INTERVAL,
+    RECHECK_MAX_INTERVAL,
+    RECHECK_FRACTION,
+    RECHECK_FAILURE_BASE,
+    RECHECK_JITTER,
+    SCAN_LOG_SAMPLE
+)
+from logger import logger, get_logger
+
+scan_logger = get_logger("scan")
+
+DEADLINE_ERROR = "Scan run deadline exceeded"
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def _result(service_id, url, expiry=None, error=None, latency_ms=None, error_class=None, retry_at=None):
+    return {
+        "id": service_id,
+        "url": url,
+        "expiry": expiry,
+        "error": error,
+        "error_class": error_class,
+        "retry_at": retry_at,
+        "latency_ms": latency_ms
+    }
+
+
+def probe_service(service_id, url, probe_timeout=SCAN_PROBE_TIMEOUT):
+    # latency_ms is None when no handshake was made (cache hit or open
+    # breaker), so the service's last measured handshake time is kept
+    started = time.monotonic()
+    expiry = error = error_class = retry_at = None
+    probed = True
+    try:
+        expiry, probed = probe_cert_expiry(url, timeout=probe_timeout)
+    except ProbeFailure as e:
+        error, error_class = str(e), e.error_class
+        retry_at = datetime.utcfromtimestamp(e.retry_at) if e.retry_at else None
+        probed = not isinstance(e, CircuitOpen)
+    except Exception as e:
+        error, error_class = str(e) or e.__class__.__name__, classify_error(e)
+    latency_ms = (time.monotonic() - started) * 1000 if probed else None
+    return _result(service_id, url, expiry, error, latency_ms, error_class, retry_at)
+
+
+def iter_scan(services, max_in_flight=SCAN_MAX_IN_FLIGHT,
+              probe_timeout=SCAN_PROBE_TIMEOUT, run_deadline=SCAN_RUN_DEADLINE):
+    """Probe (id, url) pairs concurrently and yield a result dict per service
+    as soon as its probe finishes.
+
+    At most `max_in_flight` probes run at once and `services` is consumed
+    lazily, so memory stays bounded by the in-flight window. Once
+    `run_deadline` seconds have passed, every service still pending or not
+    yet started is yielded with DEADLINE_ERROR instead of being probed.
+    """
+    deadline = time.monotonic() + run_deadline
+    services = iter(services)
+    pending = {}
+    exhausted = False
+    executor = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="cert-scan")
+    try:
+        while True:
+            while not exhausted and len(pending) < max_in_flight:
+                try:
+                    service_id, url = next(services)
+                except StopIteration:
+                    exhausted = True
+                    break
+                pending[executor.submit(probe_service, service_id, url, probe_timeout)] = (service_id, url)
+
+            if not pending:
+                return
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+
+            done, _ = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+            for future in done:
+                pending.pop(future)
+                yield future.result()
+
+        for future, (service_id, url) in pending.items():
+            future.cancel()
+            yield _result(service_id, url, error=DEADLINE_ERROR, error_class="deadline")
+        for service_id, url in services:
+            yield _result(service_id, url, error=DEADLINE_ERROR, error_class="deadline")
+    finally:
+        # Hung probes are bounded by their own timeout; don't block the caller on them
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def next_check_delay(expiry, now):
+    # Re-check after a fraction of the remaining validity: a cert with 3 days
+    # left is looked at several times a day, one with a year left about weekly.
+    if expiry is None:
+        return RECHECK_MIN_INTERVAL
+    remaining = (expiry - now).total_seconds()
+    delay = min(max(remaining * RECHECK_FRACTION, RECHECK_MIN_INTERVAL), RECHECK_MAX_INTERVAL)
+    return delay * random.uniform(1 - RECHECK_JITTER, 1 + RECHECK_JITTER)
+
+
+def store_results(results):
+    """Persist scan results to `services` in batches, yielding each one on.
+
+    Every result also schedules the service's next check (see
+    next_check_delay); failures back off exponentially from
+    RECHECK_FAILURE_BASE, and never come before the host's circuit breaker
+    retry time. A failed probe keeps the last known certificate_expiry.
+    Rows whose URL changed while the probe was running are left alone, and
+    so are services cut off by the run deadline: they were never probed, so
+    they are passed on unwritten and stay due for the next run.
+    """
+    now = datetime.utcnow()
+    checked_at = now.strftime(TIMESTAMP_FORMAT)
+    updated = BatchWriter(
+        "UPDATE services SET certificate_expiry = ?, last_checked = ?, last_error = NULL, error_class = NULL, "
+        "next_retry_at = NULL, handshake_ms = COALESCE(?, handshake_ms), consecutive_failures = 0, next_check_at = ? WHERE id = ? AND url = ?"
+    )
+    # The backoff uses consecutive_failures before this failure is counted
+    failed = BatchWriter(
+        "UPDATE services SET last_checked = ?, last_error = ?, error_class = ?, next_retry_at = ?, handshake_ms = COALESCE(?, handshake_ms), "
+        "consecutive_failures = consecutive_failures + 1, "
+        "next_check_at = MAX(datetime(?, '+' || CAST(MIN(? * (1 << MIN(consecutive_failures, 20)), ?) * ? AS INTEGER) "
+        "|| ' seconds'), COALESCE(?, '')) WHERE id = ? AND url = ?"
+    )
+    with updated, failed:
+        for result in results:
+            if result["error_class"] == "deadline":
+                yield result
+                continue
+            if result["error"] is None:
+                next_check_at = now + timedelta(seconds=next_check_delay(result["expiry"], now))
+                expiry = result["expiry"].strftime("%Y-%m-%d")
+                updated.add((expiry, checked_at, result["latency_ms"],
+                             next_check_at.strftime(TIMESTAMP_FORMAT), result["id"], result["url"]))
+                expiry_index.set_expiry("services", result["id"], expiry)
+            else:
+                retry_at = result["retry_at"].strftime(TIMESTAMP_FORMAT) if result["retry_at"] else None
+                failed.add((checked_at, result["error"], result["error_class"], retry_at, result["latency_ms"],
+                            checked_at, RECHECK_FAILURE_BASE, RECHECK_MAX_INTERVAL,
+                            random.uniform(1 - RECHECK_JITTER, 1 + RECHECK_JITTER), retry_at,
+                            result["id"], result["url"]))
+            yield result
+
+
+class ScanSummary:
+    # Aggregates per-service results into one line per run. Successes are only
+    # logged at DEBUG; the first `sample` failures are logged individually and
+    # the rest are counted by error message.
+
+    def __init__(self, label, sample=SCAN_LOG_SAMPLE):
+        self.label = label
+        self.sample = sample
+        self.ok = 0
+        self.failed = 0
+        self.skipped = 0
+        self.errors = Counter()
+        self.started = time.monotonic()
+
+    def add(self, result, name=None):
+        fields = {
+            "service_id": result["id"],
+            "host": urlparse(result["url"]).hostname,
+            "duration_ms": round(result["latency_ms"] or 0, 1),
+        }
+        if result["error"] is None:
+            self.ok += 1
+            if scan_logger.isEnabledFor(logging.DEBUG):
+                scan_logger.debug("Updated certificate expiry for %s (%s): %s",
+                                  name or result["id"], result["url"], result["expiry"], extra=fields)
+            return
+        if result["error_class"] == "deadline":
+            self.skipped += 1
+            return
+        self.failed += 1
+        self.errors[result["error"]] += 1
+        if self.failed <= self.sample:
+            scan_logger.error("Error checking certificate for %s: %s", result["url"], result["error"], extra=fields)
+
+    def log(self):
+        elapsed = time.monotonic() - self.started
+        fields = {"updated": self.ok, "failed": self.failed, "skipped": self.skipped,
+                  "duration_ms": round(elapsed * 1000)}
+        scan_logger.info("%s finished in %.1fs: %d updated, %d failed, %d not probed before the deadline.",
+                         self.label, elapsed, self.ok, self.failed, self.skipped, extra=fields)
+        unlogged = self.failed - self.sample
+        if unlogged > 0:
+            common = "; ".join(f"{count}x {error}" for error, count in self.errors.most_common(5))
+            scan_logger.warning("%s: %d more failure(s) not logged individually. Most common: %s",
+                                self.label, unlogged, common)
+
+
+class BackgroundScan:
+    # Feed (id, url) pairs in from a request; a single thread probes them with
+    # the scan engine's concurrency limit and stores the results.
+
+    def __init__(self, **options):
+        self.options = options
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="background-scan", daemon=True)
+        self._thread.start()
+
+    def add(self, service_id, url):
+        self._queue.put((service_id, url))
+
+    def close(self):
+        self._queue.put(None)
+
+    def _pending(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            yield item
+
+    def _run(self):
+        summary = ScanSummary("Background certificate scan")
+        try:
+            for result in store_results(iter_scan(self._pending(), **self.options)):
+                summary.add(result)
+        except Exception as e:
+            logger.error("Background certificate scan failed: %s", e)
+        summary.log()
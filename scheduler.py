@@ -1,13 +1,30 @@
 from apscheduler.schedulers.background import BackgroundScheduler
-from certificate_utils import get_cert_expiry
-from email_utils import send_email
+from scan_engine import iter_scan, store_results, ScanSummary
+from email_utils import build_digest
+from recheck import adaptive_scheduler
+from mail_queue import enqueue_many, queue_stats, delivery_workers
 from database import get_db_connection
+import time
 from datetime import datetime
+from contextlib import nullcontext
+from leasing import Leases
+import alert_ledger
+from expiry_index import expiry_index
+from cert_discovery import discover
+from metrics import SCAN_RUN_SECONDS
+from profiling import profiler
 from config import (
-    CERT_ALERT_DAYS_BEFORE,
-    LICENSE_ALERT_DAYS_BEFORE,
+    CERT_ALERT_TIERS,
+    LICENSE_ALERT_TIERS,
+    ALERT_DIGEST_MODE,
     CERT_CHECK_TIME,
-    ALERT_SEND_TIME
+    ALERT_SEND_TIME,
+    SCHEDULER_MODE,
+    WORK_SHARDING,
+    SCAN_RUN_DEADLINE,
+    CERT_DISCOVERY_DIRS,
+    CERT_DISCOVERY_ALERT_EMAIL,
+    CERT_DISCOVERY_INTERVAL
 )
 from logger import logger
 
@@ -15,57 +32,191 @@ def parse_time(time_str):
     hour, minute = map(int, time_str.split(":"))
     return hour, minute
 
-def check_cert_expiry():
-    logger.info("Running certificate expiry check...")
+def _run_key():
+    # Replicas firing the same daily job agree on the key and split its rows
+    return datetime.utcnow().strftime("%Y-%m-%d")
+
+def _all_services():
     conn = get_db_connection()
     cursor = conn.cursor()
     cursor.execute("SELECT id, name, url FROM services")
     services = cursor.fetchall()
-    for service_id, name, url in services:
-        try:
-            expiry_date = get_cert_expiry(url)
-            cursor.execute(
-                "UPDATE services SET certificate_expiry = ? WHERE id = ?",
-                (expiry_date.strftime("%Y-%m-%d"), service_id)
-            )
-            logger.info(f"Updated certificate expiry for {name} ({url}): {expiry_date}")
-        except Exception as e:
-            logger.error(f"Error checking certificate for {url}: {e}")
-    conn.commit()
     conn.close()
+    return services
+
+def check_cert_expiry():
+    logger.info("Running certificate expiry check...")
+    leases = Leases("cert_scan") if WORK_SHARDING else None
+    run_key = _run_key()
+    # One deadline for the whole run, however often this replica comes back for more rows
+    deadline = time.monotonic() + SCAN_RUN_DEADLINE
+    names = {}
+    held = set()  # ids this replica claimed and has not completed
+
+    def pairs(services):
+        for service_id, name, url in services:
+            names[service_id] = name
+            yield service_id, url
+
+    def claimed():
+        # One batch at a time, and no new claims once the deadline has passed
+        for rows in leases.iter_batches(run_key, "services", "t.id, t.name, t.url"):
+            held.update(row[0] for row in rows)
+            yield from rows
+            if time.monotonic() >= deadline:
+                return
+
+    summary = ScanSummary("Certificate expiry check")
+
+    def scan(services):
+        finished = []
+        results = iter_scan(pairs(services), run_deadline=max(deadline - time.monotonic(), 0))
+        for result in store_results(results):
+            summary.add(result, names.pop(result["id"]))
+            # Rows cut off by the deadline weren't probed; they are released below
+            if leases and result["error_class"] != "deadline":
+                held.discard(result["id"])
+                finished.append(result["id"])
+                if len(finished) >= leases.batch_size:
+                    leases.complete(run_key, finished)
+                    finished = []
+        if leases:
+            leases.complete(run_key, finished)
+
+    with leases or nullcontext(), SCAN_RUN_SECONDS.time("cron"):
+        if leases:
+            leases.purge(run_key)
+            # Our own rows are all complete before we wait on other replicas
+            scan(claimed())
+            while time.monotonic() < deadline and leases.wait_for_others(run_key):
+                scan(claimed())
+            if held:
+                # Hand what we didn't get to back to replicas that are still running
+                leases.release(run_key, held)
+                logger.warning("Scan deadline passed; released %s claimed service(s) to other replicas.", len(held))
+        else:
+            scan(_all_services())
+    summary.log()
+
+def _split_emails(emails):
+    return [e.strip() for e in emails.split(",") if e.strip()]
+
+def _digest_messages(alerts):
+    by_recipient = {}
+    for kind, name, expiry_date, emails in alerts:
+        for recipient in _split_emails(emails):
+            by_recipient.setdefault(recipient, []).append((kind, name, expiry_date))
+    for recipient, items in by_recipient.items():
+        subject, body = build_digest(items)
+        yield [recipient], subject, body
+
+def _alert_messages(alerts):
+    for kind, name, expiry_date, emails in alerts:
+        if kind == "License":
+            subject = f"License Expiry Warning: {name}"
+            body = f"The license '{name}' is expiring on {expiry_date}."
+        else:
+            subject = f"Certificate Expiry Warning: {name}"
+            body = f"The SSL certificate for '{name}' is expiring on {expiry_date}."
+        yield _split_emails(emails), subject, body
+
+def _addressed(table, items):
+    # An item without a recipient can't be alerted. Leaving it out of the
+    # ledger means it alerts once an address is set, instead of counting as sent.
+    kept = [item for item in items if _split_emails(item[0][3] or "")]
+    if len(kept) < len(items):
+        kept_ids = {row[0] for row, _ in kept}
+        skipped = [row[0] for row, _ in items if row[0] not in kept_ids]
+        logger.warning("%s %s with no alert email were not alerted (ids %s)", len(skipped), table,
+                       ", ".join(map(str, skipped[:20])) + (" ..." if len(skipped) > 20 else ""))
+    return kept
+
+# table -> (lease job, columns, expiry column, tiers, alert label)
+ALERT_TABLES = {
+    "licenses": ("license_alerts", "t.id, t.name, t.expiry_date, t.alert_email", "expiry_date",
+                 LICENSE_ALERT_TIERS, "License"),
+    "services": ("cert_alerts", "t.id, t.name, t.certificate_expiry, t.alert_email", "certificate_expiry",
+                 CERT_ALERT_TIERS, "Certificate"),
+}
+
+def _alert_batch(items, today):
+    # items: table -> rows (id, name, expiry, alert_email) that entered a new tier
+    # or changed expiry since their last alert. Returns (emails queued, items alerted).
+    tiered = {}
+    alerts = []
+    for table, rows in items.items():
+        _, _, _, tiers, label = ALERT_TABLES[table]
+        tiered[table] = _addressed(table, [(row, tier) for row, tier in alert_ledger.tiered(table, rows, tiers, today)
+                                           if tier is not None])
+        alerts += [(label, name, expiry_date, emails) for (_, name, expiry_date, emails), _ in tiered[table]]
+
+    # The mail and the ledger entries saying it was sent commit together, so
+    # a crash can neither lose an alert nor send it twice. Delivery happens
+    # on the outbox workers, so this run never waits on SMTP.
+    messages = _digest_messages(alerts) if ALERT_DIGEST_MODE else _alert_messages(alerts)
+    conn = get_db_connection()
+    with conn:
+        queued = enqueue_many(messages, conn)
+        for table, entries in tiered.items():
+            alert_ledger.record(conn, table, [(row[0], row[2], tier) for row, tier in entries])
+    delivery_workers.notify()
+    return queued, len(alerts)
 
 def send_alerts():
     logger.info("Sending alerts...")
-    conn = get_db_connection()
-    cursor = conn.cursor()
     today = datetime.utcnow().date()
+    queued = alerted = 0
+    if WORK_SHARDING:
+        # Replicas claim one batch at a time through work_leases and alert for
+        # what they claimed; in digest mode a recipient gets one digest per batch.
+        run_key = _run_key()
+        for table, (job, columns, expiry_column, tiers, _) in ALERT_TABLES.items():
+            leases = Leases(job)
+            where, params = alert_ledger.pending_condition(table, expiry_column, tiers, today)
+            with leases:
+                leases.purge(run_key)
+                for rows in leases.iter_batches(run_key, table, columns, where, params, wait=True):
+                    batch_queued, batch_alerted = _alert_batch({table: rows}, today)
+                    # Rows are only marked done once their mail is safely in the outbox
+                    leases.complete(run_key, [row[0] for row in rows])
+                    queued += batch_queued
+                    alerted += batch_alerted
+    else:
+        # Web workers may have changed rows since this process last loaded the index
+        expiry_index.refresh()
+        items = {}
+        for table, (_, _, _, tiers, _) in ALERT_TABLES.items():
+            items[table] = alert_ledger.filter_pending(
+                table, expiry_index.expiring(table, max(tiers), today), tiers, today)
+        queued, alerted = _alert_batch(items, today)
 
-    cursor.execute("SELECT name, expiry_date, alert_email FROM licenses")
-    for name, expiry_str, emails in cursor.fetchall():
-        expiry_date = datetime.strptime(expiry_str, "%Y-%m-%d").date()
-        if 0 <= (expiry_date - today).days <= LICENSE_ALERT_DAYS_BEFORE:
-            subject = f"License Expiry Warning: {name}"
-            body = f"The license '{name}' is expiring on {expiry_date}."
-            send_email(emails.split(","), subject, body)
-            logger.info(f"Alert email sent for license: {name} → {emails}")
-
-    cursor.execute("SELECT name, certificate_expiry, alert_email FROM services")
-    for name, expiry_str, emails in cursor.fetchall():
-        if expiry_str:
-            expiry_date = datetime.strptime(expiry_str, "%Y-%m-%d").date()
-            if 0 <= (expiry_date - today).days <= CERT_ALERT_DAYS_BEFORE:
-                subject = f"Certificate Expiry Warning: {name}"
-                body = f"The SSL certificate for '{name}' is expiring on {expiry_date}."
-                send_email(emails.split(","), subject, body)
-                logger.info(f"Alert email sent for certificate: {name} → {emails}")
-    conn.close()
+    conn = get_db_connection()
+    with conn:
+        for table in ALERT_TABLES:
+            alert_ledger.purge(conn, table, table)
+
+    logger.info("Queued %s alert email(s) for %s item(s) with a new alert state.", queued, alerted)
+    stats = queue_stats()
+    logger.info(
+        f"Outbox: {stats['pending']} pending, {stats['sending']} sending, {stats['dead']} dead, "
+        f"avg delivery latency {stats['avg_delivery_latency']:.1f}s"
+    )
 
 def start_scheduler():
     scheduler = BackgroundScheduler()
-    cert_hour, cert_minute = parse_time(CERT_CHECK_TIME)
-    scheduler.add_job(check_cert_expiry, 'cron', hour=cert_hour, minute=cert_minute)
+    if SCHEDULER_MODE == "adaptive":
+        adaptive_scheduler.start()
+    else:
+        cert_hour, cert_minute = parse_time(CERT_CHECK_TIME)
+        scheduler.add_job(profiler.job("check_cert_expiry", check_cert_expiry), 'cron', hour=cert_hour, minute=cert_minute)
+
+    if CERT_DISCOVERY_DIRS and not CERT_DISCOVERY_ALERT_EMAIL:
+        logger.error("CERT_DISCOVERY_DIRS is set but CERT_DISCOVERY_ALERT_EMAIL is empty; certificate discovery disabled.")
+    elif CERT_DISCOVERY_DIRS:
+        scheduler.add_job(profiler.job("discover", discover), 'interval', seconds=CERT_DISCOVERY_INTERVAL, next_run_time=datetime.now())
 
     alert_hour, alert_minute = parse_time(ALERT_SEND_TIME)
-    scheduler.add_job(send_alerts, 'cron', hour=alert_hour, minute=alert_minute)
+    scheduler.add_job(profiler.job("send_alerts", send_alerts), 'cron', hour=alert_hour, minute=alert_minute)
 
     scheduler.start()
+    delivery_workers.start()
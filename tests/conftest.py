@@ -0,0 +1,23 @@
+import os
+import sys
+import tempfile
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import config  # noqa: E402
+
+# logger reads LOG_DIR when first imported; keep test logs out of the checkout
+config.LOG_DIR = tempfile.mkdtemp(prefix="expirywatch-test-logs-")
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    # A fresh monitor.db (DATABASE_PATH is relative) in an empty working directory
+    from database import init_db, close_thread_connections
+    monkeypatch.chdir(tmp_path)
+    close_thread_connections()
+    init_db()
+    yield tmp_path
+    close_thread_connections()
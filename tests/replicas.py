@@ -0,0 +1,61 @@
+"""Run a scheduler job in several processes at once against one monitor.db,
+the way replicas with WORK_SHARDING do.
+
+    results = run_replicas("send_alerts", 3, workdir, batch_size=10)
+
+Each replica is a spawned process that chdirs into `workdir`, applies the
+config overrides (plus any extra keyword arguments), waits on a shared barrier so all start together and runs
+`scheduler.<job>()`. Returns each replica's lease owner id.
+"""
+import multiprocessing
+import os
+import sys
+import time
+
+_context = multiprocessing.get_context("spawn")
+
+
+def _replica(job, workdir, overrides, batch_delay, barrier, results):
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    os.chdir(workdir)
+    import config
+    config.LOG_DIR = os.path.join(workdir, "logs")
+    for name, value in overrides.items():
+        setattr(config, name, value)
+    import leasing
+    import scheduler
+
+    if batch_delay:
+        # Stands in for real work per batch, so replicas interleave their claims
+        complete = leasing.Leases.complete
+
+        def slow_complete(self, run_key, ids):
+            time.sleep(batch_delay)
+            complete(self, run_key, ids)
+
+        leasing.Leases.complete = slow_complete
+
+    barrier.wait()
+    getattr(scheduler, job)()
+    results.put(leasing.INSTANCE_ID)
+
+
+def run_replicas(job, count, workdir, batch_size=10, ttl=120, batch_delay=0.0, timeout=60, **config):
+    overrides = {"WORK_SHARDING": True, "LEASE_BATCH_SIZE": batch_size, "LEASE_TTL": ttl, "LEASE_POLL_INTERVAL": 0.2,
+                 **config}
+    barrier = _context.Barrier(count)
+    results = _context.Queue()
+    processes = [
+        _context.Process(target=_replica, args=(job, str(workdir), overrides, batch_delay, barrier, results))
+        for _ in range(count)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(timeout)
+        if process.is_alive():
+            process.terminate()
+            raise TimeoutError(f"replica running {job} did not finish within {timeout}s")
+        if process.exitcode != 0:
+            raise RuntimeError(f"replica running {job} exited with {process.exitcode}")
+    return [results.get(timeout=5) for _ in processes]
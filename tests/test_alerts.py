@@ -0,0 +1,99 @@
+from datetime import date, datetime, timedelta
+import pytest
+import alert_ledger
+import scheduler
+from database import get_db_connection
+from replicas import run_replicas
+
+TODAY = date(2026, 10, 18)
+TIERS = [10, 3, 1]
+
+
+def day(offset):
+    return (TODAY + timedelta(days=offset)).isoformat()
+
+
+def query(sql, params=()):
+    return get_db_connection().execute(sql, params).fetchall()
+
+
+def execute(sql, params=()):
+    conn = get_db_connection()
+    with conn:
+        conn.execute(sql, params)
+
+
+def add_license(name, expiry, email="ops@example.com"):
+    execute("INSERT INTO licenses (name, expiry_date, alert_email) VALUES (?, ?, ?)", (name, expiry, email))
+
+
+@pytest.fixture
+def frozen_today(monkeypatch):
+    class FrozenDatetime(datetime):
+        @classmethod
+        def utcnow(cls):
+            return cls(TODAY.year, TODAY.month, TODAY.day, 12)
+
+    monkeypatch.setattr(scheduler, "datetime", FrozenDatetime)
+
+
+def sent_subjects():
+    return [subject for subject, in query("SELECT subject FROM outbox ORDER BY id")]
+
+
+def test_current_tier():
+    assert [alert_ledger.current_tier(day(offset), TIERS, TODAY) for offset in (11, 10, 4, 3, 1, 0, -2)] == [
+        None, 10, 10, 3, 1, 1, 1]
+
+
+def test_alerts_once_per_tier_and_again_when_the_expiry_changes(db, frozen_today):
+    add_license("soon", day(8))
+    add_license("later", day(30))
+
+    scheduler.send_alerts()
+    assert sent_subjects() == ["License Expiry Warning: soon"]
+    assert query("SELECT item_id, expiry, tier FROM alert_state") == [(1, day(8), 10)]
+
+    # Nothing changed: nothing is sent again
+    scheduler.send_alerts()
+    assert len(sent_subjects()) == 1
+
+    # Entering the 3-day tier alerts again, and so does a renewal landing inside a tier
+    execute("UPDATE licenses SET expiry_date = ? WHERE id = 1", (day(2),))
+    scheduler.send_alerts()
+    execute("UPDATE licenses SET expiry_date = ? WHERE id = 2", (day(9),))
+    scheduler.send_alerts()
+    assert sent_subjects() == ["License Expiry Warning: soon"] * 2 + ["License Expiry Warning: later"]
+    assert query("SELECT item_id, expiry, tier FROM alert_state ORDER BY item_id") == [(1, day(2), 3), (2, day(9), 10)]
+
+
+def test_an_invalid_expiry_does_not_stop_the_others(db, frozen_today, caplog):
+    add_license("good", day(5))
+    # Not zero-padded: sorts inside the alert window as text, but is not an ISO date
+    add_license("bad", "2026-10-2")
+
+    scheduler.send_alerts()
+    assert sent_subjects() == ["License Expiry Warning: good"]
+    assert "invalid expiry date were not alerted (ids 2)" in caplog.text
+    assert query("SELECT item_id FROM alert_state") == [(1,)]
+
+
+def test_filter_pending_looks_up_only_the_candidates(db):
+    # More ledger entries than one lookup chunk, all for other items
+    conn = get_db_connection()
+    with conn:
+        alert_ledger.record(conn, "licenses", [(item_id, day(5), 10) for item_id in range(100, 1300)])
+        alert_ledger.record(conn, "licenses", [(1, day(5), 10)])
+    rows = [(1, "a", day(5), "x@example.com"), (2, "b", day(5), "x@example.com"), (1250, "c", day(2), "x@example.com")]
+    assert alert_ledger.filter_pending("licenses", rows, TIERS, TODAY) == rows[1:]
+
+
+def test_an_invalid_expiry_does_not_stop_sharded_replicas(db):
+    today = date.today()
+    add_license("good", (today + timedelta(days=5)).isoformat())
+    add_license("bad", f"{today.isoformat()}x")
+    run_replicas("send_alerts", 2, db, batch_size=1)
+    assert sent_subjects() == ["License Expiry Warning: good"]
+    # The bad row's lease is still completed, so replicas don't keep claiming it
+    assert query("SELECT item_id, done FROM work_leases WHERE job = 'license_alerts' ORDER BY item_id") == [
+        (1, 1), (2, 1)]
@@ -0,0 +1,45 @@
+import os
+import shutil
+from cert_discovery import discover
+from database import get_db_connection
+
+CERTS = os.path.join(os.path.dirname(__file__), "fixtures", "certs")
+
+
+def services():
+    conn = get_db_connection()
+    try:
+        return conn.execute("SELECT url, certificate_expiry FROM services ORDER BY url").fetchall()
+    finally:
+        conn.close()
+
+
+def test_incremental_discovery(db, monkeypatch):
+    certs = db / "certs"
+    certs.mkdir()
+    shutil.copy(os.path.join(CERTS, "bundle.pem"), certs)
+    shutil.copy(os.path.join(CERTS, "utc.der"), certs)
+
+    stats = discover([str(certs)], alert_email="ops@example.com", workers=1)
+    assert (stats["changed"], stats["certificates"]) == (2, 3)
+    assert [expiry for _, expiry in services()] == ["2027-11-22", "2126-09-24", "2036-10-15"]
+
+    # Unchanged files are skipped on their stat alone
+    assert discover([str(certs)], alert_email="ops@example.com", workers=1)["changed"] == 0
+
+    # A touched file with the same content is hashed but not parsed
+    def parse_der(der):
+        raise AssertionError("unchanged file was parsed")
+
+    os.utime(certs / "utc.der", ns=(1, 1))
+    with monkeypatch.context() as m:
+        m.setattr("local_certs.parse_der", parse_der)
+        stats = discover([str(certs)], alert_email="ops@example.com", workers=1)
+    assert (stats["touched"], stats["changed"]) == (1, 0)
+
+    # Dropping a certificate from the bundle and deleting a file remove their services
+    shutil.copy(os.path.join(CERTS, "v1.pem"), certs / "bundle.pem")
+    os.remove(certs / "utc.der")
+    stats = discover([str(certs)], alert_email="ops@example.com", workers=1)
+    assert stats["removed"] == 1
+    assert [expiry for _, expiry in services()] == ["2027-11-22"]
@@ -0,0 +1,50 @@
+import socket
+import time
+from datetime import datetime
+import pytest
+import certificate_utils
+from certificate_utils import ProbeCache
+from database import get_db_connection
+from scan_engine import probe_service, store_results
+
+EXPIRY = datetime(2030, 1, 1)
+
+
+def test_warm_up_loads_the_newest_entries(db):
+    now = time.time()
+    conn = get_db_connection()
+    with conn:
+        conn.executemany("INSERT INTO probe_cache (hostname, port, sni, expiry, checked_at) VALUES (?, 443, ?, ?, ?)",
+                         [(f"h{i}", f"h{i}", f"2030-01-0{i + 1} 00:00:00", now - 100 + i) for i in range(5)])
+    conn.close()
+
+    cache = ProbeCache(ttl=3600, max_entries=2, persist=True)
+    cache._load()
+    assert list(cache._entries) == [("h3", 443, "h3"), ("h4", 443, "h4")]
+
+
+def test_cached_result_keeps_the_measured_handshake_time(db, monkeypatch):
+    monkeypatch.setattr(certificate_utils, "probe_cache", ProbeCache(ttl=3600, max_entries=10))
+    monkeypatch.setattr(certificate_utils, "_probe_expiry", lambda *args: time.sleep(0.05) or EXPIRY)
+    conn = get_db_connection()
+    with conn:
+        conn.executemany("INSERT INTO services (name, url, alert_email) VALUES (?, ?, ?)",
+                         [("a", "https://host.test/a", "ops@example.com"), ("b", "https://host.test/b", "ops@example.com")])
+    conn.close()
+
+    first = probe_service(1, "https://host.test/a")
+    second = probe_service(2, "https://host.test/b")
+    assert first["latency_ms"] >= 50 and second["latency_ms"] is None
+    list(store_results([first, second]))
+    # b has never been measured; it doesn't inherit a fake ~0ms handshake
+    conn = get_db_connection()
+    assert conn.execute("SELECT handshake_ms IS NULL FROM services ORDER BY id").fetchall() == [(0,), (1,)]
+    conn.close()
+
+
+def test_slow_dns_counts_against_the_probe_timeout(monkeypatch):
+    monkeypatch.setattr(socket, "getaddrinfo", lambda *args, **kwargs: time.sleep(1))
+    started = time.monotonic()
+    with pytest.raises(TimeoutError, match="DNS"):
+        certificate_utils._probe_expiry("slow.test", 443, "slow.test", 0.2)
+    assert time.monotonic() - started < 0.5
@@ -0,0 +1,41 @@
+import json
+from flask import Flask, request
+from routes.importing import open_records, run_import
+from routes.licenses import _import_license
+from routes.services import _import_service, validate_service
+
+app = Flask(__name__)
+
+
+def import_rows(body, import_row, content_type="text/csv"):
+    with app.test_request_context("/import", method="POST", data=body, content_type=content_type):
+        response = run_import(open_records(request), import_row)
+        return [json.loads(line) for line in "".join(response.response).splitlines()]
+
+
+def test_null_and_non_string_fields_are_rejected():
+    for name in (None, 123, "   "):
+        fields, error = validate_service({"name": name, "url": "https://a.test", "alert_email": "ops@example.com"})
+        assert fields is None and "non-empty strings" in error
+
+
+def test_short_csv_rows_do_not_create_services_named_none(db):
+    lines = import_rows(b"name,url,alert_email\nshort,https://short.test\n", _import_service)
+    assert lines[0]["status"] == "error" and "non-empty strings" in lines[0]["error"]
+    lines = import_rows(b"name,expiry_date,alert_email\nshort\n", _import_license)
+    assert lines[0]["status"] == "error"
+
+
+def test_csv_with_byte_order_mark(db):
+    lines = import_rows("\ufeffname,url,alert_email\nExcel,https://excel.test,ops@example.com\n".encode(),
+                        _import_service)
+    assert lines[0]["status"] == "created"
+
+
+def test_license_ids_must_be_integers(db):
+    lines = import_rows(b"name,expiry_date,alert_email\nfirst,2030-01-01,ops@example.com\n", _import_license)
+    assert lines[0] == {"line": 2, "status": "created", "id": 1}
+    lines = import_rows(b"id,name,expiry_date,alert_email\n1.0,renamed,2030-01-01,ops@example.com\n"
+                        b"1,renamed,2030-01-02,ops@example.com\n", _import_license)
+    assert lines[0]["status"] == "error" and "integer" in lines[0]["error"]
+    assert lines[1] == {"line": 3, "status": "updated", "id": 1}
@@ -0,0 +1,22 @@
+import time
+from config import OUTBOX_SENT_RETENTION
+from database import get_db_connection
+from mail_queue import enqueue_many
+
+
+def test_enqueue_purges_old_delivered_mail(db):
+    old = time.time() - OUTBOX_SENT_RETENTION - 60
+    conn = get_db_connection()
+    with conn:
+        conn.executemany(
+            "INSERT INTO outbox (recipients, subject, body, status, created_at, next_attempt_at, sent_at) "
+            "VALUES ('a@example.com', ?, '', ?, ?, ?, ?)",
+            [("old sent", "sent", old, old, old), ("recent sent", "sent", time.time(), time.time(), time.time()),
+             ("old dead", "dead", old, old, None)]
+        )
+
+    with conn:
+        assert enqueue_many([(["b@example.com"], "new", "body"), ([], "nobody", "body")], conn) == 1
+
+    subjects = [row[0] for row in conn.execute("SELECT subject FROM outbox ORDER BY id")]
+    assert subjects == ["recent sent", "old dead", "new"]
@@ -0,0 +1,39 @@
+import sqlite3
+import pytest
+import database
+from database import MigrationError, close_thread_connections, get_db_connection, init_db
+
+
+@pytest.fixture
+def legacy_db(tmp_path, monkeypatch):
+    # A monitor.db as the app left it before versioned migrations
+    monkeypatch.chdir(tmp_path)
+    close_thread_connections()
+    conn = sqlite3.connect(database.DATABASE_PATH)
+    database._migrate_base_schema(conn.cursor())
+    yield conn
+    conn.close()
+    close_thread_connections()
+
+
+def test_unpadded_expiry_dates_are_normalized(legacy_db):
+    with legacy_db:
+        legacy_db.executemany("INSERT INTO licenses (name, expiry_date, alert_email) VALUES (?, ?, ?)",
+                              [("a", "2026-10-2", "a@example.com"), ("b", "2027-01-15", "b@example.com")])
+        legacy_db.execute("INSERT INTO services (name, url, alert_email, certificate_expiry) VALUES (?, ?, ?, ?)",
+                          ("s", "https://s.test", "s@example.com", "2026-1-5"))
+    init_db()
+
+    conn = get_db_connection()
+    assert conn.execute("SELECT expiry_date FROM licenses ORDER BY id").fetchall() == [("2026-10-02",), ("2027-01-15",)]
+    assert conn.execute("SELECT certificate_expiry FROM services").fetchall() == [("2026-01-05",)]
+
+
+def test_unparseable_expiry_dates_stop_the_migration(legacy_db):
+    with legacy_db:
+        legacy_db.executemany("INSERT INTO licenses (name, expiry_date, alert_email) VALUES (?, ?, ?)",
+                              [("a", "2026-10-02", "a@example.com"), ("b", "next spring", "b@example.com")])
+    with pytest.raises(MigrationError, match=r"licenses.expiry_date \(ids 2\)"):
+        init_db()
+    # Migration 2 stays unapplied until the row is fixed
+    assert legacy_db.execute("PRAGMA user_version").fetchone()[0] == 1
@@ -0,0 +1,49 @@
+import json
+from datetime import datetime
+import pytest
+import certificate_utils
+import scan_cli
+from database import get_db_connection
+
+
+def test_upsert_reports_conflicting_rows_and_keeps_the_rest(db, tmp_path, monkeypatch, capsys):
+    monkeypatch.setattr(certificate_utils, "_probe_expiry", lambda *args: datetime(2030, 1, 1))
+    # main() swaps in its own cache; put the module's back afterwards
+    monkeypatch.setattr(certificate_utils, "probe_cache", certificate_utils.probe_cache)
+    conn = get_db_connection()
+    with conn:
+        # Named like the URL the CLI derives for a.test, which it uses as the new row's name
+        conn.execute("INSERT INTO services (name, url, alert_email) VALUES (?, ?, ?)",
+                     ("https://a.test", "https://a.test/health", "ops@example.com"))
+    hosts = tmp_path / "hosts.txt"
+    hosts.write_text("A.test\nB.Test:8443\nc.test\n")
+
+    assert scan_cli.main([str(hosts), "--upsert", "--alert-email", "ops@example.com"]) == 1
+
+    err = capsys.readouterr().err
+    assert "https://a.test: not upserted" in err
+    assert "3 ok, 0 failed, 0 rejected, 1 not upserted" in err
+    conn = get_db_connection()
+    rows = conn.execute("SELECT url, certificate_expiry FROM services ORDER BY url").fetchall()
+    assert rows == [("https://a.test/health", None), ("https://b.test:8443", "2030-01-01"),
+                    ("https://c.test", "2030-01-01")]
+
+
+def test_bad_ports_are_rejected_lines(tmp_path, monkeypatch, capsys):
+    monkeypatch.setattr(certificate_utils, "_probe_expiry", lambda *args: datetime(2030, 1, 1))
+    monkeypatch.setattr(certificate_utils, "probe_cache", certificate_utils.probe_cache)
+    hosts = tmp_path / "hosts.txt"
+    hosts.write_text("host:abc\nhost:70000\nhost:0\nok.test:8443\n")
+
+    assert scan_cli.main([str(hosts)]) == 1
+
+    out, err = capsys.readouterr()
+    assert [json.loads(line)["url"] for line in out.splitlines()] == ["https://ok.test:8443"]
+    assert "1 ok, 0 failed, 3 rejected" in err
+
+
+def test_upsert_requires_an_alert_email(capsys):
+    with pytest.raises(SystemExit) as exit_info:
+        scan_cli.main(["-", "--upsert"])
+    assert exit_info.value.code == 2
+    assert "--upsert needs --alert-email" in capsys.readouterr().err
@@ -0,0 +1,25 @@
+import time
+from datetime import datetime
+import certificate_utils
+from database import get_db_connection
+from scan_engine import ScanSummary, iter_scan, store_results
+
+
+def test_services_cut_off_by_the_deadline_are_not_recorded_as_failures(db, monkeypatch):
+    monkeypatch.setattr(certificate_utils, "probe_cache", certificate_utils.ProbeCache(ttl=0, max_entries=10))
+    monkeypatch.setattr(certificate_utils, "_probe_expiry", lambda *args: time.sleep(0.5) or datetime(2030, 1, 1))
+    conn = get_db_connection()
+    with conn:
+        conn.executemany("INSERT INTO services (name, url, alert_email, next_check_at) VALUES (?, ?, ?, ?)",
+                         [(f"s{i}", f"https://s{i}.test", "ops@example.com", "2020-01-01 00:00:00")
+                          for i in range(4)])
+
+    summary = ScanSummary("test")
+    services = [(i + 1, f"https://s{i}.test") for i in range(4)]
+    for result in store_results(iter_scan(services, max_in_flight=2, run_deadline=0.1)):
+        assert result["error_class"] == "deadline"
+        summary.add(result)
+
+    assert (summary.failed, summary.skipped) == (0, 4)
+    rows = conn.execute("SELECT last_checked, last_error, consecutive_failures, next_check_at FROM services").fetchall()
+    assert rows == [(None, None, 0, "2020-01-01 00:00:00")] * 4
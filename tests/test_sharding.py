@@ -0,0 +1,94 @@
+import os
+import time
+from datetime import date, timedelta
+from database import get_db_connection
+from replicas import run_replicas
+
+CERTS = os.path.join(os.path.dirname(__file__), "fixtures", "certs")
+
+
+def query(sql, params=()):
+    conn = get_db_connection()
+    try:
+        return conn.execute(sql, params).fetchall()
+    finally:
+        conn.close()
+
+
+def seed_expiring(count):
+    expiry = (date.today() + timedelta(days=2)).isoformat()
+    conn = get_db_connection()
+    with conn:
+        conn.executemany("INSERT INTO licenses (name, expiry_date, alert_email) VALUES (?, ?, ?)",
+                         [(f"license {i}", expiry, f"owner{i}@example.com") for i in range(count)])
+        conn.executemany("INSERT INTO services (name, url, alert_email, certificate_expiry) VALUES (?, ?, ?, ?)",
+                         [(f"service {i}", f"https://s{i}.example.com", f"owner{i}@example.com", expiry)
+                          for i in range(count)])
+
+
+def test_alert_replicas_split_the_work_and_alert_once(db):
+    seed_expiring(200)
+    owners = run_replicas("send_alerts", 3, db, batch_size=10, batch_delay=0.02)
+
+    assert query("SELECT COUNT(*), COUNT(DISTINCT subject) FROM outbox") == [(400, 400)]
+    assert query("SELECT kind, COUNT(*) FROM alert_state GROUP BY kind ORDER BY kind") == [
+        ("licenses", 200), ("services", 200)]
+    claimed_by = {owner for owner, in query("SELECT DISTINCT owner FROM work_leases WHERE done = 1")}
+    assert len(claimed_by) > 1 and claimed_by <= set(owners)
+
+    # A second run finds nothing new to alert
+    run_replicas("send_alerts", 2, db)
+    assert query("SELECT COUNT(*) FROM outbox") == [(400,)]
+
+
+def test_rows_of_a_crashed_replica_are_taken_over_in_the_same_run(db):
+    seed_expiring(30)
+    # A replica claimed the first batch of licenses, then died before alerting them
+    conn = get_db_connection()
+    with conn:
+        conn.executemany(
+            "INSERT INTO work_leases (job, run_key, item_id, owner, lease_until, done) VALUES (?, ?, ?, ?, ?, 0)",
+            [("license_alerts", date.today().isoformat(), item_id, "crashed", time.time() + 1)
+             for item_id in range(1, 11)]
+        )
+
+    started = time.monotonic()
+    run_replicas("send_alerts", 1, db, ttl=1)
+    assert time.monotonic() - started < 20
+    assert query("SELECT COUNT(*) FROM alert_state WHERE kind = 'licenses'") == [(30,)]
+    assert query("SELECT COUNT(*) FROM work_leases WHERE owner = 'crashed'") == [(0,)]
+
+
+def seed_cert_files(count):
+    # file:// certificates, so the scan needs no network
+    path = os.path.join(CERTS, "bundle.pem")
+    conn = get_db_connection()
+    with conn:
+        conn.executemany("INSERT INTO services (name, url, alert_email) VALUES (?, ?, ?)",
+                         [(f"cert {i}", f"file://{path}?{i}#{i % 2}", "ops@example.com") for i in range(count)])
+
+
+def test_scan_replicas_split_the_services(db):
+    seed_cert_files(120)
+
+    run_replicas("check_cert_expiry", 2, db, batch_size=10, batch_delay=0.02)
+
+    assert query("SELECT COUNT(*) FROM services WHERE last_checked IS NULL OR last_error IS NOT NULL") == [(0,)]
+    assert query("SELECT certificate_expiry, COUNT(*) FROM services GROUP BY 1 ORDER BY 1") == [
+        ("2027-11-22", 60), ("2126-09-24", 60)]
+    assert len(query("SELECT DISTINCT owner FROM work_leases WHERE job = 'cert_scan' AND done = 1")) == 2
+
+
+def test_scan_replica_past_its_deadline_releases_what_it_did_not_probe(db):
+    seed_cert_files(120)
+    run_replicas("check_cert_expiry", 1, db, batch_size=10, batch_delay=0.2, SCAN_RUN_DEADLINE=0.5)
+
+    checked = query("SELECT COUNT(*) FROM services WHERE last_checked IS NOT NULL")[0][0]
+    assert 0 < checked < 120
+    # Only probed rows are done; nothing is left claimed, and nothing was recorded as failed
+    assert query("SELECT done, COUNT(*) FROM work_leases WHERE job = 'cert_scan' GROUP BY done") == [(1, checked)]
+    assert query("SELECT COUNT(*) FROM services WHERE last_error IS NOT NULL") == [(0,)]
+
+    # A replica still running the same day picks up the rest
+    run_replicas("check_cert_expiry", 1, db, batch_size=10)
+    assert query("SELECT COUNT(*) FROM services WHERE last_checked IS NULL") == [(0,)]
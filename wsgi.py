@@ -0,0 +1,9 @@
+# Production entry point, e.g.: gunicorn -c gunicorn.conf.py wsgi:app
+from app import create_app
+from leader import run_scheduler_when_leader
+
+app = create_app()
+
+# Every worker imports this module; only the one holding the leader lock runs
+# background jobs, the rest serve HTTP only and take over if the leader dies.
+run_scheduler_when_leader()